@@ -1,12 +1,50 @@
-from flask import Flask, request, jsonify
+from flask import Blueprint, Flask, Response, current_app, request, jsonify, send_file
 from flask_cors import CORS
-from database import get_connection, init_database
+import metrics
+from archive import (
+    archive_page, archiver, build_archived_alerts_query, build_archived_visits_query, wants_archive
+)
+from bulk_import import (
+    INSERT_ALERT_SQL, alert_rows, import_patients, parse_age, parse_date, text_field
+)
+from cache import cache
+from change_feed import CursorExpired, create_hub, parse_cursor, record_event, sse_message
+from compression import compress_response, etag_matches
+from database import db_connection, get_pool, init_database, stream_rows
+from emr_history import (
+    HISTORY_PAGE_SIZE, INSERT_HISTORY_SQL, LAST_HISTORY_VERSION_SQL, LAST_HISTORY_VERSIONS_SQL,
+    SELECT_HISTORY_SQL, SELECT_VERSION_CHAIN_SQL, chain_params, history_params, insert_history_rows,
+    json_delta, load_data, rebuild_version, serialize_history_entry
+)
+from json_provider import FastJSONProvider, format_time, iter_json_array, raw_json
+from patient_ids import new_patient_id
+from photos import store_photo
+from search import build_search_query, parse_search_args, search_page
 from config import config
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
+import base64
+import io
 import json
+import threading
+from urllib.parse import quote
+from werkzeug.http import parse_etags
+from werkzeug.wsgi import ClosingIterator
 
-app = Flask(__name__)
-CORS(app)  # Enable CORS for React frontend
+# All API routes live on this blueprint; create_app() builds the Flask app around it
+api = Blueprint('api', __name__)
+
+def photo_url(patient_id, photo_hash):
+    """Versioned URL of a patient's photo; the version changes whenever the photo does"""
+    return f"/api/patients/{quote(str(patient_id), safe='')}/photo?v={photo_hash[:16]}"
+
+# Column types stored as strings, so rows can be cached and compared as JSON;
+# an exact type lookup is cheaper per value than isinstance() checks
+TEMPORAL_CONVERTERS = {
+    datetime: datetime.isoformat,
+    date: date.isoformat,
+    # MySQL TIME columns (e.g. visit_time) come back as timedeltas
+    timedelta: format_time,
+}
 
 # Helper function to serialize dates
 def serialize_patient(patient):
@@ -14,103 +52,319 @@ def serialize_patient(patient):
         return None
     result = dict(patient)
     for key, value in result.items():
-        if isinstance(value, (datetime, date)):
-            result[key] = value.isoformat()
+        convert = TEMPORAL_CONVERTERS.get(type(value))
+        if convert is not None:
+            result[key] = convert(value)
+    # Search-only generated column
+    result.pop('mobile_rev', None)
+    if 'photo_hash' in result:
+        # Photos are served separately; rows not yet migrated keep their inline photo
+        photo_hash = result.pop('photo_hash')
+        if photo_hash:
+            result.pop('photo', None)
+            result['photo_url'] = photo_url(result['id'], photo_hash)
+        else:
+            result['photo_url'] = None
     return result
 
+# Columns shown in the patient queue; photo and other bulky fields are left out
+QUEUE_COLUMNS = """
+    p.id, p.mr_number, p.name, p.parent_info, p.age, p.gender, p.mobile,
+    p.purpose, p.visit_type, p.assigned_to, p.last_visit_date, p.last_clinic,
+    p.status, p.visit_count, p.photo_hash, p.created_at, p.updated_at
+"""
+
+# Query parameters that filter the queue, mapped to their columns
+QUEUE_FILTERS = {
+    'status': 'p.status',
+    'assigned_to': 'p.assigned_to',
+    'last_clinic': 'p.last_clinic'
+}
+
+# Pushes queue rows to connected screens as patients change
+changes = create_hub(QUEUE_COLUMNS, serialize_patient)
+
+QUEUE_PAGE_SIZE = 50
+QUEUE_MAX_PAGE_SIZE = 200
+
+def encode_cursor(created_at, patient_id):
+    """Encode a (created_at, id) keyset position as an opaque cursor"""
+    raw = json.dumps([created_at.isoformat(), patient_id])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    """Decode a cursor from encode_cursor(), raising ValueError if malformed"""
+    try:
+        created_at, patient_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return datetime.fromisoformat(created_at), str(patient_id)
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+def build_queue_query(args):
+    """Build the SQL for one queue page from request args.
+
+    Returns (sql, params, limit); raises ValueError for bad arguments.
+    """
+    try:
+        limit = min(max(int(args.get('limit', QUEUE_PAGE_SIZE)), 1), QUEUE_MAX_PAGE_SIZE)
+    except ValueError:
+        raise ValueError('limit must be an integer')
+
+    conditions = []
+    params = []
+    for arg, column in QUEUE_FILTERS.items():
+        value = args.get(arg)
+        if value:
+            conditions.append(f"{column} = %s")
+            params.append(value)
+
+    cursor_arg = args.get('cursor')
+    if cursor_arg:
+        after_created_at, after_id = decode_cursor(cursor_arg)
+        conditions.append("(p.created_at < %s OR (p.created_at = %s AND p.id < %s))")
+        params.extend([after_created_at, after_created_at, after_id])
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    # Fetch one extra row to know whether another page exists
+    sql = f"""
+        SELECT {QUEUE_COLUMNS}
+        FROM patients p
+        {where}
+        ORDER BY p.created_at DESC, p.id DESC
+        LIMIT %s
+    """
+    return sql, (*params, limit + 1), limit
+
+def queue_page(patients, limit):
+    """Build the queue response body from up to limit + 1 fetched rows"""
+    next_cursor = None
+    if len(patients) > limit:
+        patients = patients[:limit]
+        last = patients[-1]
+        next_cursor = encode_cursor(last['created_at'], last['id'])
+    return {
+        'patients': [serialize_patient(p) for p in patients],
+        'next_cursor': next_cursor
+    }
+
+def get_patient_queue():
+    """Get one page of the patient queue, newest first, without photos"""
+    try:
+        sql, params, limit = build_queue_query(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        with db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(sql, params)
+                patients = cursor.fetchall()
+        return jsonify(queue_page(patients, limit))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 # ============== PATIENT ENDPOINTS ==============
 
-@app.route('/api/patients', methods=['GET'])
+SELECT_ALL_PATIENTS_SQL = """
+    SELECT p.*
+    FROM patients p
+    ORDER BY p.created_at DESC
+"""
+
+@api.route('/api/patients', methods=['GET'])
 def get_all_patients():
-    """Get all patients"""
+    """Get all patients, or one queue page with ?view=queue"""
+    if request.args.get('view') == 'queue':
+        return get_patient_queue()
     try:
-        conn = get_connection()
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                SELECT p.*, 
-                       (SELECT COUNT(*) FROM visits WHERE patient_id = p.id) as visit_count
-                FROM patients p
-                ORDER BY p.created_at DESC
-            """)
-            patients = cursor.fetchall()
-        conn.close()
-        return jsonify([serialize_patient(p) for p in patients])
+        return stream_json(stream_rows(SELECT_ALL_PATIENTS_SQL), serialize_patient)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/patients/<patient_id>', methods=['GET'])
+# Related data that can be loaded together with a patient
+PATIENT_INCLUDES = ('visits', 'alerts', 'emr')
+DEFAULT_PATIENT_INCLUDES = ('visits', 'alerts')
+
+VISIT_HISTORY_LIMIT = 100
+VISIT_HISTORY_MAX_LIMIT = 500
+
+def serialize_emr_record(record):
+    """Convert an emr_records row into its API representation"""
+    return {
+        'id': record['id'],
+        # Stored JSON goes out as is, without a parse and re-dump
+        'data': raw_json(record['data']),
+        'created_at': record['created_at'].isoformat() if record['created_at'] else None,
+        'updated_at': record['updated_at'].isoformat() if record['updated_at'] else None,
+        'created_by': record['created_by']
+    }
+
+def entry_last_modified(entry):
+    """Last-Modified of a cache entry, truncated to HTTP date precision"""
+    last_modified = entry.get('last_modified')
+    if last_modified:
+        return datetime.fromisoformat(last_modified).replace(microsecond=0)
+    return None
+
+def is_not_modified(entry, if_none_match, if_modified_since):
+    """Whether the client's validators (parsed ETags / datetime) still match an entry"""
+    if if_none_match:
+        return etag_matches(if_none_match, entry['etag'])
+    last_modified = entry_last_modified(entry)
+    if last_modified and if_modified_since:
+        return last_modified <= if_modified_since.replace(tzinfo=None)
+    return False
+
+def stream_json(rows, serialize):
+    """Stream a RowStream as a JSON array; its connection is returned when the response closes"""
+    body = iter_json_array(rows, serialize, config.STREAM_BATCH_SIZE)
+    return current_app.response_class(ClosingIterator(body, rows.close), mimetype='application/json')
+
+def conditional_json(entry):
+    """Build a JSON response for a cached {'etag', 'last_modified', 'body'} entry.
+
+    Answers with 304 Not Modified, without serializing the body, when the
+    client's If-None-Match (or, failing that, If-Modified-Since) still matches.
+    """
+    if is_not_modified(entry, request.if_none_match, request.if_modified_since):
+        response = current_app.response_class(status=304)
+    else:
+        response = jsonify(entry['body'])
+    response.set_etag(entry['etag'])
+    last_modified = entry_last_modified(entry)
+    if last_modified:
+        response.last_modified = last_modified
+    # Clients may keep the body but must revalidate before using it
+    response.cache_control.no_cache = True
+    return response
+
+def emr_record_etag(patient_id, section_type, version):
+    """Strong ETag for one EMR section at a given row version"""
+    return f"emr-{patient_id}-{section_type}-v{version or 0}"
+
+def parse_patient_includes(args):
+    """Read ?include=visits,alerts,emr, raising ValueError for unknown names"""
+    include = args.get('include')
+    if include is None:
+        return DEFAULT_PATIENT_INCLUDES
+    names = tuple(name.strip() for name in include.split(',') if name.strip())
+    unknown = [name for name in names if name not in PATIENT_INCLUDES]
+    if unknown:
+        raise ValueError(f"Unknown include: {', '.join(unknown)}")
+    return names
+
+def parse_visit_limit(args):
+    """Read ?visit_limit=, clamped to VISIT_HISTORY_MAX_LIMIT"""
+    try:
+        limit = int(args.get('visit_limit', VISIT_HISTORY_LIMIT))
+    except ValueError:
+        raise ValueError('visit_limit must be an integer')
+    return min(max(limit, 1), VISIT_HISTORY_MAX_LIMIT)
+
+def patient_aggregate_query(key, by='id', include=DEFAULT_PATIENT_INCLUDES,
+                            visit_limit=VISIT_HISTORY_LIMIT):
+    """Build the multi-statement query for a patient and its related data.
+
+    Returns (sql, params); the patient row is the first result set, followed
+    by one result set per included relation, in PATIENT_INCLUDES order.
+    """
+    column = {'id': 'id', 'mr_number': 'mr_number'}[by]
+    # Related tables are keyed by patient id, so resolve MR numbers in SQL
+    patient_id_sql = "%s" if by == 'id' else "(SELECT id FROM patients WHERE mr_number = %s)"
+    
+    statements = [f"SELECT p.* FROM patients p WHERE p.{column} = %s"]
+    params = [key]
+    if 'visits' in include:
+        statements.append(f"""
+            SELECT * FROM visits
+            WHERE patient_id = {patient_id_sql}
+            ORDER BY visit_date DESC, visit_time DESC
+            LIMIT %s
+        """)
+        params.extend([key, visit_limit])
+    if 'alerts' in include:
+        statements.append(f"""
+            SELECT * FROM medical_alerts
+            WHERE patient_id = {patient_id_sql} AND is_active = TRUE
+        """)
+        params.append(key)
+    if 'emr' in include:
+        statements.append(f"SELECT * FROM emr_records WHERE patient_id = {patient_id_sql}")
+        params.append(key)
+    return ';'.join(statements), params
+
+def assemble_patient_aggregate(patient, related, include):
+    """Attach the related result sets from patient_aggregate_query() to the patient row"""
+    if patient is None:
+        return None
+    related = iter(related)
+    if 'visits' in include:
+        patient['visitHistory'] = [serialize_patient(v) for v in next(related)]
+    if 'alerts' in include:
+        patient['medicalAlerts'] = list(next(related))
+    if 'emr' in include:
+        patient['emr'] = {r['section_type']: serialize_emr_record(r) for r in next(related)}
+    return patient
+
+def load_patient_aggregate(cursor, key, by='id', include=DEFAULT_PATIENT_INCLUDES,
+                           visit_limit=VISIT_HISTORY_LIMIT):
+    """Load a patient and the requested related data in one round trip.
+
+    All statements are sent as a single multi-statement query and read back
+    result set by result set, so ``cursor`` must come from
+    ``db_connection(multi_statements=True)``. Returns None if the patient
+    does not exist.
+    """
+    cursor.execute(*patient_aggregate_query(key, by, include, visit_limit))
+    patient = cursor.fetchone()
+    # Always drain every result set so the connection stays in sync
+    related = []
+    while cursor.nextset():
+        related.append(cursor.fetchall())
+    return assemble_patient_aggregate(patient, related, include)
+
+def patient_cache_entry(patient_id, patient, include, variant):
+    """Wrap a loaded patient aggregate as a cache entry with its ETag"""
+    if patient is None:
+        return None
+    etag = f"patient-{patient_id}-v{patient['version']}-{variant}"
+    if 'emr' in include:
+        etag += f"-e{patient['emr_version']}"
+    patient = serialize_patient(patient)
+    return {'etag': etag, 'last_modified': patient['updated_at'], 'body': patient}
+
+@api.route('/api/patients/<patient_id>', methods=['GET'])
 def get_patient(patient_id):
-    """Get a single patient by ID"""
+    """Get a single patient by ID, with ?include=visits,alerts,emr"""
     try:
-        conn = get_connection()
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                SELECT p.*, 
-                       (SELECT COUNT(*) FROM visits WHERE patient_id = p.id) as visit_count
-                FROM patients p
-                WHERE p.id = %s
-            """, (patient_id,))
-            patient = cursor.fetchone()
-            
-            if patient:
-                # Get visit history
-                cursor.execute("""
-                    SELECT * FROM visits 
-                    WHERE patient_id = %s 
-                    ORDER BY visit_date DESC, visit_time DESC
-                """, (patient_id,))
-                visits = cursor.fetchall()
-                patient['visitHistory'] = [serialize_patient(v) for v in visits]
-                
-                # Get medical alerts
-                cursor.execute("""
-                    SELECT * FROM medical_alerts
-                    WHERE patient_id = %s AND is_active = TRUE
-                """, (patient_id,))
-                alerts = cursor.fetchall()
-                patient['medicalAlerts'] = alerts
-                
-        conn.close()
-        
-        if patient:
-            return jsonify(serialize_patient(patient))
+        include = parse_patient_includes(request.args)
+        visit_limit = parse_visit_limit(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    variant = f"{','.join(include)}:{visit_limit}"
+    
+    def load():
+        with db_connection(multi_statements=True) as conn:
+            with conn.cursor() as cursor:
+                patient = load_patient_aggregate(cursor, patient_id, include=include,
+                                                 visit_limit=visit_limit)
+        return patient_cache_entry(patient_id, patient, include, variant)
+    
+    try:
+        groups = ('patient', 'emr') if 'emr' in include else ('patient',)
+        entry = cache.get_or_load(patient_id, groups, variant, load)
+        if entry:
+            return conditional_json(entry)
         return jsonify({'error': 'Patient not found'}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/patients/mr/<mr_number>', methods=['GET'])
+@api.route('/api/patients/mr/<mr_number>', methods=['GET'])
 def get_patient_by_mr(mr_number):
     """Check if patient exists by MR number"""
     try:
-        conn = get_connection()
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                SELECT p.*, 
-                       (SELECT COUNT(*) FROM visits WHERE patient_id = p.id) as visit_count
-                FROM patients p
-                WHERE p.mr_number = %s
-            """, (mr_number,))
-            patient = cursor.fetchone()
-            
-            if patient:
-                # Get visit history
-                cursor.execute("""
-                    SELECT * FROM visits 
-                    WHERE patient_id = %s 
-                    ORDER BY visit_date DESC, visit_time DESC
-                """, (patient['id'],))
-                visits = cursor.fetchall()
-                patient['visitHistory'] = [serialize_patient(v) for v in visits]
-                
-                # Get medical alerts
-                cursor.execute("""
-                    SELECT * FROM medical_alerts
-                    WHERE patient_id = %s AND is_active = TRUE
-                """, (patient['id'],))
-                alerts = cursor.fetchall()
-                patient['medicalAlerts'] = alerts
-                
-        conn.close()
+        with db_connection(multi_statements=True) as conn:
+            with conn.cursor() as cursor:
+                patient = load_patient_aggregate(cursor, mr_number, by='mr_number')
         
         if patient:
             return jsonify({'exists': True, 'patient': serialize_patient(patient)})
@@ -118,322 +372,987 @@ def get_patient_by_mr(mr_number):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/patients', methods=['POST'])
+@api.route('/api/patients/search', methods=['GET'])
+def search_patients():
+    """Ranked search by name, mobile number ending or MR number, with ?q=&page=&limit="""
+    try:
+        q, page, limit = parse_search_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        sql, params = build_search_query(QUEUE_COLUMNS, q, page, limit)
+        with db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(sql, params)
+                rows = cursor.fetchall()
+        return jsonify(search_page(rows, page, limit, serialize_patient))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/api/patients', methods=['POST'])
 def create_patient():
     """Create a new patient"""
     try:
         data = request.json
-        patient_id = f"P{int(datetime.now().timestamp() * 1000) % 1000000}"
+        patient_id = new_patient_id()
         
-        conn = get_connection()
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                INSERT INTO patients (
-                    id, mr_number, name, parent_info, age, gender, dob, 
-                    mobile, city, state, photo, purpose, visit_type,
-                    allergies, conditions, assigned_to, status
-                ) VALUES (
-                    %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
-                )
-            """, (
-                patient_id,
-                data.get('mrNumber'),
-                data.get('name'),
-                data.get('parentInfo'),
-                data.get('age'),
-                data.get('gender'),
-                data.get('dob') or None,
-                data.get('mobile'),
-                data.get('city'),
-                data.get('state'),
-                data.get('photo'),
-                data.get('purpose'),
-                data.get('visitType', 'N'),
-                data.get('allergies'),
-                data.get('conditions'),
-                data.get('assignedTo', 'Unassigned'),
-                data.get('status', 'Waiting')
-            ))
-            
-            # Create initial visit record
-            cursor.execute("""
-                INSERT INTO visits (patient_id, visit_date, visit_time, visit_type, purpose, clinic, location)
-                VALUES (%s, CURDATE(), CURTIME(), %s, %s, %s, %s)
-            """, (
-                patient_id,
-                data.get('visitType', 'N'),
-                data.get('purpose'),
-                data.get('clinic', 'CHN'),
-                data.get('location', 'Chennai')
-            ))
-            
-            # Add medical alerts if provided
-            if data.get('allergies'):
-                for allergy in data.get('allergies', '').split(','):
-                    if allergy.strip():
-                        cursor.execute("""
-                            INSERT INTO medical_alerts (patient_id, alert_type, alert_value)
-                            VALUES (%s, 'allergy', %s)
-                        """, (patient_id, allergy.strip()))
+        with db_connection() as conn:
+            with conn.cursor() as cursor:
+                photo_hash = store_photo(cursor, data.get('photo'))
+                cursor.execute("""
+                    INSERT INTO patients (
+                        id, mr_number, name, parent_info, age, gender, dob, 
+                        mobile, city, state, photo_hash, purpose, visit_type,
+                        allergies, conditions, assigned_to, status,
+                        visit_count, last_visit_date, last_clinic
+                    ) VALUES (
+                        %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
+                        1, CURDATE(), %s
+                    )
+                """, (
+                    patient_id,
+                    data.get('mrNumber'),
+                    data.get('name'),
+                    data.get('parentInfo'),
+                    data.get('age'),
+                    data.get('gender'),
+                    data.get('dob') or None,
+                    data.get('mobile'),
+                    data.get('city'),
+                    data.get('state'),
+                    photo_hash,
+                    data.get('purpose'),
+                    data.get('visitType', 'N'),
+                    data.get('allergies'),
+                    data.get('conditions'),
+                    data.get('assignedTo', 'Unassigned'),
+                    data.get('status', 'Waiting'),
+                    data.get('clinic', 'CHN')
+                ))
             
-            if data.get('conditions'):
-                for condition in data.get('conditions', '').split(','):
-                    if condition.strip():
-                        cursor.execute("""
-                            INSERT INTO medical_alerts (patient_id, alert_type, alert_value)
-                            VALUES (%s, 'condition', %s)
-                        """, (patient_id, condition.strip()))
+                # Create initial visit record (already counted in visit_count above)
+                cursor.execute("""
+                    INSERT INTO visits (patient_id, visit_date, visit_time, visit_type, purpose, clinic, location)
+                    VALUES (%s, CURDATE(), CURTIME(), %s, %s, %s, %s)
+                """, (
+                    patient_id,
+                    data.get('visitType', 'N'),
+                    data.get('purpose'),
+                    data.get('clinic', 'CHN'),
+                    data.get('location', 'Chennai')
+                ))
             
-            conn.commit()
-        conn.close()
+                # Add medical alerts if provided, as one multi-row insert
+                alerts = alert_rows(patient_id, data.get('allergies'), data.get('conditions'))
+                if alerts:
+                    cursor.executemany(INSERT_ALERT_SQL, alerts)
+                
+                record_event(cursor, patient_id, 'patient.created')
+                conn.commit()
         
+        changes.notify()
         return jsonify({'id': patient_id, 'message': 'Patient created successfully'}), 201
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/api/patients/import', methods=['POST'])
+def bulk_import_patients():
+    """Bulk import patients from an NDJSON or CSV request body"""
+    fmt = request.args.get('format') or ('csv' if request.mimetype == 'text/csv' else 'ndjson')
+    if fmt not in ('ndjson', 'csv'):
+        return jsonify({'error': f"Unsupported format: {fmt}"}), 400
+    try:
+        # Read the body as a stream so large files are never held in memory
+        stream = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+        result = import_patients(stream, fmt, on_commit=changes.notify)
+        return jsonify(result.to_dict())
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/patients/<patient_id>', methods=['PUT'])
+@api.route('/api/patients/<patient_id>', methods=['PUT'])
 def update_patient(patient_id):
     """Update a patient"""
     try:
         data = request.json
-        conn = get_connection()
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                UPDATE patients SET
-                    name = %s, parent_info = %s, age = %s, gender = %s,
-                    dob = %s, mobile = %s, city = %s, state = %s,
-                    photo = %s, purpose = %s, visit_type = %s,
-                    allergies = %s, conditions = %s, assigned_to = %s, status = %s
-                WHERE id = %s
-            """, (
-                data.get('name'),
-                data.get('parentInfo'),
-                data.get('age'),
-                data.get('gender'),
-                data.get('dob') or None,
-                data.get('mobile'),
-                data.get('city'),
-                data.get('state'),
-                data.get('photo'),
-                data.get('purpose'),
-                data.get('visitType'),
-                data.get('allergies'),
-                data.get('conditions'),
-                data.get('assignedTo'),
-                data.get('status'),
-                patient_id
-            ))
-            conn.commit()
-        conn.close()
+        photo = data.get('photo')
+        with db_connection() as conn:
+            with conn.cursor() as cursor:
+                photo_hash = store_photo(cursor, photo)
+                # A photo URL sent back unchanged keeps the stored photo
+                keep_photo = photo_hash is None and bool(photo)
+                cursor.execute("""
+                    UPDATE patients SET
+                        name = %s, parent_info = %s, age = %s, gender = %s,
+                        dob = %s, mobile = %s, city = %s, state = %s,
+                        photo = NULL, photo_hash = IF(%s, photo_hash, %s),
+                        purpose = %s, visit_type = %s,
+                        allergies = %s, conditions = %s, assigned_to = %s, status = %s,
+                        version = version + 1
+                    WHERE id = %s
+                """, (
+                    data.get('name'),
+                    data.get('parentInfo'),
+                    data.get('age'),
+                    data.get('gender'),
+                    data.get('dob') or None,
+                    data.get('mobile'),
+                    data.get('city'),
+                    data.get('state'),
+                    keep_photo,
+                    photo_hash,
+                    data.get('purpose'),
+                    data.get('visitType'),
+                    data.get('allergies'),
+                    data.get('conditions'),
+                    data.get('assignedTo'),
+                    data.get('status'),
+                    patient_id
+                ))
+                record_event(cursor, patient_id, 'patient.updated')
+                conn.commit()
         
+        cache.invalidate(patient_id, 'patient')
+        changes.notify()
         return jsonify({'message': 'Patient updated successfully'})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Request fields a PATCH may change, mapped to their columns (photo is handled separately)
+PATIENT_PATCH_FIELDS = {
+    'name': 'name',
+    'parentInfo': 'parent_info',
+    'age': 'age',
+    'gender': 'gender',
+    'dob': 'dob',
+    'mobile': 'mobile',
+    'city': 'city',
+    'state': 'state',
+    'purpose': 'purpose',
+    'visitType': 'visit_type',
+    'allergies': 'allergies',
+    'conditions': 'conditions',
+    'assignedTo': 'assigned_to',
+    'status': 'status'
+}
+
+# Longest value each text field's column holds
+PATIENT_TEXT_LENGTHS = {
+    'name': 255, 'parentInfo': 255, 'gender': 20, 'mobile': 20, 'city': 100, 'state': 100,
+    'purpose': 255, 'visitType': 10, 'allergies': 65535, 'conditions': 65535, 'assignedTo': 255
+}
+
+# Fields whose columns are NOT NULL, so a PATCH may change but not clear them
+PATIENT_PATCH_REQUIRED = {'name'}
+
+# Queue states the patient list knows
+PATIENT_STATUSES = ('Waiting', 'Assigned', 'Completed')
+
+def patient_patch_value(data, field):
+    """Check one PATCH field and convert it for its column, raising ValueError if invalid"""
+    if field == 'age':
+        return parse_age(data[field])
+    if field == 'dob':
+        return parse_date(field, data[field])
+    if field == 'status':
+        if data[field] not in PATIENT_STATUSES:
+            raise ValueError(f"status must be one of: {', '.join(PATIENT_STATUSES)}")
+        return data[field]
+    return text_field(data, field, PATIENT_TEXT_LENGTHS[field], required=field in PATIENT_PATCH_REQUIRED)
+
+def patient_patch_assignments(cursor, data):
+    """Build SET clauses and params for the fields present in a PATCH body"""
+    if not isinstance(data, dict) or not data:
+        raise ValueError('Request body must be a non-empty JSON object')
+    unknown = [field for field in data if field not in PATIENT_PATCH_FIELDS and field != 'photo']
+    if unknown:
+        raise ValueError(f"Unknown field: {', '.join(unknown)}")
+
+    assignments = []
+    params = []
+    for field, column in PATIENT_PATCH_FIELDS.items():
+        if field in data:
+            assignments.append(f"{column} = %s")
+            params.append(patient_patch_value(data, field))
+    if 'photo' in data:
+        photo_hash = store_photo(cursor, data['photo'])
+        # A photo URL sent back unchanged keeps the stored photo; null removes it
+        if photo_hash is not None or not data['photo']:
+            assignments.append("photo = NULL, photo_hash = %s")
+            params.append(photo_hash)
+    return assignments, params
+
+@api.route('/api/patients/<patient_id>', methods=['PATCH'])
+def patch_patient(patient_id):
+    """Update only the patient fields present in the request body"""
+    try:
+        data = request.json
+        with db_connection() as conn:
+            with conn.cursor() as cursor:
+                assignments, params = patient_patch_assignments(cursor, data)
+                cursor.execute(f"""
+                    UPDATE patients SET
+                        {', '.join(assignments + ['version = version + 1'])}
+                    WHERE id = %s
+                """, (*params, patient_id))
+                if cursor.rowcount == 0:
+                    conn.rollback()
+                    return jsonify({'error': 'Patient not found'}), 404
+                record_event(cursor, patient_id, 'patient.updated')
+                conn.commit()
+
+        cache.invalidate(patient_id, 'patient')
+        changes.notify()
+        return jsonify({'message': 'Patient updated successfully'})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+SELECT_PHOTO_HASH_SQL = "SELECT photo_hash FROM patients WHERE id = %s"
+
+@api.route('/api/patients/<patient_id>/photo', methods=['GET'])
+def get_patient_photo(patient_id):
+    """Get a patient's photo, or its thumbnail with ?size=thumb"""
+    try:
+        thumb = request.args.get('size') == 'thumb'
+        with db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(SELECT_PHOTO_HASH_SQL, (patient_id,))
+                patient = cursor.fetchone()
+                if not patient or not patient['photo_hash']:
+                    return jsonify({'error': 'Photo not found'}), 404
+                
+                photo_hash = patient['photo_hash']
+                etag = f"{photo_hash}-thumb" if thumb else photo_hash
+                # Answer revalidations before touching the blob
+                if request.if_none_match.contains(etag):
+                    response = current_app.response_class(status=304)
+                else:
+                    column = 'thumbnail' if thumb else 'data'
+                    cursor.execute(f"""
+                        SELECT content_type, {column} AS body FROM patient_photos
+                        WHERE hash = %s
+                    """, (photo_hash,))
+                    photo = cursor.fetchone()
+                    if not photo or photo['body'] is None:
+                        return jsonify({'error': 'Photo not found'}), 404
+                    response = send_file(
+                        io.BytesIO(photo['body']),
+                        mimetype='image/jpeg' if thumb else photo['content_type'],
+                        conditional=False,
+                        etag=False
+                    )
+        
+        response.set_etag(etag)
+        # Versioned URLs (?v=<hash prefix>) never change content, so let the browser keep them
+        if request.args.get('v') == photo_hash[:16]:
+            # send_file() marks every response no-cache, which would force revalidation
+            response.cache_control.no_cache = None
+            response.cache_control.private = True
+            response.cache_control.max_age = 31536000
+            response.cache_control.immutable = True
+        else:
+            response.cache_control.no_cache = True
+        return response
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 # ============== VISIT ENDPOINTS ==============
 
-@app.route('/api/patients/<patient_id>/visits', methods=['GET'])
+SELECT_VISITS_SQL = """
+    SELECT * FROM visits 
+    WHERE patient_id = %s 
+    ORDER BY visit_date DESC, visit_time DESC
+"""
+
+@api.route('/api/patients/<patient_id>/visits', methods=['GET'])
 def get_patient_visits(patient_id):
-    """Get all visits for a patient"""
+    """Get all visits for a patient, or one page of archived visits with ?archived=true"""
+    if wants_archive(request.args):
+        return get_archived_visits(patient_id)
     try:
-        conn = get_connection()
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                SELECT * FROM visits 
-                WHERE patient_id = %s 
-                ORDER BY visit_date DESC, visit_time DESC
-            """, (patient_id,))
-            visits = cursor.fetchall()
-        conn.close()
-        return jsonify([serialize_patient(v) for v in visits])
+        return stream_json(stream_rows(SELECT_VISITS_SQL, (patient_id,)), serialize_patient)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def get_archived_visits(patient_id):
+    """Get one page of a patient's archived visits, newest first"""
+    try:
+        sql, params, limit = build_archived_visits_query(patient_id, request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        with db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(sql, params)
+                visits = cursor.fetchall()
+        return jsonify(archive_page(visits, limit, 'visits', serialize_patient))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/patients/<patient_id>/visits', methods=['POST'])
+def insert_visit(cursor, patient_id, data):
+    """Insert a visit and update the patient's visit summary; returns the visit id"""
+    cursor.execute("""
+        INSERT INTO visits (
+            patient_id, visit_date, visit_time, visit_type, purpose,
+            clinic, location, has_investigation, has_refraction, has_glaucoma, notes
+        ) VALUES (%s, CURDATE(), CURTIME(), %s, %s, %s, %s, %s, %s, %s, %s)
+    """, (
+        patient_id,
+        data.get('visitType', 'R'),
+        data.get('purpose'),
+        data.get('clinic', 'CHN'),
+        data.get('location', 'Chennai'),
+        data.get('hasInvestigation', False),
+        data.get('hasRefraction', False),
+        data.get('hasGlaucoma', False),
+        data.get('notes')
+    ))
+    visit_id = cursor.lastrowid
+
+    # Update patient's visit summary in the same transaction
+    cursor.execute("""
+        UPDATE patients SET
+            visit_count = visit_count + 1,
+            version = version + 1,
+            last_visit_date = CURDATE(),
+            last_clinic = %s,
+            visit_type = 'R'
+        WHERE id = %s
+    """, (data.get('clinic', 'CHN'), patient_id))
+
+    record_event(cursor, patient_id, 'visit.created')
+    return visit_id
+
+@api.route('/api/patients/<patient_id>/visits', methods=['POST'])
 def create_visit(patient_id):
     """Log a new visit for a patient"""
     try:
         data = request.json
-        conn = get_connection()
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                INSERT INTO visits (
-                    patient_id, visit_date, visit_time, visit_type, purpose,
-                    clinic, location, has_investigation, has_refraction, has_glaucoma, notes
-                ) VALUES (%s, CURDATE(), CURTIME(), %s, %s, %s, %s, %s, %s, %s, %s)
-            """, (
-                patient_id,
-                data.get('visitType', 'R'),
-                data.get('purpose'),
-                data.get('clinic', 'CHN'),
-                data.get('location', 'Chennai'),
-                data.get('hasInvestigation', False),
-                data.get('hasRefraction', False),
-                data.get('hasGlaucoma', False),
-                data.get('notes')
-            ))
-            
-            # Update patient's last visit info
-            cursor.execute("""
-                UPDATE patients SET
-                    last_visit_date = CURDATE(),
-                    last_clinic = %s,
-                    visit_type = 'R'
-                WHERE id = %s
-            """, (data.get('clinic', 'CHN'), patient_id))
-            
-            conn.commit()
-        conn.close()
+        with db_connection() as conn:
+            with conn.cursor() as cursor:
+                insert_visit(cursor, patient_id, data)
+                conn.commit()
         
+        cache.invalidate(patient_id, 'patient')
+        changes.notify()
         return jsonify({'message': 'Visit logged successfully'}), 201
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 # ============== MEDICAL ALERTS ENDPOINTS ==============
 
-@app.route('/api/patients/<patient_id>/alerts', methods=['GET'])
+SELECT_ALERTS_SQL = """
+    SELECT * FROM medical_alerts
+    WHERE patient_id = %s AND is_active = TRUE
+"""
+
+@api.route('/api/patients/<patient_id>/alerts', methods=['GET'])
 def get_patient_alerts(patient_id):
-    """Get medical alerts for a patient"""
+    """Get active medical alerts for a patient, or one page of archived ones with ?archived=true"""
+    if wants_archive(request.args):
+        return get_archived_alerts(patient_id)
     try:
-        conn = get_connection()
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                SELECT * FROM medical_alerts
-                WHERE patient_id = %s AND is_active = TRUE
-            """, (patient_id,))
-            alerts = cursor.fetchall()
-        conn.close()
+        with db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(SELECT_ALERTS_SQL, (patient_id,))
+                alerts = cursor.fetchall()
         return jsonify(alerts)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/patients/<patient_id>/alerts', methods=['POST'])
+def get_archived_alerts(patient_id):
+    """Get one page of a patient's archived (inactive) alerts, newest first"""
+    try:
+        sql, params, limit = build_archived_alerts_query(patient_id, request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        with db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(sql, params)
+                alerts = cursor.fetchall()
+        return jsonify(archive_page(alerts, limit, 'alerts'))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/api/patients/<patient_id>/alerts', methods=['POST'])
 def add_patient_alert(patient_id):
     """Add a medical alert for a patient"""
     try:
         data = request.json
-        conn = get_connection()
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                INSERT INTO medical_alerts (patient_id, alert_type, alert_value)
-                VALUES (%s, %s, %s)
-            """, (patient_id, data.get('alertType'), data.get('alertValue')))
-            conn.commit()
-        conn.close()
+        with db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    INSERT INTO medical_alerts (patient_id, alert_type, alert_value)
+                    VALUES (%s, %s, %s)
+                """, (patient_id, data.get('alertType'), data.get('alertValue')))
+                cursor.execute("UPDATE patients SET version = version + 1 WHERE id = %s", (patient_id,))
+                conn.commit()
+        cache.invalidate(patient_id, 'patient')
         return jsonify({'message': 'Alert added successfully'}), 201
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 # ============== EMR RECORDS ENDPOINTS ==============
 
-@app.route('/api/patients/<patient_id>/emr', methods=['GET'])
+# emr_version changes on every section save or delete for the patient. One row
+# per section, or a single row with NULL section columns if there are none;
+# no rows if the patient does not exist
+SELECT_EMR_RECORDS_SQL = """
+    SELECT p.emr_version, e.*
+    FROM patients p
+    LEFT JOIN emr_records e ON e.patient_id = p.id
+    WHERE p.id = %s
+"""
+
+SELECT_EMR_RECORD_SQL = """
+    SELECT * FROM emr_records
+    WHERE patient_id = %s AND section_type = %s
+"""
+
+# Locks the current row (if any) so the version check and the write are atomic
+LOCK_EMR_RECORD_SQL = """
+    SELECT version, data FROM emr_records
+    WHERE patient_id = %s AND section_type = %s
+    FOR UPDATE
+"""
+
+# Use INSERT ... ON DUPLICATE KEY UPDATE for upsert; the caller picks the
+# new version so it matches the section's history
+UPSERT_EMR_RECORD_SQL = """
+    INSERT INTO emr_records (patient_id, section_type, data, created_by, version)
+    VALUES (%(patient_id)s, %(section_type)s, %(data)s, %(created_by)s, %(version)s)
+    ON DUPLICATE KEY UPDATE 
+        data = VALUES(data),
+        version = VALUES(version),
+        updated_at = CURRENT_TIMESTAMP
+"""
+
+# JSON merge patch (RFC 7396): only the keys in the patch change, null removes a key
+MERGE_EMR_RECORD_SQL = """
+    INSERT INTO emr_records (patient_id, section_type, data, created_by, version)
+    VALUES (%(patient_id)s, %(section_type)s, JSON_MERGE_PATCH('{}', %(data)s),
+            %(created_by)s, %(version)s)
+    ON DUPLICATE KEY UPDATE
+        data = JSON_MERGE_PATCH(data, %(data)s),
+        version = VALUES(version),
+        updated_at = CURRENT_TIMESTAMP
+"""
+
+if config.DB_BACKEND == 'sqlite':
+    UPSERT_EMR_RECORD_SQL = """
+        INSERT INTO emr_records (patient_id, section_type, data, created_by, version)
+        VALUES (%(patient_id)s, %(section_type)s, %(data)s, %(created_by)s, %(version)s)
+        ON CONFLICT (patient_id, section_type) DO UPDATE SET
+            data = excluded.data,
+            version = excluded.version,
+            updated_at = datetime('now', 'localtime')
+    """
+    # JSON1's json_patch() implements the same RFC 7396 merge
+    MERGE_EMR_RECORD_SQL = """
+        INSERT INTO emr_records (patient_id, section_type, data, created_by, version)
+        VALUES (%(patient_id)s, %(section_type)s, json_patch('{}', %(data)s),
+                %(created_by)s, %(version)s)
+        ON CONFLICT (patient_id, section_type) DO UPDATE SET
+            data = json_patch(emr_records.data, %(data)s),
+            version = excluded.version,
+            updated_at = datetime('now', 'localtime')
+    """
+
+DELETE_EMR_RECORD_SQL = """
+    DELETE FROM emr_records
+    WHERE patient_id = %s AND section_type = %s
+"""
+
+BUMP_EMR_VERSION_SQL = "UPDATE patients SET emr_version = emr_version + 1 WHERE id = %s"
+
+def emr_list_entry(patient_id, rows):
+    """Cache entry for all of a patient's EMR sections, from SELECT_EMR_RECORDS_SQL rows"""
+    # Convert to a dict keyed by section_type
+    result = {row['section_type']: serialize_emr_record(row) for row in rows if row['id'] is not None}
+    emr_version = rows[0]['emr_version'] if rows else 0
+    return {'etag': f"emr-{patient_id}-e{emr_version}", 'body': result}
+
+def emr_record_entry(patient_id, section_type, record):
+    """Cache entry for one EMR section, which may not exist yet"""
+    if record:
+        body = {'exists': True, **serialize_emr_record(record)}
+        return {
+            'etag': emr_record_etag(patient_id, section_type, record['version']),
+            'last_modified': body['updated_at'] or body['created_at'],
+            'body': body
+        }
+    return {'etag': emr_record_etag(patient_id, section_type, 0), 'body': {'exists': False}}
+
+def emr_precondition_failed(if_match, patient_id, section_type, current):
+    """Return the section's current ETag if If-Match rules the save out, else None"""
+    if not if_match:
+        return None
+    current_etag = emr_record_etag(patient_id, section_type, current['version'] if current else 0)
+    if (current and if_match.star_tag) or etag_matches(if_match, current_etag):
+        return None
+    return current_etag
+
+def emr_save_params(patient_id, section_type, data):
+    return {
+        'patient_id': patient_id,
+        'section_type': section_type,
+        'data': json.dumps(data.get('data', {})),
+        'created_by': data.get('createdBy', 'Dr. Chris Diana Pius')
+    }
+
+def emr_patch_params(patient_id, section_type, data):
+    if not isinstance(data, dict) or 'data' not in data:
+        raise ValueError('Request body must be a JSON object with a data merge patch')
+    return {
+        'patient_id': patient_id,
+        'section_type': section_type,
+        'data': json.dumps(data['data']),
+        'created_by': data.get('createdBy', 'Dr. Chris Diana Pius')
+    }
+
+def write_emr_history(cursor, patient_id, section_type, current, created_by):
+    """Append the section's just-written state to its history; returns the new version"""
+    cursor.execute(SELECT_EMR_RECORD_SQL, (patient_id, section_type))
+    saved = cursor.fetchone()
+    before = load_data(current['data']) if current else None
+    after = load_data(saved['data']) if saved else None
+    cursor.execute(INSERT_HISTORY_SQL, history_params(
+        patient_id, section_type, saved['version'], before, after, created_by))
+    return saved['version']
+
+@api.route('/api/patients/<patient_id>/emr', methods=['GET'])
 def get_all_emr_records(patient_id):
     """Get all EMR records for a patient"""
+    def load():
+        with db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(SELECT_EMR_RECORDS_SQL, (patient_id,))
+                rows = cursor.fetchall()
+        return emr_list_entry(patient_id, rows)
+    
     try:
-        conn = get_connection()
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                SELECT * FROM emr_records
-                WHERE patient_id = %s
-            """, (patient_id,))
-            records = cursor.fetchall()
-        conn.close()
-        
-        # Convert to a dict keyed by section_type
-        result = {}
-        for record in records:
-            section = record['section_type']
-            # Parse JSON data
-            data = record['data']
-            if isinstance(data, str):
-                import json as json_module
-                data = json_module.loads(data)
-            result[section] = {
-                'id': record['id'],
-                'data': data,
-                'created_at': record['created_at'].isoformat() if record['created_at'] else None,
-                'updated_at': record['updated_at'].isoformat() if record['updated_at'] else None,
-                'created_by': record['created_by']
-            }
-        return jsonify(result)
+        return conditional_json(cache.get_or_load(patient_id, ('emr',), 'all', load))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/patients/<patient_id>/emr/<section_type>', methods=['GET'])
+@api.route('/api/patients/<patient_id>/emr/<section_type>', methods=['GET'])
 def get_emr_record(patient_id, section_type):
     """Get EMR record for a specific section"""
+    def load():
+        with db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(SELECT_EMR_RECORD_SQL, (patient_id, section_type))
+                record = cursor.fetchone()
+        return emr_record_entry(patient_id, section_type, record)
+    
     try:
-        conn = get_connection()
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                SELECT * FROM emr_records
-                WHERE patient_id = %s AND section_type = %s
-            """, (patient_id, section_type))
-            record = cursor.fetchone()
-        conn.close()
-        
-        if record:
-            data = record['data']
-            if isinstance(data, str):
-                import json as json_module
-                data = json_module.loads(data)
-            return jsonify({
-                'exists': True,
-                'id': record['id'],
-                'data': data,
-                'created_at': record['created_at'].isoformat() if record['created_at'] else None,
-                'updated_at': record['updated_at'].isoformat() if record['updated_at'] else None,
-                'created_by': record['created_by']
-            })
-        return jsonify({'exists': False})
+        return conditional_json(cache.get_or_load(patient_id, (f'emr:{section_type}',), 'record', load))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/patients/<patient_id>/emr/<section_type>', methods=['POST'])
+def write_emr_record(patient_id, section_type, sql, params, message, status):
+    """Run an EMR section write, honouring If-Match, and build the response.
+
+    With an If-Match header the write only succeeds if the section is still at
+    that version, so concurrent editors can't silently overwrite each other.
+    """
+    with db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(LOCK_EMR_RECORD_SQL, (patient_id, section_type))
+            current = cursor.fetchone()
+            current_version = current['version'] if current else 0
+            
+            current_etag = emr_precondition_failed(request.if_match, patient_id, section_type, current)
+            if current_etag:
+                response = jsonify({'error': 'EMR record was modified by someone else'})
+                response.set_etag(current_etag)
+                return response, 412
+            
+            if current is None:
+                # Re-created sections continue the numbering of their history
+                cursor.execute(LAST_HISTORY_VERSION_SQL, (patient_id, section_type))
+                current_version = cursor.fetchone()['version']
+            cursor.execute(sql, {**params, 'version': current_version + 1})
+            version = write_emr_history(cursor, patient_id, section_type, current, params['created_by'])
+            cursor.execute(BUMP_EMR_VERSION_SQL, (patient_id,))
+            conn.commit()
+    cache.invalidate(patient_id, 'emr', f'emr:{section_type}')
+    response = jsonify({'message': message})
+    response.set_etag(emr_record_etag(patient_id, section_type, version))
+    return response, status
+
+@api.route('/api/patients/<patient_id>/emr/<section_type>', methods=['POST'])
 def save_emr_record(patient_id, section_type):
-    """Save or update EMR record for a section"""
+    """Save or update EMR record for a section, replacing its data"""
     try:
         data = request.json
-        conn = get_connection()
-        with conn.cursor() as cursor:
-            # Use INSERT ... ON DUPLICATE KEY UPDATE for upsert
-            cursor.execute("""
-                INSERT INTO emr_records (patient_id, section_type, data, created_by)
-                VALUES (%s, %s, %s, %s)
-                ON DUPLICATE KEY UPDATE 
-                    data = VALUES(data),
-                    updated_at = CURRENT_TIMESTAMP
-            """, (
-                patient_id,
-                section_type,
-                json.dumps(data.get('data', {})),
-                data.get('createdBy', 'Dr. Chris Diana Pius')
-            ))
-            conn.commit()
-        conn.close()
-        return jsonify({'message': 'EMR record saved successfully'}), 201
+        return write_emr_record(patient_id, section_type, UPSERT_EMR_RECORD_SQL,
+                                emr_save_params(patient_id, section_type, data),
+                                'EMR record saved successfully', 201)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/api/patients/<patient_id>/emr/<section_type>', methods=['PATCH'])
+def patch_emr_record(patient_id, section_type):
+    """Apply a JSON merge patch to a section's data, creating the section if needed"""
+    try:
+        data = request.json
+        return write_emr_record(patient_id, section_type, MERGE_EMR_RECORD_SQL,
+                                emr_patch_params(patient_id, section_type, data),
+                                'EMR record updated successfully', 200)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# ============== BATCH EMR SAVE ==============
+
+# A consultation has seven sections; the cap keeps one request's locks short
+EMR_BATCH_MAX_SECTIONS = 20
+
+LOCK_EMR_RECORDS_SQL = """
+    SELECT section_type, version, data FROM emr_records
+    WHERE patient_id = %s AND section_type IN ({placeholders})
+    FOR UPDATE
+"""
+
+def parse_emr_batch(data):
+    """Validate a batch save body, raising ValueError if it is malformed"""
+    if not isinstance(data, dict) or not isinstance(data.get('sections'), dict) or not data['sections']:
+        raise ValueError('Request body must be a JSON object with a sections object')
+    sections = data['sections']
+    if len(sections) > EMR_BATCH_MAX_SECTIONS:
+        raise ValueError(f"At most {EMR_BATCH_MAX_SECTIONS} sections can be saved at once")
+    for section_type, section in sections.items():
+        if not section_type or not isinstance(section, dict):
+            raise ValueError(f"Section {section_type!r} must be a JSON object with its data")
+    visit = data.get('visit')
+    if visit is not None and not isinstance(visit, dict):
+        raise ValueError('visit must be a JSON object')
+    return sections, visit
+
+@api.route('/api/patients/<patient_id>/emr', methods=['POST'])
+def save_emr_records(patient_id):
+    """Save several EMR sections, and optionally log the visit, in one transaction.
+
+    Each section may carry an ifMatch ETag; if any of them is stale nothing is
+    written and the response lists the current ETags of the conflicting sections.
+    """
+    try:
+        data = request.json
+        sections, visit = parse_emr_batch(data)
+        section_types = list(sections)
+        placeholders = ', '.join(['%s'] * len(section_types))
+        default_created_by = data.get('createdBy', 'Dr. Chris Diana Pius')
+        visit_id = None
+
+        with db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT id FROM patients WHERE id = %s", (patient_id,))
+                if not cursor.fetchone():
+                    return jsonify({'error': 'Patient not found'}), 404
+
+                cursor.execute(LOCK_EMR_RECORDS_SQL.format(placeholders=placeholders),
+                               (patient_id, *section_types))
+                current = {row['section_type']: row for row in cursor.fetchall()}
+
+                conflicts = {}
+                for section_type, section in sections.items():
+                    if_match = parse_etags(section['ifMatch']) if section.get('ifMatch') else None
+                    current_etag = emr_precondition_failed(
+                        if_match, patient_id, section_type, current.get(section_type))
+                    if current_etag:
+                        conflicts[section_type] = current_etag
+                if conflicts:
+                    return jsonify({'error': 'EMR records were modified by someone else',
+                                    'conflicts': conflicts}), 412
+
+                versions = {section_type: row['version'] for section_type, row in current.items()}
+                missing = [section_type for section_type in section_types if section_type not in current]
+                if missing:
+                    # Re-created sections continue the numbering of their history
+                    cursor.execute(
+                        LAST_HISTORY_VERSIONS_SQL.format(placeholders=', '.join(['%s'] * len(missing))),
+                        (patient_id, *missing))
+                    versions.update({row['section_type']: row['version'] for row in cursor.fetchall()})
+
+                records = []
+                history = []
+                for section_type, section in sections.items():
+                    params = emr_save_params(patient_id, section_type, {
+                        'createdBy': default_created_by, **section})
+                    version = versions.get(section_type, 0) + 1
+                    versions[section_type] = version
+                    records.append({**params, 'version': version})
+                    before = current.get(section_type)
+                    history.append(history_params(
+                        patient_id, section_type, version,
+                        load_data(before['data']) if before else None,
+                        section.get('data', {}), params['created_by']))
+
+                # One multi-row upsert and one multi-row history insert for the whole batch
+                cursor.executemany(UPSERT_EMR_RECORD_SQL, records)
+                insert_history_rows(cursor, history)
+                cursor.execute(BUMP_EMR_VERSION_SQL, (patient_id,))
+                if visit is not None:
+                    visit_id = insert_visit(cursor, patient_id, visit)
+                conn.commit()
+
+        groups = ['emr', *(f'emr:{section_type}' for section_type in section_types)]
+        if visit_id is not None:
+            groups.append('patient')
+        cache.invalidate(patient_id, *groups)
+        if visit_id is not None:
+            changes.notify()
+        return jsonify({
+            'message': 'EMR records saved successfully',
+            'sections': {
+                section_type: {
+                    'created': section_type not in current,
+                    'version': versions[section_type],
+                    'etag': emr_record_etag(patient_id, section_type, versions[section_type])
+                }
+                for section_type in section_types
+            },
+            'visit': {'id': visit_id} if visit_id is not None else None
+        }), 201
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/patients/<patient_id>/emr/<section_type>', methods=['DELETE'])
+@api.route('/api/patients/<patient_id>/emr/<section_type>', methods=['DELETE'])
 def delete_emr_record(patient_id, section_type):
     """Delete EMR record for a section"""
     try:
-        conn = get_connection()
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                DELETE FROM emr_records
-                WHERE patient_id = %s AND section_type = %s
-            """, (patient_id, section_type))
-            conn.commit()
-        conn.close()
+        with db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(LOCK_EMR_RECORD_SQL, (patient_id, section_type))
+                current = cursor.fetchone()
+                cursor.execute(DELETE_EMR_RECORD_SQL, (patient_id, section_type))
+                if current:
+                    # The delete itself is a version, so earlier ones stay reachable
+                    cursor.execute(INSERT_HISTORY_SQL, history_params(
+                        patient_id, section_type, current['version'] + 1, None, None, None))
+                cursor.execute(BUMP_EMR_VERSION_SQL, (patient_id,))
+                conn.commit()
+        cache.invalidate(patient_id, 'emr', f'emr:{section_type}')
         return jsonify({'message': 'EMR record deleted successfully'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def parse_history_version(value, name):
+    try:
+        version = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a version number")
+    if version < 1:
+        raise ValueError(f"{name} must be a version number")
+    return version
+
+def load_emr_version(cursor, patient_id, section_type, version):
+    """Rebuild one historical version of a section, or None if it is not in the history"""
+    cursor.execute(SELECT_VERSION_CHAIN_SQL, chain_params(patient_id, section_type, version))
+    return rebuild_version(cursor.fetchall(), version)
+
+@api.route('/api/patients/<patient_id>/emr/<section_type>/history', methods=['GET'])
+def get_emr_history(patient_id, section_type):
+    """List the recorded versions of a section, newest first"""
+    try:
+        limit = min(max(int(request.args.get('limit', HISTORY_PAGE_SIZE)), 1), HISTORY_PAGE_SIZE)
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    try:
+        with db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(SELECT_HISTORY_SQL, (patient_id, section_type, limit))
+                versions = cursor.fetchall()
+        return jsonify([serialize_history_entry(v) for v in versions])
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/api/patients/<patient_id>/emr/<section_type>/history/<int:version>', methods=['GET'])
+def get_emr_version(patient_id, section_type, version):
+    """Get a section as it was at one version"""
+    try:
+        with db_connection() as conn:
+            with conn.cursor() as cursor:
+                entry = load_emr_version(cursor, patient_id, section_type, version)
+        if entry is None:
+            return jsonify({'error': 'Version not found'}), 404
+        response = jsonify(entry)
+        # A recorded version never changes
+        response.set_etag(emr_record_etag(patient_id, section_type, version))
+        # Clinical data: browsers may keep it, shared caches and proxies may not
+        response.cache_control.private = True
+        response.cache_control.max_age = 31536000
+        response.cache_control.immutable = True
+        return response
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/api/patients/<patient_id>/emr/<section_type>/diff', methods=['GET'])
+def get_emr_diff(patient_id, section_type):
+    """Diff two versions of a section: ?from=<version>&to=<version>"""
+    try:
+        from_version = parse_history_version(request.args.get('from'), 'from')
+        to_version = parse_history_version(request.args.get('to'), 'to')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        with db_connection() as conn:
+            with conn.cursor() as cursor:
+                old = load_emr_version(cursor, patient_id, section_type, from_version)
+                new = load_emr_version(cursor, patient_id, section_type, to_version)
+        if old is None or new is None:
+            return jsonify({'error': 'Version not found'}), 404
+        return jsonify({'from': from_version, 'to': to_version, **json_delta(old['data'], new['data'])})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# ============== CHANGE FEED ENDPOINTS ==============
+
+def changes_since(args, headers):
+    """Read the resume cursor from ?since= or an EventSource's Last-Event-ID"""
+    since = args.get('since') or headers.get('Last-Event-ID')
+    return None if since is None else parse_cursor(since)
+
+@api.route('/api/patients/changes', methods=['GET'])
+def get_patient_changes():
+    """Get queue changes after ?since=<cursor>; without it, just the current cursor"""
+    try:
+        since = changes_since(request.args, {})
+        limit = min(max(int(request.args.get('limit', changes.batch_size)), 1), changes.batch_size)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        if since is None:
+            return jsonify({'events': [], 'cursor': str(changes.head()), 'has_more': False})
+        events, cursor, has_more = changes.read(since, limit, check_expired=True)
+        return jsonify({'events': events, 'cursor': str(cursor), 'has_more': has_more})
+    except CursorExpired as e:
+        return jsonify({'error': str(e)}), 410
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Seconds a client turned away from the stream should poll before trying it again
+STREAM_RETRY_AFTER = 60
+
+# None when CHANGE_FEED_MAX_STREAMS is 0: streaming is off and every client polls
+stream_slots = threading.BoundedSemaphore(config.CHANGE_FEED_MAX_STREAMS) \
+    if config.CHANGE_FEED_MAX_STREAMS > 0 else None
+
+@api.route('/api/patients/changes/stream', methods=['GET'])
+def stream_patient_changes():
+    """Stream queue changes as Server-Sent Events.
+
+    Each open stream holds a worker thread here, so at most
+    CHANGE_FEED_MAX_STREAMS are served per process; further clients get a 503
+    and poll /api/patients/changes. With CHANGE_FEED_MAX_STREAMS=0 every
+    stream request gets the 503, so all clients poll. serve.py --async serves
+    streams from the event loop instead, without a cap.
+    """
+    try:
+        since = changes_since(request.args, request.headers)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if stream_slots is None or not stream_slots.acquire(blocking=False):
+        reason = 'Change streams are disabled' if stream_slots is None else 'Too many open change streams'
+        response = jsonify({'error': f'{reason}; poll /api/patients/changes instead',
+                            'retry_after': STREAM_RETRY_AFTER})
+        response.headers['Retry-After'] = str(STREAM_RETRY_AFTER)
+        return response, 503
+    
+    def generate():
+        for kind, payload in changes.stream(since, heartbeat=config.CHANGE_FEED_HEARTBEAT):
+            yield sse_message(kind, payload)
+    
+    response = Response(generate(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # The server closes the response when the client disconnects
+    response.call_on_close(stream_slots.release)
+    return response
+
+# ============== HEALTH ENDPOINTS ==============
+
+@api.route('/api/health/db', methods=['GET'])
+def get_db_pool_stats():
+    """Get connection pool metrics (in use, waiting, checkout wait time)"""
+    try:
+        return jsonify(get_pool().stats())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/api/health/cache', methods=['GET'])
+def get_cache_stats():
+    """Get read cache metrics (hits, misses, evictions)"""
+    return jsonify(cache.stats())
+
+@api.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Get request, query, pool and cache metrics in the Prometheus text format"""
+    try:
+        pool = get_pool().stats()
+        cache_stats = cache.stats()
+        gauges = [
+            (f'emr_db_pool_{key}', f'Connection pool {key.replace("_", " ")}', pool[key])
+            for key in ('size', 'in_use', 'idle', 'waiting', 'checkouts', 'timeouts')
+        ]
+        gauges += [
+            (f'emr_cache_{key}', f'Read cache {key}', cache_stats[key])
+            for key in ('entries', 'hits', 'misses', 'evictions') if key in cache_stats
+        ]
+        gauges.append(('emr_change_feed_subscribers', 'Open change feed streams',
+                       changes.subscriber_count()))
+        return Response(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# ============== APP FACTORY ==============
+
+def create_app():
+    """Create the Flask application.
+
+    Serving never touches the schema; run `python database.py init` (or
+    `python migrations.py migrate`) once per deployment instead.
+    """
+    app = Flask(__name__)
+    app.json = FastJSONProvider(app)
+    CORS(app)  # Enable CORS for React frontend
+    app.register_blueprint(api)
+    if config.ARCHIVE_INTERVAL > 0:
+        # Started by the first request, so each forked worker gets its own thread
+        app.before_request(archiver.start)
+    if config.COMPRESSION_ENABLED:
+        @app.after_request
+        def compress(response):
+            return compress_response(response, request.accept_encodings)
+    if config.METRICS_ENABLED:
+        @app.before_request
+        def start_timing():
+            # The route pattern, not the path, so patient ids don't become labels
+            metrics.start_request(request.url_rule.rule if request.url_rule else 'unmatched')
+
+        @app.after_request
+        def record_timing(response):
+            timings = metrics.end_request(request.method, response.status_code)
+            if timings is not None:
+                response.headers['Server-Timing'] = timings.server_timing()
+            return response
+    return app
+
+app = create_app()
+
 # ============== STARTUP ==============
 
 if __name__ == '__main__':
+    # Development server; use serve.py for production
     print("Initializing database...")
     init_database()
     print(f"Starting Flask server on port {config.FLASK_PORT}...")
@@ -0,0 +1,271 @@
+"""Retention of old visits and inactive alerts.
+
+``visits`` and ``medical_alerts`` only ever grow, so rows the chart no longer
+shows by default are moved to ``visits_archive`` and ``medical_alerts_archive``:
+visits older than ARCHIVE_VISITS_AFTER_DAYS, and inactive alerts created more
+than ARCHIVE_ALERTS_AFTER_DAYS ago. Rows keep their ids, and clients page
+into the archive on demand with ``?archived=true`` on the visit and alert
+routes. The patient's visit summary (visit_count, last_visit_date) still
+counts archived visits.
+
+Each process runs an archiver thread every ARCHIVE_INTERVAL minutes; a MySQL
+named lock makes sure only one of them works at a time. Rows move in batches
+of ARCHIVE_BATCH_SIZE, one short transaction each, so chart opens and visit
+logging are never blocked for long.
+
+    python archive.py run       # archive now, e.g. from cron with ARCHIVE_INTERVAL=0
+    python archive.py status    # rows in the hot and archive tables
+"""
+import base64
+import json
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from cache import cache
+from config import config
+from database import db_connection
+
+# Named lock so that the archivers of several workers don't run at once
+ARCHIVE_LOCK = 'emr_archiver'
+
+VISIT_COLUMNS = """
+    id, patient_id, visit_date, visit_time, visit_type, purpose, clinic, location,
+    has_investigation, has_refraction, has_glaucoma, notes, created_at
+"""
+ALERT_COLUMNS = "id, patient_id, alert_type, alert_value, is_active, created_at"
+
+# Oldest first, so an interrupted pass resumes where it stopped
+SELECT_OLD_VISITS_SQL = """
+    SELECT id, patient_id FROM visits
+    WHERE visit_date < %s
+    ORDER BY visit_date, id
+    LIMIT %s
+    FOR UPDATE
+"""
+
+SELECT_OLD_ALERTS_SQL = """
+    SELECT id, patient_id FROM medical_alerts
+    WHERE is_active = FALSE AND created_at < %s
+    ORDER BY created_at, id
+    LIMIT %s
+    FOR UPDATE
+"""
+
+ARCHIVE_PAGE_SIZE = 50
+ARCHIVE_MAX_PAGE_SIZE = 500
+
+
+def wants_archive(args):
+    """Whether a request asked for archived rows with ?archived=true"""
+    return args.get('archived', '').lower() in ('1', 'true', 'yes')
+
+def encode_position(*values):
+    """Encode a keyset position as an opaque cursor"""
+    raw = json.dumps([value.isoformat() if isinstance(value, date) else value for value in values])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def decode_position(cursor, count):
+    """Decode a cursor from encode_position(), raising ValueError if malformed"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list) or len(values) != count:
+        raise ValueError('Invalid cursor')
+    return values
+
+def parse_page_limit(args):
+    try:
+        limit = int(args.get('limit', ARCHIVE_PAGE_SIZE))
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    return min(max(limit, 1), ARCHIVE_MAX_PAGE_SIZE)
+
+# ============== ARCHIVED HISTORY ==============
+
+def build_archived_visits_query(patient_id, args):
+    """Build the SQL for one page of a patient's archived visits, newest first.
+
+    Returns (sql, params, limit); raises ValueError for bad arguments.
+    """
+    limit = parse_page_limit(args)
+    conditions = ["patient_id = %s"]
+    params = [patient_id]
+    if args.get('cursor'):
+        visit_date, visit_id = decode_position(args['cursor'], 2)
+        try:
+            visit_date, visit_id = date.fromisoformat(visit_date), int(visit_id)
+        except (TypeError, ValueError):
+            raise ValueError('Invalid cursor')
+        conditions.append("(visit_date < %s OR (visit_date = %s AND id < %s))")
+        params.extend([visit_date, visit_date, visit_id])
+    # Fetch one extra row to know whether another page exists
+    sql = f"""
+        SELECT * FROM visits_archive
+        WHERE {' AND '.join(conditions)}
+        ORDER BY visit_date DESC, id DESC
+        LIMIT %s
+    """
+    return sql, (*params, limit + 1), limit
+
+def build_archived_alerts_query(patient_id, args):
+    """Build the SQL for one page of a patient's archived alerts, newest first"""
+    limit = parse_page_limit(args)
+    conditions = ["patient_id = %s"]
+    params = [patient_id]
+    if args.get('cursor'):
+        (alert_id,) = decode_position(args['cursor'], 1)
+        if not isinstance(alert_id, int):
+            raise ValueError('Invalid cursor')
+        conditions.append("id < %s")
+        params.append(alert_id)
+    sql = f"""
+        SELECT * FROM medical_alerts_archive
+        WHERE {' AND '.join(conditions)}
+        ORDER BY id DESC
+        LIMIT %s
+    """
+    return sql, (*params, limit + 1), limit
+
+def archive_page(rows, limit, name, serialize=None):
+    """Build a page body from up to limit + 1 rows of an archived-history query"""
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        if name == 'visits':
+            next_cursor = encode_position(last['visit_date'], last['id'])
+        else:
+            next_cursor = encode_position(last['id'])
+    return {
+        name: [serialize(row) for row in rows] if serialize else rows,
+        'next_cursor': next_cursor
+    }
+
+# ============== ARCHIVER ==============
+
+def move_rows(cursor, table, columns, ids):
+    """Copy rows to the table's archive and delete them, in the caller's transaction"""
+    placeholders = ', '.join(['%s'] * len(ids))
+    cursor.execute(f"""
+        INSERT INTO {table}_archive ({columns})
+        SELECT {columns} FROM {table} WHERE id IN ({placeholders})
+    """, ids)
+    cursor.execute(f"DELETE FROM {table} WHERE id IN ({placeholders})", ids)
+
+def archive_batch(conn, cursor, table, columns, select_sql, cutoff, batch_size):
+    """Archive one batch of rows older than cutoff; returns (affected patient ids, rows moved)"""
+    cursor.execute(select_sql, (cutoff, batch_size))
+    rows = cursor.fetchall()
+    if not rows:
+        return [], 0
+    patient_ids = sorted({row['patient_id'] for row in rows})
+    move_rows(cursor, table, columns, [row['id'] for row in rows])
+    if table == 'visits':
+        # The chart's visit history changes, so its cached copies and ETags must too
+        cursor.execute(f"UPDATE patients SET version = version + 1 WHERE id IN "
+                       f"({', '.join(['%s'] * len(patient_ids))})", patient_ids)
+    conn.commit()
+    return patient_ids, len(rows)
+
+def archive_once(today=None, batch_size=None):
+    """Move every row past its retention period to the archive tables.
+
+    Returns {'visits': moved, 'alerts': moved}, or None if another process is
+    already archiving.
+    """
+    today = today or date.today()
+    batch_size = batch_size or config.ARCHIVE_BATCH_SIZE
+    visit_cutoff = today - timedelta(days=config.ARCHIVE_VISITS_AFTER_DAYS)
+    alert_cutoff = datetime.combine(today - timedelta(days=config.ARCHIVE_ALERTS_AFTER_DAYS),
+                                    datetime.min.time())
+    jobs = [
+        ('visits', 'visits', VISIT_COLUMNS, SELECT_OLD_VISITS_SQL, visit_cutoff),
+        ('alerts', 'medical_alerts', ALERT_COLUMNS, SELECT_OLD_ALERTS_SQL, alert_cutoff),
+    ]
+    moved = {name: 0 for name, *_ in jobs}
+    with db_connection() as conn:
+        with conn.cursor() as cursor:
+            if config.DB_BACKEND != 'sqlite':
+                cursor.execute("SELECT GET_LOCK(%s, 0) AS acquired", (ARCHIVE_LOCK,))
+                if not cursor.fetchone()['acquired']:
+                    return None
+            try:
+                for name, table, columns, select_sql, cutoff in jobs:
+                    while True:
+                        patient_ids, count = archive_batch(conn, cursor, table, columns,
+                                                           select_sql, cutoff, batch_size)
+                        for patient_id in patient_ids:
+                            cache.invalidate(patient_id, 'patient')
+                        moved[name] += count
+                        if count < batch_size:
+                            break
+            finally:
+                if config.DB_BACKEND != 'sqlite':
+                    cursor.execute("SELECT RELEASE_LOCK(%s)", (ARCHIVE_LOCK,))
+    return moved
+
+
+class Archiver:
+    """Runs archive_once() every ``interval`` minutes on a daemon thread"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def start(self):
+        """Start the thread if this process has none; cheap enough to call per request"""
+        if self.interval <= 0 or (self._thread is not None and self._pid == os.getpid()):
+            return
+        with self._lock:
+            # A forked worker inherits the attributes but not the thread
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='archiver', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                moved = archive_once()
+                if moved and any(moved.values()):
+                    print(f"Archived {moved['visits']} visits and {moved['alerts']} alerts")
+            except Exception as e:
+                print(f"Archiver run failed: {e}")
+            time.sleep(self.interval * 60)
+
+
+archiver = Archiver(config.ARCHIVE_INTERVAL)
+
+# ============== CLI ==============
+
+ARCHIVE_TABLES = ('visits', 'visits_archive', 'medical_alerts', 'medical_alerts_archive')
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Archive old visits and inactive alerts')
+    parser.add_argument('command', nargs='?', default='run', choices=['run', 'status'])
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        moved = archive_once()
+        if moved is None:
+            print("Another process is archiving; try again later")
+            return 1
+        print(f"Archived {moved['visits']} visits and {moved['alerts']} alerts")
+        return 0
+
+    with db_connection() as conn:
+        with conn.cursor() as cursor:
+            for table in ARCHIVE_TABLES:
+                cursor.execute(f"SELECT COUNT(*) AS row_count FROM {table}")
+                print(f"{table:<24} {cursor.fetchone()['row_count']:>10,} rows")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
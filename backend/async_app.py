@@ -0,0 +1,457 @@
+"""ASGI variant of the API with non-blocking database access.
+
+The hot paths (patient list, queue and search, chart opens, visits, alerts, EMR reads
+and saves) run natively on an aiomysql pool, so a slow query only holds a
+connection, never a worker thread. Every other route is handed to the Flask
+app unchanged. Responses are serialized by Flask's JSON provider, so both
+servers return byte-identical bodies.
+
+    python serve.py --async
+"""
+import asyncio
+from contextlib import asynccontextmanager
+
+import aiomysql
+import pymysql
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Mount, Route
+from werkzeug.http import http_date, parse_date, parse_etags, quote_etag
+
+import app as sync_app
+import metrics
+from archive import (
+    archive_page, archiver, build_archived_alerts_query, build_archived_visits_query, wants_archive
+)
+from app import (
+    BUMP_EMR_VERSION_SQL, LOCK_EMR_RECORD_SQL, MERGE_EMR_RECORD_SQL, QUEUE_COLUMNS, SELECT_ALERTS_SQL,
+    SELECT_ALL_PATIENTS_SQL, SELECT_EMR_RECORD_SQL, SELECT_EMR_RECORDS_SQL, SELECT_VISITS_SQL,
+    UPSERT_EMR_RECORD_SQL, assemble_patient_aggregate, build_queue_query, changes,
+    changes_since, emr_list_entry, emr_patch_params, emr_precondition_failed, emr_record_entry,
+    emr_record_etag, emr_save_params,
+    entry_last_modified, is_not_modified, parse_patient_includes, parse_visit_limit,
+    patient_aggregate_query, patient_cache_entry, queue_page, serialize_patient
+)
+from cache import cache
+from change_feed import CursorExpired, sse_message
+from compression import CompressionMiddleware
+from config import config
+from database import PoolTimeout
+from emr_history import INSERT_HISTORY_SQL, LAST_HISTORY_VERSION_SQL, history_params, load_data
+from json_provider import encode
+from search import build_search_query, parse_search_args, search_page
+
+# ============== ASYNC CONNECTION POOL ==============
+
+_pool = None
+# Only the patient aggregate batches several statements into one query
+_batch_pool = None
+
+async def create_pool(multi_statements=False):
+    """Open an aiomysql pool with the same session settings as get_connection()"""
+    return await aiomysql.create_pool(
+        host=config.DB_HOST,
+        port=config.DB_PORT,
+        user=config.DB_USER,
+        password=config.DB_PASSWORD,
+        db=config.DB_NAME,
+        charset='utf8mb4',
+        cursorclass=aiomysql.DictCursor,
+        client_flag=pymysql.constants.CLIENT.MULTI_STATEMENTS if multi_statements else 0,
+        minsize=config.DB_ASYNC_POOL_MIN_SIZE,
+        maxsize=config.DB_ASYNC_POOL_MAX_SIZE,
+        pool_recycle=config.DB_POOL_RECYCLE
+    )
+
+@asynccontextmanager
+async def db_connection(multi_statements=False):
+    """Check a connection out of the async pool for the duration of a block"""
+    pool = _batch_pool if multi_statements else _pool
+    try:
+        conn = await asyncio.wait_for(pool.acquire(), config.DB_POOL_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise PoolTimeout(f"No database connection available after {config.DB_POOL_TIMEOUT}s")
+    try:
+        yield conn
+    finally:
+        # aiomysql closes connections released inside a transaction, and every
+        # statement opens one, so end it to keep the connection pooled
+        try:
+            await conn.rollback()
+        except Exception:
+            conn.close()
+        pool.release(conn)
+
+async def fetch_all(sql, params):
+    async with db_connection() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(sql, params)
+            return await cursor.fetchall()
+
+# ============== RESPONSES ==============
+
+def json_response(body, status=200, headers=None):
+    """Serialize like flask.jsonify so both servers return identical bodies"""
+    content = sync_app.app.json.dumps(body, separators=(',', ':')) + '\n'
+    return Response(content, status, headers, media_type='application/json')
+
+async def stream_json(sql, params, serialize):
+    """Async counterpart of app.stream_json(), over a server-side cursor.
+
+    The query runs before the response starts, so its errors still become a
+    500; after that the rows are fetched STREAM_BATCH_SIZE at a time.
+    """
+    context = db_connection()
+    conn = await context.__aenter__()
+    finished = False
+
+    async def release():
+        nonlocal conn
+        if conn is not None:
+            if not finished:
+                # Unread rows would leave the connection out of sync; drop it instead
+                conn.close()
+            conn = None
+            await context.__aexit__(None, None, None)
+
+    try:
+        cursor = await conn.cursor(aiomysql.SSDictCursor)
+        await cursor.execute(sql, params)
+    except BaseException:
+        await release()
+        raise
+
+    async def body():
+        nonlocal finished
+        try:
+            yield b'['
+            separator = b''
+            while rows := await cursor.fetchmany(config.STREAM_BATCH_SIZE):
+                yield separator + b','.join(encode(serialize(row)) for row in rows)
+                separator = b','
+            yield b']\n'
+            await cursor.close()
+            finished = True
+        finally:
+            await release()
+
+    # The background task also covers a response that ends before body() runs
+    return StreamingResponse(body(), media_type='application/json', background=BackgroundTask(release))
+
+def error_response(e, status=500):
+    return json_response({'error': str(e)}, status)
+
+def conditional_response(request, entry):
+    """Async counterpart of app.conditional_json()"""
+    if_none_match = parse_etags(request.headers.get('if-none-match'))
+    if_modified_since = parse_date(request.headers.get('if-modified-since'))
+    headers = {'ETag': quote_etag(entry['etag']), 'Cache-Control': 'no-cache'}
+    last_modified = entry_last_modified(entry)
+    if last_modified:
+        headers['Last-Modified'] = http_date(last_modified)
+    if is_not_modified(entry, if_none_match, if_modified_since):
+        return Response(status_code=304, headers=headers)
+    return json_response(entry['body'], headers=headers)
+
+# ============== PATIENT ENDPOINTS ==============
+
+async def get_patient_queue(request):
+    """Get one page of the patient queue, newest first, without photos"""
+    try:
+        sql, params, limit = build_queue_query(request.query_params)
+    except ValueError as e:
+        return error_response(e, 400)
+    try:
+        return json_response(queue_page(await fetch_all(sql, params), limit))
+    except Exception as e:
+        return error_response(e)
+
+async def get_all_patients(request):
+    """Get all patients, or one queue page with ?view=queue"""
+    if request.query_params.get('view') == 'queue':
+        return await get_patient_queue(request)
+    try:
+        return await stream_json(SELECT_ALL_PATIENTS_SQL, (), serialize_patient)
+    except Exception as e:
+        return error_response(e)
+
+async def search_patients(request):
+    """Ranked search by name, mobile number ending or MR number, with ?q=&page=&limit="""
+    try:
+        q, page, limit = parse_search_args(request.query_params)
+    except ValueError as e:
+        return error_response(e, 400)
+    try:
+        sql, params = build_search_query(QUEUE_COLUMNS, q, page, limit)
+        return json_response(search_page(await fetch_all(sql, params), page, limit, serialize_patient))
+    except Exception as e:
+        return error_response(e)
+
+async def get_patient(request):
+    """Get a single patient by ID, with ?include=visits,alerts,emr"""
+    patient_id = request.path_params['patient_id']
+    try:
+        include = parse_patient_includes(request.query_params)
+        visit_limit = parse_visit_limit(request.query_params)
+    except ValueError as e:
+        return error_response(e, 400)
+    variant = f"{','.join(include)}:{visit_limit}"
+
+    async def load():
+        async with db_connection(multi_statements=True) as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(*patient_aggregate_query(patient_id, include=include,
+                                                              visit_limit=visit_limit))
+                patient = await cursor.fetchone()
+                related = []
+                while await cursor.nextset():
+                    related.append(await cursor.fetchall())
+        patient = assemble_patient_aggregate(patient, related, include)
+        return patient_cache_entry(patient_id, patient, include, variant)
+
+    try:
+        groups = ('patient', 'emr') if 'emr' in include else ('patient',)
+        entry = await cache.aget_or_load(patient_id, groups, variant, load)
+        if entry:
+            return conditional_response(request, entry)
+        return json_response({'error': 'Patient not found'}, 404)
+    except Exception as e:
+        return error_response(e)
+
+# ============== VISIT AND ALERT ENDPOINTS ==============
+
+async def get_archived_page(request, build_query, name, serialize=None):
+    """One page of archived visits or alerts, as app.get_archived_visits() and friends"""
+    try:
+        sql, params, limit = build_query(request.path_params['patient_id'], request.query_params)
+    except ValueError as e:
+        return error_response(e, 400)
+    try:
+        return json_response(archive_page(await fetch_all(sql, params), limit, name, serialize))
+    except Exception as e:
+        return error_response(e)
+
+async def get_patient_visits(request):
+    """Get all visits for a patient, or one page of archived visits with ?archived=true"""
+    if wants_archive(request.query_params):
+        return await get_archived_page(request, build_archived_visits_query, 'visits', serialize_patient)
+    try:
+        return await stream_json(SELECT_VISITS_SQL, (request.path_params['patient_id'],), serialize_patient)
+    except Exception as e:
+        return error_response(e)
+
+async def get_patient_alerts(request):
+    """Get active medical alerts for a patient, or one page of archived ones with ?archived=true"""
+    if wants_archive(request.query_params):
+        return await get_archived_page(request, build_archived_alerts_query, 'alerts')
+    try:
+        return json_response(await fetch_all(SELECT_ALERTS_SQL, (request.path_params['patient_id'],)))
+    except Exception as e:
+        return error_response(e)
+
+# ============== EMR RECORDS ENDPOINTS ==============
+
+async def get_all_emr_records(request):
+    """Get all EMR records for a patient"""
+    patient_id = request.path_params['patient_id']
+
+    async def load():
+        async with db_connection() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(SELECT_EMR_RECORDS_SQL, (patient_id,))
+                rows = await cursor.fetchall()
+        return emr_list_entry(patient_id, rows)
+
+    try:
+        return conditional_response(request, await cache.aget_or_load(patient_id, ('emr',), 'all', load))
+    except Exception as e:
+        return error_response(e)
+
+async def get_emr_record(request):
+    """Get EMR record for a specific section"""
+    patient_id = request.path_params['patient_id']
+    section_type = request.path_params['section_type']
+
+    async def load():
+        async with db_connection() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(SELECT_EMR_RECORD_SQL, (patient_id, section_type))
+                record = await cursor.fetchone()
+        return emr_record_entry(patient_id, section_type, record)
+
+    try:
+        entry = await cache.aget_or_load(patient_id, (f'emr:{section_type}',), 'record', load)
+        return conditional_response(request, entry)
+    except Exception as e:
+        return error_response(e)
+
+async def write_emr_record(request, sql, params, message, status):
+    """Async counterpart of app.write_emr_record()"""
+    patient_id = request.path_params['patient_id']
+    section_type = request.path_params['section_type']
+    if_match = parse_etags(request.headers.get('if-match'))
+    async with db_connection() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(LOCK_EMR_RECORD_SQL, (patient_id, section_type))
+            current = await cursor.fetchone()
+            current_version = current['version'] if current else 0
+
+            current_etag = emr_precondition_failed(if_match, patient_id, section_type, current)
+            if current_etag:
+                return json_response({'error': 'EMR record was modified by someone else'}, 412,
+                                     {'ETag': quote_etag(current_etag)})
+
+            if current is None:
+                await cursor.execute(LAST_HISTORY_VERSION_SQL, (patient_id, section_type))
+                current_version = (await cursor.fetchone())['version']
+            await cursor.execute(sql, {**params, 'version': current_version + 1})
+            await cursor.execute(SELECT_EMR_RECORD_SQL, (patient_id, section_type))
+            saved = await cursor.fetchone()
+            before = load_data(current['data']) if current else None
+            await cursor.execute(INSERT_HISTORY_SQL, history_params(
+                patient_id, section_type, saved['version'], before, load_data(saved['data']),
+                params['created_by']))
+            await cursor.execute(BUMP_EMR_VERSION_SQL, (patient_id,))
+            await conn.commit()
+    cache.invalidate(patient_id, 'emr', f'emr:{section_type}')
+    etag = emr_record_etag(patient_id, section_type, saved['version'])
+    return json_response({'message': message}, status, {'ETag': quote_etag(etag)})
+
+async def save_emr_record(request):
+    """Save or update EMR record for a section, replacing its data"""
+    try:
+        params = emr_save_params(request.path_params['patient_id'],
+                                 request.path_params['section_type'], await request.json())
+        return await write_emr_record(request, UPSERT_EMR_RECORD_SQL, params,
+                                      'EMR record saved successfully', 201)
+    except Exception as e:
+        return error_response(e)
+
+async def patch_emr_record(request):
+    """Apply a JSON merge patch to a section's data, creating the section if needed"""
+    try:
+        params = emr_patch_params(request.path_params['patient_id'],
+                                  request.path_params['section_type'], await request.json())
+        return await write_emr_record(request, MERGE_EMR_RECORD_SQL, params,
+                                      'EMR record updated successfully', 200)
+    except ValueError as e:
+        return error_response(e, 400)
+    except Exception as e:
+        return error_response(e)
+
+# ============== CHANGE FEED ENDPOINTS ==============
+
+async def get_patient_changes(request):
+    """Get queue changes after ?since=<cursor>; without it, just the current cursor"""
+    try:
+        since = changes_since(request.query_params, {})
+        limit = min(max(int(request.query_params.get('limit', changes.batch_size)), 1), changes.batch_size)
+    except ValueError as e:
+        return error_response(e, 400)
+    try:
+        if since is None:
+            head = await asyncio.to_thread(changes.head)
+            return json_response({'events': [], 'cursor': str(head), 'has_more': False})
+        events, cursor, has_more = await asyncio.to_thread(changes.read, since, limit, True)
+        return json_response({'events': events, 'cursor': str(cursor), 'has_more': has_more})
+    except CursorExpired as e:
+        return error_response(e, 410)
+    except Exception as e:
+        return error_response(e)
+
+async def stream_patient_changes(request):
+    """Stream queue changes as Server-Sent Events, one task per open screen"""
+    try:
+        since = changes_since(request.query_params, request.headers)
+    except ValueError as e:
+        return error_response(e, 400)
+
+    async def generate():
+        async for kind, payload in changes.astream(since, heartbeat=config.CHANGE_FEED_HEARTBEAT):
+            yield sse_message(kind, payload)
+
+    return StreamingResponse(generate(), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# ============== HEALTH ENDPOINTS ==============
+
+async def get_db_pool_stats(request):
+    """Get async connection pool metrics, with the keys of ConnectionPool.stats().
+
+    aiomysql keeps no wait or churn counters, so those report null.
+    """
+    return json_response({
+        'min_size': _pool.minsize,
+        'max_size': _pool.maxsize,
+        'size': _pool.size,
+        'in_use': _pool.size - _pool.freesize,
+        'idle': _pool.freesize,
+        'waiting': None,
+        'checkouts': None,
+        'timeouts': None,
+        'opened': None,
+        'discarded': None,
+        'wait_time_avg_ms': None,
+        'wait_time_max_ms': None,
+    })
+
+# ============== APP FACTORY ==============
+
+def timed(path, endpoint):
+    """Record the endpoint's latency under its route pattern, as the Flask app does"""
+    async def handler(request):
+        timings = metrics.start_request(path)
+        response = await endpoint(request)
+        metrics.end_request(request.method, response.status_code)
+        response.headers['Server-Timing'] = timings.server_timing()
+        return response
+    return handler
+
+@asynccontextmanager
+async def lifespan(app):
+    global _pool, _batch_pool
+    _pool = await create_pool()
+    _batch_pool = await create_pool(multi_statements=True)
+    # The archiver uses the blocking pool on its own thread, off the event loop
+    archiver.start()
+    try:
+        yield
+    finally:
+        for pool in (_pool, _batch_pool):
+            pool.close()
+            await pool.wait_closed()
+
+def create_app():
+    """Create the ASGI application; unmatched routes fall through to Flask"""
+    routes = [
+        Route('/api/patients', get_all_patients, methods=['GET']),
+        Route('/api/patients/changes', get_patient_changes, methods=['GET']),
+        Route('/api/patients/changes/stream', stream_patient_changes, methods=['GET']),
+        Route('/api/patients/search', search_patients, methods=['GET']),
+        Route('/api/patients/{patient_id}', get_patient, methods=['GET']),
+        Route('/api/patients/{patient_id}/visits', get_patient_visits, methods=['GET']),
+        Route('/api/patients/{patient_id}/alerts', get_patient_alerts, methods=['GET']),
+        Route('/api/patients/{patient_id}/emr', get_all_emr_records, methods=['GET']),
+        Route('/api/patients/{patient_id}/emr/{section_type}', get_emr_record, methods=['GET']),
+        Route('/api/patients/{patient_id}/emr/{section_type}', save_emr_record, methods=['POST']),
+        Route('/api/patients/{patient_id}/emr/{section_type}', patch_emr_record, methods=['PATCH']),
+        Route('/api/health/db', get_db_pool_stats, methods=['GET']),
+        # Writes with side effects beyond one section, photos, imports, etc.
+        Mount('/', WSGIMiddleware(sync_app.app, workers=config.WEB_THREADS)),
+    ]
+    if config.METRICS_ENABLED:
+        # Flask times the mounted routes itself
+        routes = [Route(route.path, timed(route.path, route.endpoint), methods=route.methods)
+                  if isinstance(route, Route) else route for route in routes]
+    # Same CORS policy as flask_cors for the native routes
+    middleware = [Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])]
+    if config.COMPRESSION_ENABLED:
+        # Flask compresses the mounted routes itself; those pass through untouched
+        middleware.insert(0, Middleware(CompressionMiddleware))
+    return Starlette(routes=routes, middleware=middleware, lifespan=lifespan)
+
+app = create_app()
@@ -0,0 +1,420 @@
+"""Reproducible load test for the EMR API, with a stored baseline to catch regressions.
+
+Seed a synthetic clinic into a local database, start a server against it, and
+drive one or more workload mixes:
+
+    python bench_api.py seed --patients 20000 --visits 8 --sections 5
+    CACHE_BACKEND=none python serve.py --workers 2 --bind 127.0.0.1:5000
+    python bench_api.py run http://127.0.0.1:5000 --save-baseline baseline.json
+    # ... change the code, restart the server ...
+    python bench_api.py run http://127.0.0.1:5000 --baseline baseline.json
+
+Every virtual user repeats sessions drawn from the mix: polling the queue,
+opening a chart, autosaving an EMR section in a burst of merge patches, or
+registering a patient with a photo. Throughput and p50/p95/p99 latency are
+reported per endpoint (method and route pattern). With --baseline, an
+endpoint whose p95 rose or whose throughput fell by more than --tolerance is
+reported as a regression and the exit status is 1.
+
+Seeding and every choice the load generator makes derive from --random-seed,
+so two runs against the same dataset send the same requests. Compare runs on
+the same host with the same server settings; the baseline records them.
+"""
+import argparse
+import asyncio
+import base64
+import io
+import json
+import platform
+import random
+import time
+from datetime import date, timedelta
+from urllib.parse import urlsplit
+
+from PIL import Image
+
+from bench_search import FIRST_NAMES, LAST_NAMES
+from bench_serving import Connection, percentile
+from bulk_import import INSERT_ALERT_SQL, INSERT_PATIENT_SQL, INSERT_VISIT_SQL, alert_rows, import_ids
+from database import db_connection, init_database
+from photos import store_photo
+
+# Patients written per transaction while seeding
+SEED_CHUNK_SIZE = 500
+# Distinct photos generated; identical images are stored once, like in production
+PHOTO_VARIANTS = 12
+
+SECTION_TYPES = ['Complaints', 'History', 'Refraction', 'AntSegmentExam', 'FundusExam',
+                 'Investigation', 'Diagnosis']
+CLINICS = ['Glaucoma', 'Retina', 'Cornea', 'Cataract', 'Paediatric']
+ALLERGIES = ['Penicillin', 'Sulfa', 'Atropine', 'Latex', 'Iodine']
+CONDITIONS = ['Diabetes', 'Hypertension', 'Asthma', 'Thyroid']
+FINDINGS = ['normal', 'clear', 'quiet', 'mild haze', 'trace cells', 'early changes', 'stable',
+            'no change since last visit', 'reduced', 'within normal limits']
+
+# Weighted sessions per workload mix
+MIXES = {
+    'queue': {'queue': 1},
+    'chart': {'chart': 1},
+    'autosave': {'autosave': 1},
+    'registration': {'registration': 1},
+    # A clinic at rush hour: mostly reads, a steady stream of saves, some arrivals
+    'clinic': {'queue': 5, 'chart': 3, 'autosave': 2, 'registration': 1},
+}
+
+# Merge patches sent per autosave burst, like a doctor typing into one section
+AUTOSAVE_BURST = 5
+
+SEED_EMR_SQL = """
+    INSERT INTO emr_records (patient_id, section_type, data, created_by, version)
+    VALUES (%s, %s, %s, %s, 1)
+"""
+
+# ============== SEEDING ==============
+
+def eye_findings(rng):
+    return {eye: {'finding': rng.choice(FINDINGS), 'notes': ' '.join(rng.choices(FINDINGS, k=3))}
+            for eye in ('od', 'os')}
+
+def section_data(section_type, rng):
+    """A section's data, about the size of one the EMR page saves"""
+    if section_type == 'Refraction':
+        return {eye: {'sph': rng.choice([-2.5, -1.0, -0.25, 0.5, 1.75]),
+                      'cyl': rng.choice([0, -0.5, -1.25]), 'axis': rng.randrange(0, 180, 5),
+                      'vision': rng.choice(['6/6', '6/9', '6/12', '6/18'])}
+                for eye in ('od', 'os')}
+    if section_type in ('AntSegmentExam', 'FundusExam'):
+        return {part: eye_findings(rng) for part in ('lids', 'conjunctiva', 'cornea', 'lens', 'disc', 'macula')}
+    return {
+        'items': [{'name': rng.choice(FINDINGS), 'duration': f"{rng.randint(1, 12)} months",
+                   'eye': rng.choice(['OD', 'OS', 'OU'])} for _ in range(rng.randint(1, 4))],
+        'notes': ' '.join(rng.choices(FINDINGS, k=12))
+    }
+
+def make_photos(count, size_kb, rng):
+    """JPEG data URLs of roughly ``size_kb`` each, as a registration webcam sends"""
+    photos = []
+    for _ in range(count):
+        # Noise barely compresses, so the encoded size tracks the pixel count
+        side = 64
+        while True:
+            noise = rng.randbytes(side * side * 3)
+            buffer = io.BytesIO()
+            Image.frombytes('RGB', (side, side), noise).save(buffer, 'JPEG', quality=85)
+            if buffer.tell() >= size_kb * 1024 or side >= 1024:
+                break
+            side = min(int(side * max(1.2, (size_kb * 1024 / buffer.tell()) ** 0.5)), 1024)
+        photos.append('data:image/jpeg;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii'))
+    return photos
+
+def synthetic_patient(mr_number, visit_count, rng):
+    """A patient row in INSERT_PATIENT_SQL order, and its visit dates, oldest first"""
+    today = date.today()
+    visit_dates = sorted(today - timedelta(days=rng.randint(0, 5 * 365)) for _ in range(visit_count))
+    allergies = ', '.join(rng.sample(ALLERGIES, rng.choice([0, 0, 0, 1, 2]))) or None
+    conditions = ', '.join(rng.sample(CONDITIONS, rng.choice([0, 0, 1]))) or None
+    age = rng.randint(1, 95)
+    return [
+        mr_number, f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}", None, age,
+        rng.choice(['Male', 'Female']), today - timedelta(days=age * 365 + rng.randint(0, 364)),
+        f"9{rng.randint(0, 999999999):09d}", 'Chennai', 'Tamil Nadu', 'Review',
+        rng.choice(['N', 'R']), allergies, conditions, 'Unassigned',
+        rng.choice(['Waiting', 'Waiting', 'In Progress', 'Completed']),
+        visit_count, visit_dates[-1] if visit_dates else None, rng.choice(CLINICS)
+    ], visit_dates
+
+def seed(patients, visits, sections, photo_share, photo_kb, rng):
+    """Write a synthetic dataset; returns the counts written"""
+    # A fresh database needs its tables, and an old one any pending migrations
+    init_database()
+    photos = make_photos(PHOTO_VARIANTS, photo_kb, rng) if photo_share > 0 else []
+    photo_hashes = []
+    if photos:
+        with db_connection() as conn:
+            with conn.cursor() as cursor:
+                photo_hashes = [store_photo(cursor, photo) for photo in photos]
+                conn.commit()
+
+    tag = int(time.time())
+    counts = {'patients': 0, 'visits': 0, 'alerts': 0, 'emr_records': 0, 'photos': 0}
+    for start in range(0, patients, SEED_CHUNK_SIZE):
+        patient_rows, visit_rows, alert_batch, emr_rows, photo_rows = [], [], [], [], []
+        for i in range(start, min(start + SEED_CHUNK_SIZE, patients)):
+            patient_id = import_ids.next_id()
+            row, visit_dates = synthetic_patient(f"B{tag}{i:07d}", rng.randint(1, 2 * visits - 1)
+                                                 if visits else 0, rng)
+            patient_rows.append((patient_id, *row))
+            clinic = row[-1]
+            visit_rows.extend((patient_id, visit_date, 'R', 'Review', clinic, 'Chennai')
+                              for visit_date in visit_dates)
+            alert_batch.extend(alert_rows(patient_id, row[11], row[12]))
+            emr_rows.extend((patient_id, section_type, json.dumps(section_data(section_type, rng)),
+                             'Dr. Bench')
+                            for section_type in rng.sample(SECTION_TYPES, min(sections, len(SECTION_TYPES))))
+            if photo_hashes and rng.random() < photo_share:
+                photo_rows.append((rng.choice(photo_hashes), patient_id))
+
+        with db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.executemany(INSERT_PATIENT_SQL, patient_rows)
+                if visit_rows:
+                    cursor.executemany(INSERT_VISIT_SQL, visit_rows)
+                if alert_batch:
+                    cursor.executemany(INSERT_ALERT_SQL, alert_batch)
+                if emr_rows:
+                    cursor.executemany(SEED_EMR_SQL, emr_rows)
+                if photo_rows:
+                    cursor.executemany("UPDATE patients SET photo_hash = %s WHERE id = %s", photo_rows)
+                conn.commit()
+        counts['patients'] += len(patient_rows)
+        counts['visits'] += len(visit_rows)
+        counts['alerts'] += len(alert_batch)
+        counts['emr_records'] += len(emr_rows)
+        counts['photos'] += len(photo_rows)
+    return counts
+
+# ============== WORKLOAD ==============
+
+class Recorder:
+    """Latencies and errors per endpoint"""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+
+    async def call(self, conn, endpoint, method, path, body=None):
+        started = time.perf_counter()
+        try:
+            status, response = await conn.request(method, path, body)
+        except (OSError, ConnectionError, asyncio.IncompleteReadError):
+            conn.close()
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+            return None
+        self.latencies.setdefault(endpoint, []).append(time.perf_counter() - started)
+        if status >= 400:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+            return None
+        return response
+
+    def summary(self, elapsed):
+        results = {}
+        for endpoint in sorted(set(self.latencies) | set(self.errors)):
+            latencies = sorted(self.latencies.get(endpoint, []))
+            results[endpoint] = {
+                'requests': len(latencies),
+                'errors': self.errors.get(endpoint, 0),
+                'rps': len(latencies) / elapsed,
+                'p50_ms': percentile(latencies, 0.50) * 1000,
+                'p95_ms': percentile(latencies, 0.95) * 1000,
+                'p99_ms': percentile(latencies, 0.99) * 1000,
+            }
+        return results
+
+
+async def queue_session(conn, recorder, rng, ids, registrations):
+    """Poll the queue, then read the next page"""
+    body = await recorder.call(conn, 'GET /api/patients?view=queue', 'GET', '/api/patients?view=queue&limit=50')
+    next_cursor = json.loads(body).get('next_cursor') if body else None
+    if next_cursor:
+        await recorder.call(conn, 'GET /api/patients?view=queue', 'GET',
+                            f'/api/patients?view=queue&limit=50&cursor={next_cursor}')
+
+async def chart_session(conn, recorder, rng, ids, registrations):
+    """Open a chart: the patient with history, the EMR sections and the photo thumbnail"""
+    patient_id = rng.choice(ids)
+    body = await recorder.call(conn, 'GET /api/patients/<patient_id>', 'GET',
+                               f'/api/patients/{patient_id}?include=visits,alerts,emr')
+    await recorder.call(conn, 'GET /api/patients/<patient_id>/emr', 'GET', f'/api/patients/{patient_id}/emr')
+    photo_url = json.loads(body).get('photo_url') if body else None
+    if photo_url:
+        await recorder.call(conn, 'GET /api/patients/<patient_id>/photo', 'GET', f'{photo_url}&size=thumb')
+
+async def autosave_session(conn, recorder, rng, ids, registrations):
+    """Type into one section: a burst of merge patches, then the full save"""
+    patient_id = rng.choice(ids)
+    section_type = rng.choice(SECTION_TYPES)
+    path = f'/api/patients/{patient_id}/emr/{section_type}'
+    for i in range(AUTOSAVE_BURST):
+        await recorder.call(conn, 'PATCH /api/patients/<patient_id>/emr/<section_type>', 'PATCH', path,
+                            {'data': {'notes': ' '.join(rng.choices(FINDINGS, k=i + 2))}})
+    await recorder.call(conn, 'POST /api/patients/<patient_id>/emr/<section_type>', 'POST', path,
+                        {'data': section_data(section_type, rng), 'createdBy': 'Dr. Bench'})
+
+class Registrations:
+    """Photos for new patients, and MR numbers no earlier run has used"""
+
+    def __init__(self, photos):
+        self.photos = photos
+        self.tag = int(time.time() * 1000)
+        self.count = 0
+
+    def next_mr_number(self):
+        self.count += 1
+        return f"R{self.tag}{self.count:06d}"
+
+async def registration_session(conn, recorder, rng, ids, registrations):
+    """Register a walk-in patient, photo included"""
+    body = {
+        'mrNumber': registrations.next_mr_number(),
+        'name': f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+        'age': rng.randint(1, 95),
+        'gender': rng.choice(['Male', 'Female']),
+        'mobile': f"9{rng.randint(0, 999999999):09d}",
+        'purpose': 'New consultation',
+        'allergies': rng.choice([None, None, rng.choice(ALLERGIES)]),
+        'photo': rng.choice(registrations.photos) if registrations.photos else None,
+    }
+    await recorder.call(conn, 'POST /api/patients', 'POST', '/api/patients', body)
+
+SESSIONS = {
+    'queue': queue_session,
+    'chart': chart_session,
+    'autosave': autosave_session,
+    'registration': registration_session,
+}
+
+async def load_patient_ids(conn, count=500):
+    """IDs of existing patients, for the sessions that open a chart"""
+    ids, next_cursor = [], None
+    while len(ids) < count:
+        path = '/api/patients?view=queue&limit=100' + (f'&cursor={next_cursor}' if next_cursor else '')
+        status, body = await conn.get(path)
+        if status != 200:
+            raise RuntimeError(f"Could not read the patient queue: HTTP {status}")
+        page = json.loads(body)
+        ids.extend(patient['id'] for patient in page['patients'])
+        next_cursor = page.get('next_cursor')
+        if not next_cursor:
+            break
+    if not ids:
+        raise RuntimeError('No patients to benchmark against; run the seed command first')
+    return ids
+
+async def run_mix(base_url, mix, concurrency, duration, random_seed, photo_kb):
+    """Drive one workload mix and return its per-endpoint summary"""
+    url = urlsplit(base_url)
+    host, port = url.hostname, url.port or 80
+    rng = random.Random(random_seed)
+    setup = Connection(host, port)
+    ids = await load_patient_ids(setup)
+    setup.close()
+    registrations = Registrations(make_photos(2, photo_kb, rng) if 'registration' in MIXES[mix] else [])
+    names = list(MIXES[mix])
+    weights = [MIXES[mix][name] for name in names]
+    recorder = Recorder()
+    deadline = time.monotonic() + duration
+
+    async def client(user_rng):
+        conn = Connection(host, port)
+        while time.monotonic() < deadline:
+            session = SESSIONS[user_rng.choices(names, weights)[0]]
+            await session(conn, recorder, user_rng, ids, registrations)
+        conn.close()
+
+    started = time.monotonic()
+    await asyncio.gather(*(client(random.Random(rng.getrandbits(64))) for _ in range(concurrency)))
+    return recorder.summary(time.monotonic() - started)
+
+# ============== REPORTING ==============
+
+def print_results(mix, results, baseline=None):
+    print(f"\n{mix}")
+    print(f"{'endpoint':<56} {'requests':>9} {'errors':>7} {'req/s':>8} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}" + (f" {'vs baseline':>20}" if baseline else ''))
+    for endpoint, result in results.items():
+        line = (f"{endpoint:<56} {result['requests']:>9} {result['errors']:>7} {result['rps']:>8.1f} "
+                f"{result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} {result['p99_ms']:>8.1f}")
+        before = (baseline or {}).get(endpoint)
+        if before:
+            line += f"   p95 {change(before['p95_ms'], result['p95_ms']):>+6.0%} " \
+                    f"rps {change(before['rps'], result['rps']):>+6.0%}"
+        print(line)
+
+def change(before, after):
+    return (after - before) / before if before else 0.0
+
+def regressions(baseline, results, tolerance):
+    """Endpoints slower or less productive than the baseline by more than tolerance"""
+    found = []
+    for mix, endpoints in results.items():
+        for endpoint, result in endpoints.items():
+            before = baseline.get(mix, {}).get(endpoint)
+            if not before:
+                continue
+            if change(before['p95_ms'], result['p95_ms']) > tolerance:
+                found.append(f"{mix}: {endpoint} p95 {before['p95_ms']:.1f} -> {result['p95_ms']:.1f} ms")
+            if change(before['rps'], result['rps']) < -tolerance:
+                found.append(f"{mix}: {endpoint} throughput {before['rps']:.1f} -> {result['rps']:.1f} req/s")
+            if result['errors'] > before['errors']:
+                found.append(f"{mix}: {endpoint} errors {before['errors']} -> {result['errors']}")
+    return found
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Seed a synthetic clinic and load test the EMR API')
+    parser.add_argument('--random-seed', type=int, default=42)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    seed_parser = commands.add_parser('seed', help='write a synthetic dataset to the configured database')
+    seed_parser.add_argument('--patients', type=int, default=10000)
+    seed_parser.add_argument('--visits', type=int, default=6, help='average visits per patient')
+    seed_parser.add_argument('--sections', type=int, default=5, help='EMR sections per patient')
+    seed_parser.add_argument('--photo-share', type=float, default=0.8, help='fraction of patients with a photo')
+    seed_parser.add_argument('--photo-kb', type=int, default=80, help='approximate photo size')
+
+    run_parser = commands.add_parser('run', help='drive workload mixes against a running server')
+    run_parser.add_argument('server', help='base URL, e.g. http://127.0.0.1:5000')
+    run_parser.add_argument('--mix', action='append', choices=sorted(MIXES),
+                            help='workload mix to run (repeatable; default: all)')
+    run_parser.add_argument('--concurrency', type=int, default=50, help='simultaneous virtual users')
+    run_parser.add_argument('--duration', type=float, default=20, help='seconds per mix')
+    run_parser.add_argument('--photo-kb', type=int, default=80, help='approximate registration photo size')
+    run_parser.add_argument('--baseline', help='compare with results saved by --save-baseline')
+    run_parser.add_argument('--tolerance', type=float, default=0.15,
+                            help='allowed p95 increase or throughput drop, as a fraction')
+    run_parser.add_argument('--save-baseline', help='write the results to this file')
+    args = parser.parse_args(argv)
+
+    if args.command == 'seed':
+        started = time.monotonic()
+        counts = seed(args.patients, args.visits, args.sections, args.photo_share, args.photo_kb,
+                      random.Random(args.random_seed))
+        print(', '.join(f"{count} {name}" for name, count in counts.items()) +
+              f" seeded in {time.monotonic() - started:.1f}s")
+        return 0
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    settings = {
+        'concurrency': args.concurrency,
+        'duration': args.duration,
+        'random_seed': args.random_seed,
+        'host': platform.node(),
+    }
+    if baseline and baseline['settings'] != settings:
+        print(f"Warning: baseline was recorded with {baseline['settings']}, not {settings}")
+
+    results = {}
+    for mix in args.mix or list(MIXES):
+        results[mix] = asyncio.run(run_mix(args.server, mix, args.concurrency, args.duration,
+                                           args.random_seed, args.photo_kb))
+        print_results(mix, results[mix], baseline['results'].get(mix) if baseline else None)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({'settings': settings, 'results': results}, f, indent=2)
+        print(f"\nBaseline saved to {args.save_baseline}")
+
+    if baseline:
+        found = regressions(baseline['results'], results, args.tolerance)
+        if found:
+            print(f"\n{len(found)} regression(s) beyond {args.tolerance:.0%}:")
+            for message in found:
+                print(f"  {message}")
+            return 1
+        print(f"\nNo regressions beyond {args.tolerance:.0%}")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
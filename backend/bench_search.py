@@ -0,0 +1,130 @@
+"""Benchmark patient search against a populated database.
+
+Seed synthetic patients first if the database is small; search is meant to
+stay in the low milliseconds with hundreds of thousands of patients:
+
+    python bench_search.py --seed 300000
+    python bench_search.py --iterations 200
+
+Queries are built from patients already in the database, one set per kind of
+match, and run through the same SQL as GET /api/patients/search.
+"""
+import argparse
+import json
+import random
+import time
+
+from app import QUEUE_COLUMNS, serialize_patient
+from bulk_import import import_patients
+from database import db_connection
+from search import build_search_query, search_page
+
+FIRST_NAMES = [
+    'Aarav', 'Abdul', 'Anita', 'Arjun', 'Bhavna', 'Deepa', 'Divya', 'Ganesh', 'Gita', 'Harish',
+    'Imran', 'Kavitha', 'Krishna', 'Lakshmi', 'Manoj', 'Meena', 'Mohammed', 'Murugan', 'Nandini',
+    'Pooja', 'Priya', 'Rahul', 'Rajesh', 'Ramesh', 'Revathi', 'Sanjay', 'Saranya', 'Senthil',
+    'Shalini', 'Suresh', 'Tamil', 'Uma', 'Vijay', 'Vikram', 'Yamuna'
+]
+LAST_NAMES = [
+    'Babu', 'Chandran', 'Das', 'Gupta', 'Iyer', 'Khan', 'Kumar', 'Menon', 'Nair', 'Patel',
+    'Pillai', 'Raj', 'Rao', 'Reddy', 'Sharma', 'Singh', 'Subramanian', 'Venkatesh'
+]
+
+
+def synthetic_patients(count, rng):
+    """Yield NDJSON patient records for import_patients()"""
+    tag = int(time.time())
+    for i in range(count):
+        yield json.dumps({
+            'mrNumber': f"S{tag}{i:07d}",
+            'name': f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            'age': rng.randint(1, 95),
+            'gender': rng.choice(['Male', 'Female']),
+            'mobile': f"9{rng.randint(0, 999999999):09d}",
+            'purpose': 'Review',
+            'lastClinic': 'Glaucoma'
+        }) + '\n'
+
+def misspell(name, rng):
+    """Swap two adjacent letters, like a hurried typist"""
+    if len(name) < 4:
+        return name
+    i = rng.randrange(1, len(name) - 2)
+    return name[:i] + name[i + 1] + name[i] + name[i + 2:]
+
+def sample_queries(sample, rng):
+    """(kind, q) pairs drawn from existing patients"""
+    queries = []
+    for patient in sample:
+        name = patient['name']
+        queries.append(('name_prefix', name[:3]))
+        queries.append(('name_fuzzy', misspell(name, rng)))
+        if patient['mobile'] and len(patient['mobile']) >= 4:
+            queries.append(('mobile_suffix', patient['mobile'][-4:]))
+        queries.append(('mr_exact', patient['mr_number']))
+        queries.append(('mr_prefix', patient['mr_number'][:-2]))
+    return queries
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+def run(iterations, limit, rng):
+    """Time each query kind; returns {kind: summary}"""
+    with db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) AS total FROM patients")
+            total = cursor.fetchone()['total']
+            cursor.execute("SELECT name, mobile, mr_number FROM patients ORDER BY RAND() LIMIT 100")
+            sample = cursor.fetchall()
+            if not sample:
+                raise RuntimeError('No patients to search; run with --seed first')
+            queries = sample_queries(sample, rng)
+
+            timings = {}
+            for _ in range(iterations):
+                kind, q = rng.choice(queries)
+                sql, params = build_search_query(QUEUE_COLUMNS, q, 1, limit)
+                started = time.perf_counter()
+                cursor.execute(sql, params)
+                body = search_page(cursor.fetchall(), 1, limit, serialize_patient)
+                elapsed = time.perf_counter() - started
+                timings.setdefault(kind, []).append((elapsed, len(body['patients'])))
+
+    summary = {}
+    for kind, runs in sorted(timings.items()):
+        latencies = sorted(elapsed for elapsed, _ in runs)
+        summary[kind] = {
+            'queries': len(runs),
+            'avg_results': sum(found for _, found in runs) / len(runs),
+            'p50_ms': percentile(latencies, 0.50) * 1000,
+            'p95_ms': percentile(latencies, 0.95) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+        }
+    return total, summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark patient search')
+    parser.add_argument('--seed', type=int, default=0, help='synthetic patients to import first')
+    parser.add_argument('--iterations', type=int, default=500, help='searches to time')
+    parser.add_argument('--limit', type=int, default=20, help='results per page')
+    parser.add_argument('--random-seed', type=int, default=42)
+    args = parser.parse_args(argv)
+    rng = random.Random(args.random_seed)
+
+    if args.seed:
+        started = time.monotonic()
+        result = import_patients(synthetic_patients(args.seed, rng))
+        print(f"Seeded {result.imported} patients in {time.monotonic() - started:.1f}s")
+
+    total, summary = run(args.iterations, args.limit, rng)
+    print(f"{total} patients")
+    print(f"{'kind':<14} {'queries':>8} {'results':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for kind, result in summary.items():
+        print(f"{kind:<14} {result['queries']:>8} {result['avg_results']:>8.1f} "
+              f"{result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f}")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,157 @@
+"""Compare the sync (gunicorn) and async (uvicorn) servers under the same load.
+
+Start both against the same database, with the same worker count on the same
+host, and with CACHE_BACKEND=none so every request reaches MySQL:
+
+    CACHE_BACKEND=none python serve.py --workers 2 --bind 127.0.0.1:5000
+    CACHE_BACKEND=none python serve.py --workers 2 --bind 127.0.0.1:5001 --async
+    python bench_serving.py http://127.0.0.1:5000 http://127.0.0.1:5001 --concurrency 200
+
+Each run keeps ``concurrency`` keep-alive connections busy for ``duration``
+seconds with a mix of queue polls and chart opens, like a clinic at rush hour.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from urllib.parse import urlsplit
+
+# (weight, path template); {id} is replaced by a random patient from the queue
+WORKLOAD = [
+    (5, '/api/patients?view=queue&limit=50'),
+    (3, '/api/patients/{id}?include=visits,alerts,emr'),
+    (2, '/api/patients/{id}/emr'),
+]
+
+
+class Connection:
+    """Minimal HTTP/1.1 keep-alive client, so the load generator stays cheap"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = self.writer = None
+
+    async def get(self, path):
+        return await self.request('GET', path)
+
+    async def request(self, method, path, body=None):
+        """Send one request, with ``body`` as JSON if given; returns (status, body)"""
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        head = f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n"
+        payload = b''
+        if body is not None:
+            payload = json.dumps(body).encode('utf-8')
+            head += f"Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n"
+        self.writer.write(head.encode('ascii') + b'\r\n' + payload)
+        await self.writer.drain()
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError('server closed the connection')
+        length, close, chunked = 0, False, False
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            name = name.strip().lower()
+            if name == 'content-length':
+                length = int(value)
+            elif name == 'connection' and value.strip().lower() == 'close':
+                close = True
+            elif name == 'transfer-encoding' and 'chunked' in value.lower():
+                chunked = True
+        if chunked:
+            # Streamed responses (e.g. the full patient list) have no Content-Length
+            chunks = []
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                chunks.append(await self.reader.readexactly(size + 2))
+                if size == 0:
+                    break
+            body = b''.join(chunk[:-2] for chunk in chunks)
+        else:
+            body = await self.reader.readexactly(length)
+        if close:
+            self.close()
+        return int(status_line.split()[1]), body
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+async def load_patient_ids(host, port):
+    status, body = await Connection(host, port).get('/api/patients?view=queue&limit=200')
+    if status != 200:
+        raise RuntimeError(f"Could not read the patient queue: HTTP {status}")
+    ids = [patient['id'] for patient in json.loads(body)['patients']]
+    if not ids:
+        raise RuntimeError('No patients to benchmark against; seed the database first')
+    return ids
+
+async def run(base_url, concurrency, duration):
+    """Drive one server and return its throughput and latency summary"""
+    url = urlsplit(base_url)
+    host, port = url.hostname, url.port or 80
+    ids = await load_patient_ids(host, port)
+    weights = [weight for weight, _ in WORKLOAD]
+    paths = [path for _, path in WORKLOAD]
+    latencies, errors = [], 0
+    deadline = time.monotonic() + duration
+
+    async def client():
+        nonlocal errors
+        conn = Connection(host, port)
+        while time.monotonic() < deadline:
+            path = random.choices(paths, weights)[0].format(id=random.choice(ids))
+            started = time.perf_counter()
+            try:
+                status, _ = await conn.get(path)
+            except (OSError, ConnectionError, asyncio.IncompleteReadError):
+                conn.close()
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+            if status >= 400:
+                errors += 1
+        conn.close()
+
+    started = time.monotonic()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.monotonic() - started
+    latencies.sort()
+    return {
+        'server': base_url,
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the sync and async API servers')
+    parser.add_argument('servers', nargs='+', help='base URLs, e.g. http://127.0.0.1:5000')
+    parser.add_argument('--concurrency', type=int, default=100, help='simultaneous connections')
+    parser.add_argument('--duration', type=float, default=20, help='seconds per server')
+    args = parser.parse_args(argv)
+
+    print(f"{'server':<28} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for server in args.servers:
+        result = asyncio.run(run(server, args.concurrency, args.duration))
+        print(f"{result['server']:<28} {result['requests']:>9} {result['errors']:>7} {result['rps']:>9.1f} "
+              f"{result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} {result['p99_ms']:>8.1f}")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
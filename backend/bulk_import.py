@@ -0,0 +1,278 @@
+import csv
+import json
+from datetime import date
+
+import pymysql
+
+from change_feed import record_events
+from database import db_connection
+from patient_ids import IdAllocator
+
+# Rows written per transaction
+CHUNK_SIZE = 1000
+# Cap on per-row errors kept in the report, so a bad file can't exhaust memory
+MAX_REPORTED_ERRORS = 1000
+
+FORMATS = ('ndjson', 'csv')
+
+INSERT_PATIENT_SQL = """
+    INSERT INTO patients (
+        id, mr_number, name, parent_info, age, gender, dob,
+        mobile, city, state, purpose, visit_type,
+        allergies, conditions, assigned_to, status,
+        visit_count, last_visit_date, last_clinic
+    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+INSERT_VISIT_SQL = """
+    INSERT INTO visits (patient_id, visit_date, visit_type, purpose, clinic, location)
+    VALUES (%s, %s, %s, %s, %s, %s)
+"""
+
+INSERT_ALERT_SQL = """
+    INSERT INTO medical_alerts (patient_id, alert_type, alert_value)
+    VALUES (%s, %s, %s)
+"""
+
+def alert_rows(patient_id, allergies, conditions):
+    """Split comma-separated allergies and conditions into medical_alerts rows"""
+    rows = []
+    for alert_type, values in (('allergy', allergies), ('condition', conditions)):
+        for value in (values or '').split(','):
+            if value.strip():
+                rows.append((patient_id, alert_type, value.strip()))
+    return rows
+
+# Imports reserve a whole chunk's worth of IDs per round trip
+import_ids = IdAllocator(block_size=CHUNK_SIZE)
+
+
+class ImportResult:
+    """Counts and per-row errors for one import run"""
+
+    def __init__(self):
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+
+    def add_error(self, line, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'error': message})
+
+    def to_dict(self):
+        return {
+            'imported': self.imported,
+            'failed': self.failed,
+            'errors': sorted(self.errors, key=lambda error: error['line']),
+            'errors_truncated': self.failed > len(self.errors)
+        }
+
+
+def read_rows(stream, fmt):
+    """Yield (line_number, row) from a text stream; row is a ValueError if unparseable"""
+    if fmt == 'ndjson':
+        for line_number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                yield line_number, ValueError('Invalid JSON')
+                continue
+            if not isinstance(row, dict):
+                yield line_number, ValueError('Each line must be a JSON object')
+                continue
+            yield line_number, row
+    elif fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, {key: value for key, value in row.items() if value != ''}
+    else:
+        raise ValueError(f"Unsupported format: {fmt}")
+
+def text_field(row, key, max_length, required=False):
+    """Read a trimmed text field; blank means None, raising ValueError if invalid"""
+    value = row.get(key)
+    if value is None or str(value).strip() == '':
+        if required:
+            raise ValueError(f"{key} is required")
+        return None
+    if isinstance(value, (dict, list)):
+        raise ValueError(f"{key} must be text")
+    value = str(value).strip()
+    if len(value) > max_length:
+        raise ValueError(f"{key} is longer than {max_length} characters")
+    return value
+
+def parse_age(value):
+    """Parse an age in whole years; blank means unknown"""
+    if value in (None, ''):
+        return None
+    # int() would accept True and quietly truncate 12.5
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise ValueError('age must be an integer')
+    try:
+        age = int(value)
+    except (TypeError, ValueError):
+        raise ValueError('age must be an integer')
+    if not 0 <= age <= 150:
+        raise ValueError('age is out of range')
+    return age
+
+def parse_date(key, value):
+    """Parse a YYYY-MM-DD date; blank means None"""
+    try:
+        return date.fromisoformat(value) if value else None
+    except (TypeError, ValueError):
+        raise ValueError(f"{key} must be a YYYY-MM-DD date")
+
+def validate_row(row):
+    """Check and normalise one patient record, raising ValueError if invalid"""
+    age = parse_age(row.get('age'))
+    dates = {key: parse_date(key, row.get(key)) for key in ('dob', 'lastVisitDate')}
+
+    return {
+        'mrNumber': text_field(row, 'mrNumber', 50, required=True),
+        'name': text_field(row, 'name', 255, required=True),
+        'parentInfo': text_field(row, 'parentInfo', 255),
+        'age': age,
+        'gender': text_field(row, 'gender', 20),
+        'dob': dates['dob'],
+        'mobile': text_field(row, 'mobile', 20),
+        'city': text_field(row, 'city', 100),
+        'state': text_field(row, 'state', 100),
+        'purpose': text_field(row, 'purpose', 255),
+        'visitType': text_field(row, 'visitType', 10) or 'N',
+        'allergies': text_field(row, 'allergies', 65535),
+        'conditions': text_field(row, 'conditions', 65535),
+        'assignedTo': text_field(row, 'assignedTo', 255) or 'Unassigned',
+        'status': text_field(row, 'status', 50) or 'Waiting',
+        'lastVisitDate': dates['lastVisitDate'],
+        'lastClinic': text_field(row, 'lastClinic', 100),
+        'location': text_field(row, 'location', 100),
+    }
+
+def _insert_rows(cursor, rows):
+    """Insert patients with their last visit and alerts as multi-row INSERTs"""
+    patients, visits, alerts = [], [], []
+    for patient_id, row in rows:
+        has_visit = row['lastVisitDate'] is not None
+        patients.append((
+            patient_id, row['mrNumber'], row['name'], row['parentInfo'], row['age'],
+            row['gender'], row['dob'], row['mobile'], row['city'], row['state'],
+            row['purpose'], row['visitType'], row['allergies'], row['conditions'],
+            row['assignedTo'], row['status'],
+            1 if has_visit else 0, row['lastVisitDate'], row['lastClinic']
+        ))
+        if has_visit:
+            visits.append((patient_id, row['lastVisitDate'], row['visitType'], row['purpose'],
+                           row['lastClinic'], row['location']))
+        alerts.extend(alert_rows(patient_id, row['allergies'], row['conditions']))
+
+    cursor.executemany(INSERT_PATIENT_SQL, patients)
+    if visits:
+        cursor.executemany(INSERT_VISIT_SQL, visits)
+    if alerts:
+        cursor.executemany(INSERT_ALERT_SQL, alerts)
+    # Change-feed subscribers see imported patients like any other new patient
+    record_events(cursor, [patient_id for patient_id, _ in rows], 'patient.created')
+
+def _write_chunk(chunk, result, id_factory, on_commit=None):
+    """Write one chunk in a single transaction, isolating rows that fail"""
+    with db_connection() as conn:
+        with conn.cursor() as cursor:
+            # Report MR numbers that already exist instead of failing the chunk on them
+            cursor.execute(
+                f"SELECT mr_number FROM patients WHERE mr_number IN ({', '.join(['%s'] * len(chunk))})",
+                [row['mrNumber'] for _, row in chunk])
+            existing = {r['mr_number'] for r in cursor.fetchall()}
+
+            rows, lines, seen = [], [], set()
+            for line, row in chunk:
+                if row['mrNumber'] in existing or row['mrNumber'] in seen:
+                    result.add_error(line, f"MR number {row['mrNumber']} already exists")
+                    continue
+                seen.add(row['mrNumber'])
+                rows.append((id_factory(), row))
+                lines.append(line)
+            if not rows:
+                return
+
+            try:
+                _insert_rows(cursor, rows)
+                conn.commit()
+                result.imported += len(rows)
+                if on_commit:
+                    on_commit()
+                return
+            except pymysql.err.MySQLError:
+                conn.rollback()
+
+            # Something in the chunk was rejected (e.g. a concurrent insert); retry row by row
+            for line, patient in zip(lines, rows):
+                cursor.execute("SAVEPOINT import_row")
+                try:
+                    _insert_rows(cursor, [patient])
+                except pymysql.err.MySQLError as e:
+                    cursor.execute("ROLLBACK TO SAVEPOINT import_row")
+                    result.add_error(line, e.args[-1] if e.args else str(e))
+                else:
+                    result.imported += 1
+            conn.commit()
+            if on_commit:
+                on_commit()
+
+def import_patients(stream, fmt='ndjson', chunk_size=CHUNK_SIZE, id_factory=import_ids.next_id,
+                    on_commit=None):
+    """Import patients from a text stream of NDJSON or CSV records.
+
+    Invalid rows are reported and skipped; valid rows are committed in chunks
+    of ``chunk_size``, so one bad record never aborts the rest of the file.
+    ``on_commit`` is called after each chunk commits.
+    """
+    result = ImportResult()
+    chunk = []
+    for line, row in read_rows(stream, fmt):
+        if isinstance(row, ValueError):
+            result.add_error(line, str(row))
+            continue
+        try:
+            chunk.append((line, validate_row(row)))
+        except ValueError as e:
+            result.add_error(line, str(e))
+            continue
+        if len(chunk) >= chunk_size:
+            _write_chunk(chunk, result, id_factory, on_commit)
+            chunk = []
+    if chunk:
+        _write_chunk(chunk, result, id_factory, on_commit)
+    return result
+
+def main(argv=None):
+    import argparse
+    import os
+    import time
+
+    parser = argparse.ArgumentParser(description='Bulk import patients from NDJSON or CSV')
+    parser.add_argument('path', help='file to import')
+    parser.add_argument('--format', choices=FORMATS,
+                        help='file format (default: from the file extension)')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ('csv' if os.path.splitext(args.path)[1].lower() == '.csv' else 'ndjson')
+    started = time.monotonic()
+    with open(args.path, newline='', encoding='utf-8') as stream:
+        result = import_patients(stream, fmt, chunk_size=args.chunk_size)
+    elapsed = time.monotonic() - started
+
+    for error in result.errors:
+        print(f"line {error['line']}: {error['error']}")
+    rate = result.imported / elapsed * 60 if elapsed else 0
+    print(f"Imported {result.imported} patients, {result.failed} failed "
+          f"in {elapsed:.1f}s ({rate:,.0f} patients/min)")
+    return 1 if result.failed else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,246 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import json_provider
+from config import config
+
+# Returned by backends on a miss, since None is a cacheable value
+MISS = object()
+
+
+class MemoryBackend:
+    """Size-bounded LRU cache with per-entry TTL, local to one process"""
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return MISS
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                self.evictions += 1
+                return MISS
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteBackend:
+    """Cache stored in a local SQLite file, shared by every worker on the host.
+
+    A stand-in for an external cache server: values are JSON encoded and the
+    least recently used entries beyond ``max_entries`` are pruned periodically.
+    """
+
+    PRUNE_EVERY = 100
+
+    def __init__(self, path, max_entries=10000):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._sets = 0
+        self.evictions = 0
+        with self._connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    expires_at REAL,
+                    accessed_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_accessed ON cache_entries (accessed_at)")
+
+    def _connection(self):
+        # sqlite3 connections can't be shared between threads, so keep one per thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT value, expires_at FROM cache_entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return MISS
+        value, expires_at = row
+        now = time.time()
+        if expires_at is not None and expires_at <= now:
+            conn.execute("DELETE FROM cache_entries WHERE key = ? AND expires_at = ?", (key, expires_at))
+            self.evictions += 1
+            return MISS
+        conn.execute("UPDATE cache_entries SET accessed_at = ? WHERE key = ?", (now, key))
+        return json_provider.loads(value)
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        conn = self._connection()
+        conn.execute("""
+            INSERT OR REPLACE INTO cache_entries (key, value, expires_at, accessed_at)
+            VALUES (?, ?, ?, ?)
+        """, (key, json_provider.dumps(value), now + ttl if ttl else None, now))
+        self._sets += 1
+        if self._sets % self.PRUNE_EVERY == 0:
+            self._prune(conn, now)
+
+    def _prune(self, conn, now):
+        expired = conn.execute("DELETE FROM cache_entries WHERE expires_at <= ?", (now,)).rowcount
+        overflow = conn.execute("""
+            DELETE FROM cache_entries WHERE key IN (
+                SELECT key FROM cache_entries ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+            )
+        """, (self.max_entries,)).rowcount
+        self.evictions += expired + overflow
+
+    def clear(self):
+        self._connection().execute("DELETE FROM cache_entries")
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0]
+
+
+class ReadCache:
+    """Read-through cache for per-patient data, grouped into invalidation groups.
+
+    Each (patient, group) pair has a generation token stored in the backend.
+    Entries are keyed by the tokens of every group they depend on, so
+    invalidating a group is a single write that makes all of its entries
+    unreachable; they then age out through LRU/TTL. A reader that fetched
+    data just before an invalidation stores it under the old token, where it
+    can never be read back.
+    """
+
+    def __init__(self, backend, ttl=300):
+        self.backend = backend
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _generation(self, patient_id, group):
+        gen_key = f"gen:{patient_id}:{group}"
+        token = self.backend.get(gen_key)
+        if token is MISS:
+            # A fresh token (not a counter) so an evicted generation can't revive old entries
+            token = os.urandom(6).hex()
+            self.backend.set(gen_key, token)
+        return token
+
+    def _key(self, patient_id, groups, variant):
+        tokens = ':'.join(self._generation(patient_id, group) for group in groups)
+        return f"{patient_id}:{'+'.join(groups)}:{tokens}:{variant}"
+
+    def get_or_load(self, patient_id, groups, variant, load):
+        """Return the cached value, or call ``load()`` and cache its result.
+
+        ``load`` may return None (e.g. not found), which is not cached.
+        """
+        key = self._key(patient_id, groups, variant)
+        value = self.backend.get(key)
+        if value is not MISS:
+            with self._lock:
+                self.hits += 1
+            return value
+        with self._lock:
+            self.misses += 1
+        value = load()
+        if value is not None:
+            self.backend.set(key, value, self.ttl)
+        return value
+
+    async def aget_or_load(self, patient_id, groups, variant, load):
+        """get_or_load() for async callers; ``load`` is a coroutine function"""
+        key = self._key(patient_id, groups, variant)
+        value = self.backend.get(key)
+        if value is not MISS:
+            with self._lock:
+                self.hits += 1
+            return value
+        with self._lock:
+            self.misses += 1
+        value = await load()
+        if value is not None:
+            self.backend.set(key, value, self.ttl)
+        return value
+
+    def invalidate(self, patient_id, *groups):
+        """Drop every cached entry that depends on any of ``groups`` for a patient"""
+        for group in groups:
+            self.backend.set(f"gen:{patient_id}:{group}", os.urandom(6).hex())
+        with self._lock:
+            self.invalidations += len(groups)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'backend': type(self.backend).__name__,
+                'entries': len(self.backend),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.backend.evictions,
+                'invalidations': self.invalidations,
+            }
+
+
+class NullCache:
+    """Drop-in ReadCache replacement that never caches"""
+
+    def get_or_load(self, patient_id, groups, variant, load):
+        return load()
+
+    async def aget_or_load(self, patient_id, groups, variant, load):
+        return await load()
+
+    def invalidate(self, patient_id, *groups):
+        pass
+
+    def stats(self):
+        return {'backend': None}
+
+
+def create_cache():
+    """Build the read cache configured by CACHE_BACKEND"""
+    if config.CACHE_BACKEND == 'none':
+        return NullCache()
+    if config.CACHE_BACKEND == 'sqlite':
+        backend = SQLiteBackend(config.CACHE_SQLITE_PATH, config.CACHE_MAX_ENTRIES)
+    elif config.CACHE_BACKEND == 'memory':
+        backend = MemoryBackend(config.CACHE_MAX_ENTRIES)
+    else:
+        raise ValueError(f"Unknown CACHE_BACKEND: {config.CACHE_BACKEND}")
+    return ReadCache(backend, ttl=config.CACHE_TTL)
+
+cache = create_cache()
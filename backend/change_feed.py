@@ -0,0 +1,348 @@
+"""Change feed for the patient queue.
+
+Writes that change what the queue shows record a row in ``patient_events`` in
+the same transaction. Each process runs one poller thread that reads new
+events by primary key and fans them out to every connected screen, so the
+database sees one cheap range read per process per poll interval no matter
+how many screens are open. Clients resume from the last event id they saw.
+"""
+import asyncio
+import json
+import queue
+import threading
+import time
+
+from config import config
+from database import db_connection
+
+EVENT_TYPES = ('patient.created', 'patient.updated', 'visit.created')
+
+RECORD_EVENT_SQL = "INSERT INTO patient_events (patient_id, event_type) VALUES (%s, %s)"
+
+# Newest event that is old enough to be settled (see ChangeHub.read)
+HEAD_SQL = """
+    SELECT COALESCE(MAX(id), 0) AS head FROM patient_events
+    WHERE created_at < NOW(6) - INTERVAL %s MICROSECOND
+"""
+
+PRUNE_SQL = """
+    DELETE FROM patient_events
+    WHERE created_at < NOW(6) - INTERVAL %s SECOND
+    ORDER BY id
+    LIMIT 1000
+"""
+
+EVENT_AGE_SQL = "TIMESTAMPDIFF(MICROSECOND, e.created_at, NOW(6))"
+
+if config.DB_BACKEND == 'sqlite':
+    HEAD_SQL = """
+        SELECT COALESCE(MAX(id), 0) AS head FROM patient_events
+        WHERE created_at < strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime',
+                                    -(%s / 1000000.0) || ' seconds')
+    """
+    PRUNE_SQL = """
+        DELETE FROM patient_events WHERE id IN (
+            SELECT id FROM patient_events
+            WHERE created_at < datetime('now', 'localtime', -%s || ' seconds')
+            ORDER BY id
+            LIMIT 1000
+        )
+    """
+    EVENT_AGE_SQL = """
+        CAST((julianday('now', 'localtime') - julianday(e.created_at)) * 86400000000 AS INTEGER)
+    """
+
+# Delivered to a subscriber whose queue overflowed; it then catches up from the database
+_OVERFLOW = object()
+
+
+class CursorExpired(Exception):
+    """Raised when a cursor points at events that have already been pruned"""
+
+
+def record_event(cursor, patient_id, event_type):
+    """Record a change event; call inside the transaction that makes the change"""
+    cursor.execute(RECORD_EVENT_SQL, (patient_id, event_type))
+
+def record_events(cursor, patient_ids, event_type):
+    """Record one event per patient as a multi-row insert, like record_event()"""
+    cursor.executemany(RECORD_EVENT_SQL, [(patient_id, event_type) for patient_id in patient_ids])
+
+def parse_cursor(value):
+    """Parse a client-supplied cursor, raising ValueError if malformed"""
+    try:
+        cursor = int(value)
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+    if cursor < 0:
+        raise ValueError('Invalid cursor')
+    return cursor
+
+def sse_message(kind, payload=None):
+    """Format one Server-Sent Events message"""
+    if kind == 'heartbeat':
+        return ": keep-alive\n\n"
+    if kind == 'events':
+        return ''.join(f"id: {event['cursor']}\nevent: patient\ndata: {json.dumps(event)}\n\n"
+                       for event in payload)
+    # 'ready' carries the starting cursor; 'reset' tells the client to reload
+    if kind == 'ready':
+        return f"id: {payload}\nevent: ready\ndata: {json.dumps({'cursor': str(payload)})}\n\n"
+    return f"event: {kind}\ndata: {{}}\n\n"
+
+
+class ChangeHub:
+    """Per-process fan-out of patient change events.
+
+    Event ids come from AUTO_INCREMENT, so a transaction can commit an id
+    lower than one already visible. Reads stop at the first missing id until
+    the events after it are ``gap_wait`` seconds old; by then the missing id
+    was either rolled back or belongs to a transaction that took longer than
+    any request does.
+    """
+
+    def __init__(self, columns, serialize, poll_interval=1.0, gap_wait=5.0,
+                 batch_size=500, retention=86400, queue_size=1000):
+        self.columns = columns
+        self.serialize = serialize
+        self.poll_interval = poll_interval
+        self.gap_wait = gap_wait
+        self.batch_size = batch_size
+        self.retention = retention
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._subscribers = {}
+        self._next_token = 0
+        self._thread = None
+        self.polls = 0
+
+    # ---- reads ----
+
+    def head(self):
+        """Cursor of the newest settled event"""
+        with db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(HEAD_SQL, (int(self.gap_wait * 1000000),))
+                return cursor.fetchone()['head']
+
+    def read_sql(self):
+        """Events after a cursor (param 1), up to a limit (param 2), with their patients' rows"""
+        return f"""
+            SELECT e.id AS event_id, e.event_type, e.patient_id AS event_patient_id,
+                   {EVENT_AGE_SQL} AS event_age_us,
+                   {self.columns}
+            FROM patient_events e
+            LEFT JOIN patients p ON p.id = e.patient_id
+            WHERE e.id > %s
+            ORDER BY e.id
+            LIMIT %s
+        """
+
+    def read(self, since, limit=None, check_expired=False):
+        """Read settled events after ``since``; returns (events, cursor, has_more)"""
+        limit = limit or self.batch_size
+        with db_connection() as conn:
+            with conn.cursor() as cursor:
+                if check_expired:
+                    cursor.execute("SELECT MIN(id) AS oldest FROM patient_events")
+                    oldest = cursor.fetchone()['oldest']
+                    # A rolled-back id right after the cursor looks the same; a
+                    # needless reset only costs the client one snapshot reload
+                    if oldest is not None and oldest > since + 1:
+                        raise CursorExpired('Cursor has expired; reload the queue')
+                cursor.execute(self.read_sql(), (since, limit))
+                rows = cursor.fetchall()
+
+        events = []
+        expected = since + 1
+        for row in rows:
+            event_id = row.pop('event_id')
+            if event_id != expected and row['event_age_us'] < self.gap_wait * 1000000:
+                break
+            expected = event_id + 1
+            events.append(self._event(event_id, row))
+        cursor = int(events[-1]['cursor']) if events else since
+        return events, cursor, len(rows) == limit and len(events) == len(rows)
+
+    def _event(self, event_id, row):
+        event_type = row.pop('event_type')
+        patient_id = row.pop('event_patient_id')
+        row.pop('event_age_us')
+        patient = self.serialize(row) if row.get('id') is not None else None
+        return {'cursor': str(event_id), 'type': event_type, 'patient_id': patient_id,
+                'patient': patient}
+
+    # ---- fan-out ----
+
+    def notify(self):
+        """Wake the poller after a local commit so this process sees it at once"""
+        self._wake.set()
+
+    def subscribe(self, callback):
+        """Call ``callback(events)`` from the poller thread for every new batch"""
+        with self._lock:
+            token = self._next_token
+            self._next_token += 1
+            self._subscribers[token] = callback
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='change-feed', daemon=True)
+                self._thread.start()
+        return token
+
+    def unsubscribe(self, token):
+        with self._lock:
+            self._subscribers.pop(token, None)
+        self._wake.set()
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def _run(self):
+        position = None
+        last_prune = 0.0
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    self._thread = None
+                    return
+                callbacks = list(self._subscribers.values())
+            has_more = False
+            try:
+                if position is None:
+                    position = self.head()
+                events, position, has_more = self.read(position)
+                self.polls += 1
+                if events:
+                    for callback in callbacks:
+                        callback(events)
+                if time.monotonic() - last_prune > 60:
+                    self._prune()
+                    last_prune = time.monotonic()
+            except Exception as e:
+                print(f"Change feed poll failed: {e}")
+            if not has_more:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    def _prune(self):
+        with db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(PRUNE_SQL, (self.retention,))
+                conn.commit()
+
+    # ---- client streams ----
+
+    def stream(self, since=None, heartbeat=15.0):
+        """Yield ('ready', cursor), ('events', [...]), ('heartbeat', None) or ('reset', None).
+
+        Without ``since`` the stream starts at the current head, so the client
+        should load its snapshot after 'ready'.
+        """
+        inbox = queue.Queue(self.queue_size)
+
+        def deliver(events):
+            try:
+                inbox.put_nowait(events)
+            except queue.Full:
+                # Drop the backlog; the stream catches up from the database
+                _drain(inbox)
+                inbox.put_nowait(_OVERFLOW)
+
+        token = self.subscribe(deliver)
+        try:
+            position = self.head() if since is None else since
+            if since is None:
+                yield 'ready', position
+            position = yield from self._catch_up(position)
+            while True:
+                try:
+                    batch = inbox.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield 'heartbeat', None
+                    continue
+                if batch is _OVERFLOW:
+                    position = yield from self._catch_up(position)
+                    continue
+                events = [event for event in batch if int(event['cursor']) > position]
+                if events:
+                    position = int(events[-1]['cursor'])
+                    yield 'events', events
+        except CursorExpired:
+            yield 'reset', None
+        finally:
+            self.unsubscribe(token)
+
+    def _catch_up(self, position):
+        while True:
+            events, position, has_more = self.read(position, check_expired=True)
+            if events:
+                yield 'events', events
+            if not has_more:
+                return position
+
+    async def astream(self, since=None, heartbeat=15.0):
+        """Async counterpart of stream(); database reads run in a worker thread"""
+        loop = asyncio.get_running_loop()
+        inbox = asyncio.Queue(self.queue_size)
+
+        def put(events):
+            try:
+                inbox.put_nowait(events)
+            except asyncio.QueueFull:
+                _drain(inbox)
+                inbox.put_nowait(_OVERFLOW)
+
+        token = self.subscribe(lambda events: loop.call_soon_threadsafe(put, events))
+        try:
+            position = await asyncio.to_thread(self.head) if since is None else since
+            if since is None:
+                yield 'ready', position
+            async for item in self._acatch_up(position):
+                position = int(item[1][-1]['cursor'])
+                yield item
+            while True:
+                try:
+                    batch = await asyncio.wait_for(inbox.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield 'heartbeat', None
+                    continue
+                if batch is _OVERFLOW:
+                    async for item in self._acatch_up(position):
+                        position = int(item[1][-1]['cursor'])
+                        yield item
+                    continue
+                events = [event for event in batch if int(event['cursor']) > position]
+                if events:
+                    position = int(events[-1]['cursor'])
+                    yield 'events', events
+        except CursorExpired:
+            yield 'reset', None
+        finally:
+            self.unsubscribe(token)
+
+    async def _acatch_up(self, position):
+        while True:
+            events, position, has_more = await asyncio.to_thread(self.read, position, None, True)
+            if events:
+                yield 'events', events
+            if not has_more:
+                return
+
+
+def _drain(inbox):
+    while True:
+        try:
+            inbox.get_nowait()
+        except (queue.Empty, asyncio.QueueEmpty):
+            return
+
+def create_hub(columns, serialize):
+    """Build a ChangeHub from the CHANGE_FEED_* settings"""
+    return ChangeHub(
+        columns, serialize,
+        poll_interval=config.CHANGE_FEED_POLL_INTERVAL,
+        gap_wait=config.CHANGE_FEED_GAP_WAIT,
+        retention=config.CHANGE_FEED_RETENTION
+    )
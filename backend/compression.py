@@ -0,0 +1,195 @@
+"""Response compression, negotiated from Accept-Encoding.
+
+Brotli is preferred when the ``brotli`` package is installed and the client
+accepts it, gzip otherwise. Complete bodies smaller than COMPRESS_MIN_SIZE are
+sent as is; streamed bodies, whose size is not known up front, are always
+compressed. Images are already compressed and event streams must reach the
+client message by message, so only JSON and text are touched.
+
+A compressed body is a different byte sequence, so it gets its own strong
+ETag: the identity ETag with the coding appended (``"...-gzip"``). Routes
+compare validators with etag_matches(), which accepts any of these forms, so
+If-None-Match and If-Match work whichever encoding the client cached.
+"""
+import zlib
+
+from werkzeug.datastructures import Accept
+from werkzeug.http import parse_accept_header, quote_etag, unquote_etag
+from werkzeug.wsgi import ClosingIterator
+
+from config import config
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Encodings in order of preference when the client accepts several equally
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+COMPRESSIBLE_TYPES = ('application/json', 'text/plain', 'text/csv', 'text/html')
+
+# Every coding an ETag may carry, whether or not this process can produce it
+ETAG_CODINGS = ('br', 'gzip')
+
+
+def compressible(mimetype):
+    return mimetype in COMPRESSIBLE_TYPES
+
+def encoded_etag(etag, encoding):
+    """The ETag of the body compressed with ``encoding``"""
+    return f"{etag}-{encoding}"
+
+def encode_etag_header(value, encoding):
+    """Rewrite a quoted ETag header value for the compressed body"""
+    etag, weak = unquote_etag(value)
+    return quote_etag(encoded_etag(etag, encoding), weak)
+
+def etag_matches(etags, etag):
+    """Whether parsed ETags contain ``etag`` in its identity or any compressed form"""
+    return etags.contains(etag) or any(etags.contains(encoded_etag(etag, coding))
+                                       for coding in ETAG_CODINGS)
+
+def negotiate(accept_encodings):
+    """Pick an encoding from a parsed Accept-Encoding header, or None"""
+    return accept_encodings.best_match(ENCODINGS)
+
+def compressor(encoding):
+    """A streaming compressor with compress(data) and flush() methods"""
+    if encoding == 'br':
+        return BrotliCompressor()
+    # wbits 16 + MAX_WBITS writes the gzip header and trailer
+    return zlib.compressobj(config.GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+class BrotliCompressor:
+    """brotli.Compressor with the zlib compressobj interface"""
+
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=config.BROTLI_QUALITY)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.finish()
+
+
+def compress(data, encoding):
+    """Compress a complete body"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=config.BROTLI_QUALITY)
+    return zlib.compress(data, config.GZIP_LEVEL, 16 + zlib.MAX_WBITS)
+
+def compress_stream(chunks, encoding):
+    """Compress an iterable of byte chunks as it is consumed"""
+    stream = compressor(encoding)
+    for chunk in chunks:
+        data = stream.compress(chunk)
+        if data:
+            yield data
+    yield stream.flush()
+
+# ============== FLASK ==============
+
+def compress_response(response, accept_encodings):
+    """Compress a Flask response in place if the client accepts it (after_request)"""
+    if (response.status_code < 200 or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers or not compressible(response.mimetype)):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate(accept_encodings)
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        # ClosingIterator passes close() on, so the stream's connection is returned
+        response.response = ClosingIterator(compress_stream(response.response, encoding),
+                                            getattr(response.response, 'close', None))
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < config.COMPRESS_MIN_SIZE:
+            return response
+        response.set_data(compress(data, encoding))
+    if 'ETag' in response.headers:
+        response.headers['ETag'] = encode_etag_header(response.headers['ETag'], encoding)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+# ============== ASGI ==============
+
+def headers_etag(headers):
+    """The ETag value from a list of raw ASGI headers, or None"""
+    for name, value in headers:
+        if name.lower() == b'etag':
+            return value.decode('latin-1')
+    return None
+
+class CompressionMiddleware:
+    """ASGI counterpart of compress_response() for the async server.
+
+    Responses that already carry a Content-Encoding, such as those from the
+    mounted Flask app, pass through untouched.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        accept = dict(scope['headers']).get(b'accept-encoding', b'').decode('latin-1')
+        encoding = negotiate(parse_accept_header(accept, Accept)) if accept else None
+
+        start = None
+        stream = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start, stream, passthrough
+            if message['type'] == 'http.response.start':
+                start = message
+                headers = {name.lower(): value for name, value in message['headers']}
+                mimetype = headers.get(b'content-type', b'').split(b';')[0].strip().decode('latin-1')
+                passthrough = (message['status'] < 200 or message['status'] in (204, 304)
+                               or b'content-encoding' in headers or not compressible(mimetype))
+                if not passthrough:
+                    start['headers'] = [*message['headers'], (b'vary', b'Accept-Encoding')]
+                    passthrough = encoding is None
+                if passthrough:
+                    await send(start)
+                return
+            if passthrough or message['type'] != 'http.response.body':
+                await send(message)
+                return
+
+            body = message.get('body', b'')
+            more_body = message.get('more_body', False)
+            if stream is None:
+                if not more_body and len(body) < config.COMPRESS_MIN_SIZE:
+                    passthrough = True
+                    await send(start)
+                    await send(message)
+                    return
+                headers = [(name, value) for name, value in start['headers']
+                           if name.lower() not in (b'content-length', b'etag')]
+                etag = headers_etag(start['headers'])
+                if etag is not None:
+                    headers.append((b'etag', encode_etag_header(etag, encoding).encode('latin-1')))
+                headers.append((b'content-encoding', encoding.encode('ascii')))
+                if not more_body:
+                    data = compress(body, encoding)
+                    headers.append((b'content-length', str(len(data)).encode('ascii')))
+                    await send({**start, 'headers': headers})
+                    await send({'type': 'http.response.body', 'body': data})
+                    return
+                await send({**start, 'headers': headers})
+                stream = compressor(encoding)
+            data = stream.compress(body)
+            if not more_body:
+                data += stream.flush()
+            await send({'type': 'http.response.body', 'body': data, 'more_body': more_body})
+
+        await self.app(scope, receive, send_compressed)
@@ -5,15 +5,84 @@ from dotenv import load_dotenv
 load_dotenv()
 
 class Config:
-    # Database configuration
+    # Database configuration: 'mysql', or 'sqlite' for a single-machine clinic
+    DB_BACKEND = os.getenv('DB_BACKEND', 'mysql').lower()
+    DB_SQLITE_PATH = os.getenv('DB_SQLITE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'emr.sqlite3'))
     DB_HOST = os.getenv('DB_HOST', 'localhost')
     DB_PORT = int(os.getenv('DB_PORT', 3306))
     DB_USER = os.getenv('DB_USER', 'root')
     DB_PASSWORD = os.getenv('DB_PASSWORD', '')
     DB_NAME = os.getenv('DB_NAME', 'emr_database')
     
+    # Connection pool configuration
+    DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', 2))
+    DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', 10))
+    DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 10))
+    DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 3600))
+    DB_POOL_IDLE_TIMEOUT = int(os.getenv('DB_POOL_IDLE_TIMEOUT', 300))
+    DB_POOL_PING_INTERVAL = int(os.getenv('DB_POOL_PING_INTERVAL', 30))
+    # The async server runs one event loop per process, so it needs a larger pool
+    DB_ASYNC_POOL_MIN_SIZE = int(os.getenv('DB_ASYNC_POOL_MIN_SIZE', 2))
+    DB_ASYNC_POOL_MAX_SIZE = int(os.getenv('DB_ASYNC_POOL_MAX_SIZE', 20))
+    
+    # Patient IDs reserved from the database per round trip, per worker
+    PATIENT_ID_BLOCK_SIZE = int(os.getenv('PATIENT_ID_BLOCK_SIZE', 100))
+    
+    # Read cache: 'memory' (per process), 'sqlite' (shared by workers on one host) or 'none'
+    CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'memory').lower()
+    CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', 2000))
+    CACHE_TTL = int(os.getenv('CACHE_TTL', 300))
+    CACHE_SQLITE_PATH = os.getenv('CACHE_SQLITE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache.sqlite3'))
+    
+    # EMR history stores a full snapshot at least every this many versions of a section
+    EMR_SNAPSHOT_INTERVAL = int(os.getenv('EMR_SNAPSHOT_INTERVAL', 20))
+    
+    # Retention: visits older than ARCHIVE_VISITS_AFTER_DAYS and inactive alerts
+    # older than ARCHIVE_ALERTS_AFTER_DAYS move to the archive tables, checked every
+    # ARCHIVE_INTERVAL minutes by a background job (0 disables it)
+    ARCHIVE_INTERVAL = int(os.getenv('ARCHIVE_INTERVAL', 60))
+    ARCHIVE_VISITS_AFTER_DAYS = int(os.getenv('ARCHIVE_VISITS_AFTER_DAYS', 730))
+    ARCHIVE_ALERTS_AFTER_DAYS = int(os.getenv('ARCHIVE_ALERTS_AFTER_DAYS', 90))
+    ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', 1000))
+    
+    # Patient change feed (seconds)
+    CHANGE_FEED_POLL_INTERVAL = float(os.getenv('CHANGE_FEED_POLL_INTERVAL', 1.0))
+    CHANGE_FEED_GAP_WAIT = float(os.getenv('CHANGE_FEED_GAP_WAIT', 5.0))
+    CHANGE_FEED_HEARTBEAT = float(os.getenv('CHANGE_FEED_HEARTBEAT', 15.0))
+    CHANGE_FEED_RETENTION = int(os.getenv('CHANGE_FEED_RETENTION', 86400))
+    # Open SSE streams per process on the sync server, where each holds a worker
+    # thread; keep it below WEB_THREADS. Extra clients get a 503 and poll instead,
+    # and 0 disables streaming there, so every client polls.
+    CHANGE_FEED_MAX_STREAMS = int(os.getenv('CHANGE_FEED_MAX_STREAMS', 2))
+    
+    # Instrumentation: per-route and per-query timings on /metrics, and a log
+    # of queries slower than SLOW_QUERY_MS (milliseconds)
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True').lower() == 'true'
+    SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 200))
+    
+    # Response compression (brotli if installed, else gzip) for JSON and text
+    # bodies of at least COMPRESS_MIN_SIZE bytes; streamed bodies always qualify
+    COMPRESSION_ENABLED = os.getenv('COMPRESSION_ENABLED', 'True').lower() == 'true'
+    COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', 1024))
+    GZIP_LEVEL = int(os.getenv('GZIP_LEVEL', 6))
+    BROTLI_QUALITY = int(os.getenv('BROTLI_QUALITY', 5))
+    # Rows read per round trip when streaming large lists from a server-side cursor
+    STREAM_BATCH_SIZE = int(os.getenv('STREAM_BATCH_SIZE', 500))
+    
+    # JSON encoder for responses: auto (orjson if installed), orjson or json
+    JSON_ENCODER = os.getenv('JSON_ENCODER', 'auto').lower()
+    
     # Flask configuration
     FLASK_PORT = int(os.getenv('FLASK_PORT', 5000))
-    FLASK_DEBUG = os.getenv('FLASK_DEBUG', 'True').lower() == 'true'
+    FLASK_DEBUG = os.getenv('FLASK_DEBUG', 'False').lower() == 'true'
+    
+    # Production server (serve.py)
+    WEB_HOST = os.getenv('WEB_HOST', '0.0.0.0')
+    WEB_WORKERS = int(os.getenv('WEB_WORKERS', os.cpu_count() or 1))
+    WEB_THREADS = int(os.getenv('WEB_THREADS', 4))
+    WEB_KEEPALIVE = int(os.getenv('WEB_KEEPALIVE', 5))
+    WEB_TIMEOUT = int(os.getenv('WEB_TIMEOUT', 30))
+    WEB_BACKLOG = int(os.getenv('WEB_BACKLOG', 2048))
+    WEB_MAX_REQUESTS = int(os.getenv('WEB_MAX_REQUESTS', 0))
 
 config = Config()
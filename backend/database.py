@@ -1,8 +1,44 @@
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
 import pymysql
+import metrics
 from config import config
 
-def get_connection():
-    """Get a database connection"""
+
+class InstrumentedCursor(pymysql.cursors.DictCursor):
+    """DictCursor that reports each query's time and row count to metrics"""
+
+    def execute(self, query, args=None):
+        # Buffered cursors read the whole result inside execute(), so this
+        # covers the round trip and the fetch (executemany() comes through here too)
+        started = time.perf_counter()
+        try:
+            return super().execute(query, args)
+        finally:
+            metrics.observe_query(query, time.perf_counter() - started, self.rowcount)
+
+
+class InstrumentedSSCursor(pymysql.cursors.SSDictCursor):
+    """Unbuffered counterpart of InstrumentedCursor; times each query up to its first row"""
+
+    def execute(self, query, args=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, args)
+        finally:
+            # The row count is unknown until the stream has been read
+            metrics.observe_query(query, time.perf_counter() - started, None)
+
+
+def get_connection(multi_statements=False):
+    """Open a new, unpooled database connection"""
+    if config.DB_BACKEND == 'sqlite':
+        import sqlite_storage
+        return sqlite_storage.connect(multi_statements)
     return pymysql.connect(
         host=config.DB_HOST,
         port=config.DB_PORT,
@@ -10,11 +46,341 @@ def get_connection():
         password=config.DB_PASSWORD,
         database=config.DB_NAME,
         charset='utf8mb4',
-        cursorclass=pymysql.cursors.DictCursor
+        cursorclass=InstrumentedCursor if config.METRICS_ENABLED else pymysql.cursors.DictCursor,
+        # Only the batch pool's connections accept several statements per query
+        client_flag=pymysql.constants.CLIENT.MULTI_STATEMENTS if multi_statements else 0
     )
 
+def get_batch_connection():
+    """Open a connection that accepts multi-statement queries"""
+    return get_connection(multi_statements=True)
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection becomes free within the checkout timeout"""
+
+
+class ConnectionPool:
+    """Bounded, thread-safe pool of database connections.
+
+    Idle connections are kept in a LIFO stack so the most recently used (and
+    most likely alive) connection is handed out first. A connection is pinged
+    on checkout when it has been idle longer than ``ping_interval`` and is
+    replaced once it is older than ``recycle`` seconds. Idle connections above
+    ``min_size`` are closed after ``idle_timeout`` seconds.
+    """
+
+    def __init__(self, connect=get_connection, min_size=1, max_size=10,
+                 timeout=10.0, recycle=3600, idle_timeout=300, ping_interval=30):
+        if max_size < 1 or min_size < 0 or min_size > max_size:
+            raise ValueError('Invalid pool size: min=%s max=%s' % (min_size, max_size))
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.idle_timeout = idle_timeout
+        self.ping_interval = ping_interval
+        self.pid = os.getpid()
+
+        self._cond = threading.Condition()
+        self._idle = deque()  # entries are [conn, created_at, last_used]
+        self._size = 0
+        self._in_use = 0
+        self._waiting = 0
+
+        # Metrics
+        self._checkouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._timeouts = 0
+        self._opened = 0
+        self._discarded = 0
+
+    def _open(self):
+        conn = self._connect()
+        now = time.monotonic()
+        # Remember the creation time so release() can keep recycling on schedule
+        conn._pool_created_at = now
+        with self._cond:
+            self._opened += 1
+        return [conn, now, now]
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def fill(self):
+        """Open connections until ``min_size`` are available"""
+        while True:
+            with self._cond:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                entry = self._open()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._idle.append(entry)
+                self._cond.notify()
+
+    def acquire(self):
+        """Check out a healthy connection, blocking up to ``timeout`` seconds"""
+        start = time.monotonic()
+        deadline = start + self.timeout
+        entry = None
+        with self._cond:
+            self._waiting += 1
+            try:
+                while True:
+                    if self._idle:
+                        entry = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(
+                            'Timed out after %.1fs waiting for a database connection' % self.timeout)
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+            self._in_use += 1
+
+        # Open or validate outside the lock so slow handshakes don't block others
+        try:
+            entry = self._validate(entry)
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+        waited = time.monotonic() - start
+        with self._cond:
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        if config.METRICS_ENABLED:
+            metrics.observe_pool_wait(waited)
+        return entry[0]
+
+    def _validate(self, entry):
+        if entry is None:
+            return self._open()
+        conn, created_at, last_used = entry
+        now = time.monotonic()
+        if self.recycle and now - created_at > self.recycle:
+            self._discard(conn)
+            return self._open()
+        if now - last_used > self.ping_interval:
+            try:
+                conn.ping(reconnect=False)
+            except Exception:
+                self._discard(conn)
+                return self._open()
+        return entry
+
+    def _discard(self, conn):
+        self._close_quietly(conn)
+        with self._cond:
+            self._discarded += 1
+
+    def release(self, conn, discard=False):
+        """Return a connection to the pool, closing it if ``discard`` is set"""
+        if not discard:
+            # End any open transaction so the next user starts with a fresh snapshot
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+
+        now = time.monotonic()
+        stale = []
+        with self._cond:
+            self._in_use -= 1
+            if discard:
+                self._size -= 1
+                self._discarded += 1
+            else:
+                self._idle.append([conn, getattr(conn, '_pool_created_at', now), now])
+            # Trim connections that sat idle too long, oldest first
+            while (self._idle and self._size > self.min_size
+                   and now - self._idle[0][2] > self.idle_timeout):
+                stale.append(self._idle.popleft()[0])
+                self._size -= 1
+                self._discarded += 1
+            self._cond.notify()
+
+        if discard:
+            self._close_quietly(conn)
+        for idle_conn in stale:
+            self._close_quietly(idle_conn)
+
+    @contextmanager
+    def connection(self):
+        """Context manager that always returns the connection to the pool"""
+        conn = self.acquire()
+        discard = False
+        try:
+            yield conn
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+            raise
+        finally:
+            self.release(conn, discard=discard)
+
+    def close(self):
+        """Close all idle connections"""
+        with self._cond:
+            idle = [entry[0] for entry in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+        for conn in idle:
+            self._close_quietly(conn)
+
+    def stats(self):
+        """Snapshot of pool usage metrics"""
+        with self._cond:
+            return {
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'size': self._size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'waiting': self._waiting,
+                'checkouts': self._checkouts,
+                'timeouts': self._timeouts,
+                'opened': self._opened,
+                'discarded': self._discarded,
+                'wait_time_avg_ms': round(self._wait_total / self._checkouts * 1000, 3) if self._checkouts else 0.0,
+                'wait_time_max_ms': round(self._wait_max * 1000, 3),
+            }
+
+
+_pools = {}
+_pool_lock = threading.Lock()
+
+def get_pool(multi_statements=False):
+    """Get a process-wide connection pool, creating it on first use.
+
+    Connections of the default pool run one statement per query. A separate
+    pool serves the few reads that batch several SELECTs into one round trip,
+    so a query built from request input can never smuggle in a second statement.
+    """
+    pool = _pools.get(multi_statements)
+    if pool is not None and pool.pid == os.getpid():
+        return pool
+    with _pool_lock:
+        pool = _pools.get(multi_statements)
+        if pool is None or pool.pid != os.getpid():
+            pool = ConnectionPool(
+                connect=get_batch_connection if multi_statements else get_connection,
+                min_size=config.DB_POOL_MIN_SIZE,
+                max_size=config.DB_POOL_MAX_SIZE,
+                timeout=config.DB_POOL_TIMEOUT,
+                recycle=config.DB_POOL_RECYCLE,
+                idle_timeout=config.DB_POOL_IDLE_TIMEOUT,
+                ping_interval=config.DB_POOL_PING_INTERVAL
+            )
+            pool.fill()
+            _pools[multi_statements] = pool
+        return pool
+
+def db_connection(multi_statements=False):
+    """Check out a pooled connection: ``with db_connection() as conn: ...``
+
+    Pass ``multi_statements=True`` only for fixed, fully parameterized batches
+    of reads such as the patient aggregate.
+    """
+    return get_pool(multi_statements).connection()
+
+
+class RowStream:
+    """Iterator over the rows of an executed, unbuffered query.
+
+    Holds its pooled connection until the rows run out or close() is called.
+    A stream closed early (e.g. the client went away) discards the connection
+    instead of reading the rest of the result off the socket.
+    """
+
+    def __init__(self, pool, conn, cursor, batch_size):
+        self._pool = pool
+        self._conn = conn
+        self._cursor = cursor
+        self._batch_size = batch_size
+        self._batch = deque()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self._batch:
+            if self._conn is None:
+                raise StopIteration
+            self._batch.extend(self._cursor.fetchmany(self._batch_size))
+            if not self._batch:
+                self._cursor.close()
+                self._release(discard=False)
+                raise StopIteration
+        return self._batch.popleft()
+
+    def close(self):
+        self._release(discard=True)
+
+    def _release(self, discard):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._pool.release(conn, discard=discard)
+
+
+def stream_rows(sql, params=None, batch_size=None):
+    """Run a query on a server-side cursor and return a RowStream over its rows.
+
+    Rows are read ``batch_size`` at a time as the stream is consumed, so memory
+    stays flat however many match. The query runs before this returns, so
+    errors surface here rather than halfway through a response.
+    """
+    pool = get_pool()
+    conn = pool.acquire()
+    try:
+        cursor = conn.cursor(InstrumentedSSCursor if config.METRICS_ENABLED else pymysql.cursors.SSDictCursor)
+        cursor.execute(sql, params)
+    except Exception:
+        pool.release(conn, discard=True)
+        raise
+    return RowStream(pool, conn, cursor, batch_size or config.STREAM_BATCH_SIZE)
+
+def add_column_if_missing(cursor, table, column, definition):
+    """Add a column to an existing table unless it is already there"""
+    cursor.execute("""
+        SELECT 1 FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+    """, (table, column))
+    if cursor.fetchone() is None:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        return True
+    return False
+
 def init_database():
     """Initialize the database and create tables"""
+    if config.DB_BACKEND == 'sqlite':
+        import sqlite_storage
+        sqlite_storage.init_database()
+        return
+    
     # First connect without database to create it if needed
     conn = pymysql.connect(
         host=config.DB_HOST,
@@ -44,19 +410,35 @@ def init_database():
                     city VARCHAR(100),
                     state VARCHAR(100),
                     photo LONGTEXT,
+                    photo_hash CHAR(64),
                     purpose VARCHAR(255),
                     visit_type VARCHAR(10) DEFAULT 'N',
                     allergies TEXT,
                     conditions TEXT,
                     assigned_to VARCHAR(255) DEFAULT 'Unassigned',
+                    visit_count INT NOT NULL DEFAULT 0,
                     last_visit_date DATE,
                     last_clinic VARCHAR(100),
                     status VARCHAR(50) DEFAULT 'Waiting',
+                    version INT NOT NULL DEFAULT 1,
+                    emr_version INT NOT NULL DEFAULT 1,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
                 )
             """)
             
+            # Create content-addressed photo store, keyed by SHA-256 of the image
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS patient_photos (
+                    hash CHAR(64) PRIMARY KEY,
+                    content_type VARCHAR(50) NOT NULL,
+                    size INT NOT NULL,
+                    data LONGBLOB NOT NULL,
+                    thumbnail MEDIUMBLOB,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
             # Create visits table
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS visits (
@@ -98,6 +480,7 @@ def init_database():
                     visit_id INT,
                     section_type VARCHAR(50) NOT NULL,
                     data JSON NOT NULL,
+                    version INT NOT NULL DEFAULT 1,
                     created_by VARCHAR(100),
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
@@ -108,9 +491,90 @@ def init_database():
             
             conn.commit()
             print("Database and tables created successfully!")
+        
+        # Bring existing databases up to the current schema (columns, indexes)
+        from migrations import apply_migrations
+        applied = apply_migrations(conn)
+        if applied:
+            print(f"Applied migrations: {', '.join(str(v) for v in applied)}")
             
     finally:
         conn.close()
 
+def visit_source(include_archive):
+    """The visits the summary counts: the hot table, plus the archive once it exists"""
+    if not include_archive:
+        return "visits"
+    return """(
+        SELECT id, patient_id, visit_date, visit_time, clinic FROM visits
+        UNION ALL
+        SELECT id, patient_id, visit_date, visit_time, clinic FROM visits_archive
+    )"""
+
+def backfill_visit_summary(cursor, include_archive=True):
+    """Recompute visit_count, last_visit_date and last_clinic from the visits (and archive) tables"""
+    cursor.execute(f"""
+        UPDATE patients p
+        LEFT JOIN (
+            SELECT patient_id, visit_date, clinic,
+                   COUNT(*) OVER (PARTITION BY patient_id) AS visit_count,
+                   ROW_NUMBER() OVER (
+                       PARTITION BY patient_id
+                       ORDER BY visit_date DESC, visit_time DESC, id DESC
+                   ) AS visit_rank
+            FROM {visit_source(include_archive)} all_visits
+        ) v ON v.patient_id = p.id AND v.visit_rank = 1
+        SET p.visit_count = COALESCE(v.visit_count, 0),
+            p.last_visit_date = v.visit_date,
+            p.last_clinic = COALESCE(v.clinic, p.last_clinic)
+    """)
+    return cursor.rowcount
+
+def check_visit_summary(cursor):
+    """Return patients whose stored visit summary disagrees with the visits (and archive) tables"""
+    cursor.execute(f"""
+        SELECT p.id, p.visit_count, COALESCE(v.visit_count, 0) AS actual_visit_count,
+               p.last_visit_date, v.last_visit_date AS actual_last_visit_date
+        FROM patients p
+        LEFT JOIN (
+            SELECT patient_id, COUNT(*) AS visit_count, MAX(visit_date) AS last_visit_date
+            FROM {visit_source(True)} all_visits
+            GROUP BY patient_id
+        ) v ON v.patient_id = p.id
+        WHERE p.visit_count <> COALESCE(v.visit_count, 0)
+           OR NOT (p.last_visit_date <=> v.last_visit_date)
+    """)
+    return cursor.fetchall()
+
+def main(argv=None):
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='EMR database maintenance')
+    parser.add_argument('command', nargs='?', default='init',
+                        choices=['init', 'backfill-visit-summary', 'check-visit-summary'])
+    args = parser.parse_args(argv)
+    
+    if args.command == 'init':
+        init_database()
+        return 0
+    if config.DB_BACKEND == 'sqlite':
+        print(f"{args.command} is only needed for MySQL databases")
+        return 1
+    
+    with db_connection() as conn:
+        with conn.cursor() as cursor:
+            if args.command == 'backfill-visit-summary':
+                updated = backfill_visit_summary(cursor)
+                conn.commit()
+                print(f"Backfilled visit summary for {updated} patients")
+                return 0
+            
+            mismatches = check_visit_summary(cursor)
+    for row in mismatches:
+        print(f"{row['id']}: visit_count={row['visit_count']} (actual {row['actual_visit_count']}), "
+              f"last_visit_date={row['last_visit_date']} (actual {row['actual_last_visit_date']})")
+    print(f"{len(mismatches)} patients with an inconsistent visit summary")
+    return 1 if mismatches else 0
+
 if __name__ == "__main__":
-    init_database()
+    raise SystemExit(main())
@@ -0,0 +1,156 @@
+"""Append-only version history of EMR sections.
+
+Every write to a section appends its new version to ``emr_record_history``,
+either as a full snapshot or as a delta against the previous version, both
+compressed with MySQL's COMPRESS(). A snapshot is taken at least every
+EMR_SNAPSHOT_INTERVAL versions, so rebuilding any version reads one snapshot
+and fewer than that many deltas. The current version stays in emr_records.
+
+A delta is {"set": [[path, value], ...], "unset": [path, ...]} where a path
+is the list of object keys leading to the value; arrays are replaced whole.
+"""
+import json
+
+from config import config
+
+INSERT_HISTORY_SQL = """
+    INSERT INTO emr_record_history (patient_id, section_type, version, kind, payload, created_by)
+    VALUES (%s, %s, %s, %s, COMPRESS(%s), %s)
+"""
+
+# executemany() can't fold COMPRESS(%s) rows into one statement, so batches build their own
+HISTORY_ROW_SQL = "(%s, %s, %s, %s, COMPRESS(%s), %s)"
+
+# Highest version ever written, so a section re-created after a delete keeps counting
+LAST_HISTORY_VERSION_SQL = """
+    SELECT COALESCE(MAX(version), 0) AS version FROM emr_record_history
+    WHERE patient_id = %s AND section_type = %s
+"""
+
+# LAST_HISTORY_VERSION_SQL for several sections at once; sections never written have no row
+LAST_HISTORY_VERSIONS_SQL = """
+    SELECT section_type, MAX(version) AS version FROM emr_record_history
+    WHERE patient_id = %s AND section_type IN ({placeholders})
+    GROUP BY section_type
+"""
+
+SELECT_HISTORY_SQL = """
+    SELECT version, kind, created_by, created_at FROM emr_record_history
+    WHERE patient_id = %s AND section_type = %s
+    ORDER BY version DESC
+    LIMIT %s
+"""
+
+# Rows needed to rebuild a version: the nearest snapshot (or delete) at or
+# before it, and every delta after that up to the version
+SELECT_VERSION_CHAIN_SQL = """
+    SELECT version, kind, UNCOMPRESS(payload) AS payload, created_by, created_at
+    FROM emr_record_history
+    WHERE patient_id = %s AND section_type = %s AND version <= %s
+      AND version >= (
+          SELECT COALESCE(MAX(version), 0) FROM emr_record_history
+          WHERE patient_id = %s AND section_type = %s AND version <= %s AND kind <> 'delta'
+      )
+    ORDER BY version
+"""
+
+HISTORY_PAGE_SIZE = 100
+
+
+def chain_params(patient_id, section_type, version):
+    return (patient_id, section_type, version, patient_id, section_type, version)
+
+def load_data(value):
+    """Decode a JSON column or payload that may come back as str or bytes"""
+    if value is None:
+        return None
+    if isinstance(value, (bytes, bytearray)):
+        value = value.decode('utf-8')
+    return json.loads(value) if isinstance(value, str) else value
+
+def json_delta(old, new, path=()):
+    """Compute the delta that turns document ``old`` into ``new``"""
+    delta = {'set': [], 'unset': []}
+    if not (isinstance(old, dict) and isinstance(new, dict)):
+        if old != new:
+            delta['set'].append([list(path), new])
+        return delta
+    for key in old:
+        if key not in new:
+            delta['unset'].append(list(path) + [key])
+    for key, value in new.items():
+        if key in old:
+            nested = json_delta(old[key], value, path + (key,))
+            delta['set'].extend(nested['set'])
+            delta['unset'].extend(nested['unset'])
+        else:
+            delta['set'].append([list(path) + [key], value])
+    return delta
+
+def apply_delta(doc, delta):
+    """Apply a json_delta() result to a document, returning the new document"""
+    for path, value in delta['set']:
+        if not path:
+            doc = value
+            continue
+        target = doc
+        for key in path[:-1]:
+            target = target[key]
+        target[path[-1]] = value
+    for path in delta['unset']:
+        target = doc
+        for key in path[:-1]:
+            target = target[key]
+        del target[path[-1]]
+    return doc
+
+def history_params(patient_id, section_type, version, before, after, created_by):
+    """INSERT_HISTORY_SQL params recording ``after`` as ``version`` of a section.
+
+    ``before`` is the previous version's data, or None if the section did not
+    exist; ``after`` is None for a delete.
+    """
+    if after is None:
+        return (patient_id, section_type, version, 'delete', None, created_by)
+    full = json.dumps(after, separators=(',', ':'))
+    if before is not None and version % config.EMR_SNAPSHOT_INTERVAL != 0:
+        delta = json.dumps(json_delta(before, after), separators=(',', ':'))
+        if len(delta) < len(full):
+            return (patient_id, section_type, version, 'delta', delta, created_by)
+    return (patient_id, section_type, version, 'snapshot', full, created_by)
+
+def insert_history_rows(cursor, rows):
+    """Insert several history_params() rows with one multi-row INSERT"""
+    if not rows:
+        return
+    sql = INSERT_HISTORY_SQL.split('VALUES')[0] + 'VALUES ' + ', '.join([HISTORY_ROW_SQL] * len(rows))
+    cursor.execute(sql, [value for row in rows for value in row])
+
+def rebuild_version(rows, version):
+    """Rebuild one version from SELECT_VERSION_CHAIN_SQL rows.
+
+    Returns None if the version is not in the history, otherwise a dict with
+    the version's data (None if the section was deleted) and its metadata.
+    """
+    if not rows or rows[-1]['version'] != version or rows[0]['kind'] == 'delta':
+        return None
+    data = None
+    for row in rows:
+        payload = load_data(row['payload'])
+        data = apply_delta(data, payload) if row['kind'] == 'delta' else payload
+    last = rows[-1]
+    return {
+        'version': version,
+        'deleted': last['kind'] == 'delete',
+        'data': data,
+        'created_by': last['created_by'],
+        'created_at': last['created_at'].isoformat() if last['created_at'] else None
+    }
+
+def serialize_history_entry(row):
+    return {
+        'version': row['version'],
+        'kind': row['kind'],
+        'created_by': row['created_by'],
+        'created_at': row['created_at'].isoformat() if row['created_at'] else None
+    }
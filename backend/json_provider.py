@@ -0,0 +1,145 @@
+"""Fast JSON encoding for API responses.
+
+Encodes with orjson when it is installed (and JSON_ENCODER allows it), and
+with the standard library otherwise; both produce the same compact UTF-8
+documents. Dates, datetimes and times become ISO 8601 strings, TIME columns
+(timedeltas) HH:MM:SS, Decimals and UUIDs strings, so rows can be encoded
+without converting them first.
+
+JSON that is already encoded, such as the ``emr_records.data`` column, is
+wrapped in RawJSON and spliced into the output unchanged instead of being
+parsed and dumped again.
+"""
+import dataclasses
+import json
+import re
+import secrets
+import uuid
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+from flask.json.provider import JSONProvider
+
+from config import config
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class RawJSON:
+    """JSON text that is already encoded, e.g. a JSON column read from the database"""
+
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text.decode('utf-8') if isinstance(text, (bytes, bytearray)) else text
+
+    def __eq__(self, other):
+        return isinstance(other, RawJSON) and other.text == self.text
+
+    def __repr__(self):
+        return f"RawJSON({self.text!r})"
+
+
+def raw_json(value):
+    """Wrap a JSON column value for passthrough; values a driver already parsed are kept"""
+    if isinstance(value, (str, bytes, bytearray)):
+        return RawJSON(value)
+    return value
+
+def format_time(value):
+    """HH:MM:SS for a MySQL TIME column, which comes back as a timedelta"""
+    seconds = int(value.total_seconds())
+    return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+def _default(value):
+    # orjson encodes datetimes, dates, times and UUIDs itself; json needs them all here
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, timedelta):
+        return format_time(value)
+    if isinstance(value, (Decimal, uuid.UUID)):
+        return str(value)
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return dataclasses.asdict(value)
+    if hasattr(value, '__html__'):
+        return str(value.__html__())
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+# RawJSON is encoded as a placeholder string and replaced afterwards; the
+# per-process nonce keeps stored text from ever looking like a placeholder
+_RAW_NONCE = secrets.token_hex(8)
+_RAW_MARKER = f"\x00{_RAW_NONCE}:"
+_RAW_PLACEHOLDER = re.compile(rf'"\\u0000{_RAW_NONCE}:(\d+)"'.encode('ascii'))
+
+if orjson is not None and config.JSON_ENCODER in ('auto', 'orjson'):
+    ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def _encode(obj, default):
+        return orjson.dumps(obj, default=default, option=ORJSON_OPTIONS)
+
+    loads = orjson.loads
+else:
+    if config.JSON_ENCODER == 'orjson':
+        raise RuntimeError('JSON_ENCODER=orjson but orjson is not installed')
+
+    def _encode(obj, default):
+        return json.dumps(obj, default=default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    loads = json.loads
+
+def encode(obj):
+    """Encode obj as compact UTF-8 JSON bytes"""
+    raw = []
+
+    def default(value):
+        if isinstance(value, RawJSON):
+            raw.append(value.text.encode('utf-8'))
+            return f"{_RAW_MARKER}{len(raw) - 1}"
+        return _default(value)
+
+    data = _encode(obj, default)
+    if raw:
+        data = _RAW_PLACEHOLDER.sub(lambda match: raw[int(match.group(1))], data)
+    return data
+
+def dumps(obj):
+    """Encode obj as a compact JSON string"""
+    return encode(obj).decode('utf-8')
+
+def iter_json_array(items, serialize=None, batch_size=500):
+    """Encode an iterable as a JSON array, yielding a chunk of bytes per batch of items"""
+    yield b'['
+    separator = b''
+    batch = []
+    for item in items:
+        batch.append(encode(serialize(item) if serialize else item))
+        if len(batch) >= batch_size:
+            yield separator + b','.join(batch)
+            separator, batch = b',', []
+    if batch:
+        yield separator + b','.join(batch)
+    yield b']\n'
+
+
+class FastJSONProvider(JSONProvider):
+    """Flask JSON provider backed by encode() and loads().
+
+    Output is always compact and keeps the keys in insertion order; the
+    formatting arguments of json.dumps() are accepted and ignored.
+    """
+
+    mimetype = 'application/json'
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj)
+
+    def loads(self, s, **kwargs):
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        # Trailing newline, as flask.jsonify has always sent
+        return self._app.response_class(encode(obj) + b'\n', mimetype=self.mimetype)
@@ -0,0 +1,229 @@
+"""Request and query instrumentation, exposed in the Prometheus text format.
+
+Every request's latency is recorded per route, and every query's latency and
+row count per SQL fingerprint: the statement with its literals and
+placeholders replaced by ``?``, so the label set stays small and no patient
+data reaches the metrics or the logs. Queries slower than SLOW_QUERY_MS are
+logged with the route that ran them. Each response also carries a
+Server-Timing header splitting its time into pool wait, queries and the rest
+(Python work such as JSON parsing and serialization), which browser dev tools
+show per request.
+
+Metrics live in process memory; with several workers each scrape of
+/metrics reports the worker that answered it. Recording is one
+perf_counter() pair and a locked dict update, cheap enough to leave on.
+"""
+import bisect
+import contextvars
+import hashlib
+import logging
+import re
+import threading
+import time
+
+from config import config
+
+# Latency buckets in seconds, shared by every histogram
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Query labels beyond this many distinct fingerprints are folded into "other"
+MAX_FINGERPRINTS = 500
+FINGERPRINT_MAX_LENGTH = 160
+
+slow_query_log = logging.getLogger('emr.slow_queries')
+
+
+class Histogram:
+    """Thread-safe cumulative histogram with one series per label set"""
+
+    def __init__(self, name, help_text, label_names, buckets=BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, labels, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        with self._lock:
+            snapshot = {labels: list(series) for labels, series in self._series.items()}
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(snapshot.items()):
+            base = _labels(self.label_names, labels)
+            prefix = f"{base}," if base else ""
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {series[-1]}')
+            suffix = f"{{{base}}}" if base else ""
+            lines.append(f"{self.name}_sum{suffix} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{suffix} {series[-1]}")
+        return lines
+
+
+class Counter:
+    """Thread-safe counter with one series per label set"""
+
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._series[labels] = self._series.get(labels, 0) + amount
+
+    def render(self):
+        with self._lock:
+            snapshot = dict(self._series)
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(snapshot.items()):
+            lines.append(f"{self.name}{{{_labels(self.label_names, labels)}}} {value}")
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names, values):
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+REQUEST_DURATION = Histogram(
+    'emr_http_request_duration_seconds', 'Time to handle a request, by route',
+    ('method', 'route', 'status'))
+QUERY_DURATION = Histogram(
+    'emr_db_query_duration_seconds', 'Time to run a query and fetch its result, by SQL fingerprint',
+    ('query',))
+QUERY_ROWS = Counter(
+    'emr_db_query_rows_total', 'Rows returned or affected, by SQL fingerprint', ('query',))
+POOL_WAIT = Histogram(
+    'emr_db_pool_wait_seconds', 'Time spent waiting to check out a pooled connection', ())
+SLOW_QUERIES = Counter(
+    'emr_db_slow_queries_total', f'Queries slower than SLOW_QUERY_MS ({config.SLOW_QUERY_MS} ms)',
+    ('query',))
+
+# ============== SQL FINGERPRINTS ==============
+
+_LITERALS = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"|\b\d+(?:\.\d+)?\b|%\(\w+\)s|%s|\?")
+_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_ROWS = re.compile(r"(\(\?\))(?:\s*,\s*\(\?\))+")
+_SPACE = re.compile(r"\s+")
+
+_fingerprints = {}  # statement -> fingerprint
+_shapes = set()
+_fingerprints_lock = threading.Lock()
+
+def fingerprint(sql):
+    """Normalize a statement to its shape: literals and lists collapsed to ?"""
+    cached = _fingerprints.get(sql)
+    if cached is not None:
+        return cached
+    shape = _SPACE.sub(' ', sql).strip()
+    shape = _LITERALS.sub('?', shape)
+    shape = _LISTS.sub('(?)', shape)
+    shape = _ROWS.sub(r'\1', shape)
+    if len(shape) > FINGERPRINT_MAX_LENGTH:
+        digest = hashlib.sha1(shape.encode('utf-8')).hexdigest()[:8]
+        shape = f"{shape[:FINGERPRINT_MAX_LENGTH]}... #{digest}"
+    with _fingerprints_lock:
+        if shape not in _shapes:
+            # Dynamic SQL with many shapes must not grow the label set without bound
+            if len(_shapes) >= MAX_FINGERPRINTS:
+                return 'other'
+            _shapes.add(shape)
+        # Statements built with their values inlined (multi-row inserts) are not kept
+        if len(sql) <= 4096 and len(_fingerprints) < MAX_FINGERPRINTS * 4:
+            _fingerprints[sql] = shape
+    return shape
+
+# ============== PER-REQUEST TIMINGS ==============
+
+class RequestTimings:
+    """Time one request spent waiting for the pool and running queries"""
+
+    __slots__ = ('route', 'started', 'pool_wait', 'query_time', 'queries')
+
+    def __init__(self, route):
+        self.route = route
+        self.started = time.perf_counter()
+        self.pool_wait = 0.0
+        self.query_time = 0.0
+        self.queries = 0
+
+    def server_timing(self):
+        total = time.perf_counter() - self.started
+        app = max(total - self.pool_wait - self.query_time, 0.0)
+        return (f'pool;dur={self.pool_wait * 1000:.2f}, '
+                f'db;dur={self.query_time * 1000:.2f};desc="{self.queries} queries", '
+                f'app;dur={app * 1000:.2f}, total;dur={total * 1000:.2f}')
+
+
+_current = contextvars.ContextVar('emr_request_timings', default=None)
+
+def start_request(route):
+    """Begin timing a request in the current thread or task"""
+    timings = RequestTimings(route)
+    _current.set(timings)
+    return timings
+
+def end_request(method, status):
+    """Record the current request's latency and return its timings"""
+    timings = _current.get()
+    if timings is None:
+        return None
+    _current.set(None)
+    REQUEST_DURATION.observe((method, timings.route, str(status)),
+                             time.perf_counter() - timings.started)
+    return timings
+
+def observe_pool_wait(seconds):
+    POOL_WAIT.observe((), seconds)
+    timings = _current.get()
+    if timings is not None:
+        timings.pool_wait += seconds
+
+def observe_query(sql, seconds, rows):
+    """Record one query; called by the instrumented cursors"""
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', 'replace')
+    shape = fingerprint(sql)
+    labels = (shape,)
+    QUERY_DURATION.observe(labels, seconds)
+    if rows and rows > 0:
+        QUERY_ROWS.inc(labels, rows)
+    timings = _current.get()
+    if timings is not None:
+        timings.query_time += seconds
+        timings.queries += 1
+    if seconds * 1000 >= config.SLOW_QUERY_MS:
+        SLOW_QUERIES.inc(labels)
+        # The fingerprint only, never the parameters: they hold patient data
+        slow_query_log.warning('slow query %.1f ms, %s rows, route %s: %s', seconds * 1000,
+                               rows, timings.route if timings else '-', shape)
+
+# ============== EXPOSITION ==============
+
+def render(gauges=()):
+    """Render every metric, plus ``gauges`` given as (name, help, value) tuples"""
+    lines = []
+    for metric in (REQUEST_DURATION, QUERY_DURATION, QUERY_ROWS, SLOW_QUERIES, POOL_WAIT):
+        lines.extend(metric.render())
+    for name, help_text, value in gauges:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {value}")
+    return '\n'.join(lines) + '\n'
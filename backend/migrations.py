@@ -0,0 +1,305 @@
+import pymysql
+
+from config import config
+from database import add_column_if_missing, backfill_visit_summary, db_connection
+
+# Named lock so that several workers starting at once don't migrate concurrently
+MIGRATION_LOCK = 'emr_schema_migrations'
+MIGRATION_LOCK_TIMEOUT = 60
+
+def add_index_if_missing(cursor, table, index, columns, kind='INDEX', parser=None, lock='NONE'):
+    """Add a secondary index, by default without blocking reads or writes on the table"""
+    cursor.execute("""
+        SELECT 1 FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+        LIMIT 1
+    """, (table, index))
+    if cursor.fetchone() is None:
+        with_parser = f" WITH PARSER {parser}" if parser else ""
+        cursor.execute(f"ALTER TABLE {table} ADD {kind} {index} ({columns}){with_parser}, "
+                       f"ALGORITHM=INPLACE, LOCK={lock}")
+        return True
+    return False
+
+# ============== MIGRATIONS ==============
+# MySQL commits DDL implicitly, so every migration must be safe to re-run if
+# it is interrupted before its version is recorded.
+
+def migrate_photo_hash(cursor):
+    add_column_if_missing(cursor, 'patients', 'photo_hash', 'CHAR(64) AFTER photo')
+
+def migrate_visit_summary(cursor):
+    if add_column_if_missing(cursor, 'patients', 'visit_count', 'INT NOT NULL DEFAULT 0 AFTER assigned_to'):
+        # The archive tables come later (migration 9), so there is nothing archived yet
+        backfill_visit_summary(cursor, include_archive=False)
+
+def migrate_query_indexes(cursor):
+    # Patient queue: newest first, optionally filtered by status, doctor or clinic
+    add_index_if_missing(cursor, 'patients', 'idx_patients_created', 'created_at, id')
+    add_index_if_missing(cursor, 'patients', 'idx_patients_status_created', 'status, created_at, id')
+    add_index_if_missing(cursor, 'patients', 'idx_patients_assigned_created', 'assigned_to, created_at, id')
+    add_index_if_missing(cursor, 'patients', 'idx_patients_clinic_created', 'last_clinic, created_at, id')
+    # Visit history, read newest first
+    add_index_if_missing(cursor, 'visits', 'idx_visits_patient_date', 'patient_id, visit_date, visit_time')
+    # Active alerts for a patient
+    add_index_if_missing(cursor, 'medical_alerts', 'idx_alerts_patient_active', 'patient_id, is_active')
+
+def migrate_row_versions(cursor):
+    # Row versions back the ETags of patient and EMR reads
+    add_column_if_missing(cursor, 'patients', 'version', 'INT NOT NULL DEFAULT 1 AFTER status')
+    add_column_if_missing(cursor, 'patients', 'emr_version', 'INT NOT NULL DEFAULT 1 AFTER version')
+    add_column_if_missing(cursor, 'emr_records', 'version', 'INT NOT NULL DEFAULT 1 AFTER data')
+
+def migrate_id_sequences(cursor):
+    from patient_ids import SEQUENCE_START
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS id_sequences (
+            name VARCHAR(50) PRIMARY KEY,
+            next_value BIGINT NOT NULL
+        )
+    """)
+    cursor.execute("INSERT IGNORE INTO id_sequences (name, next_value) VALUES ('patient', %s)",
+                   (SEQUENCE_START,))
+
+def migrate_patient_events(cursor):
+    # Outbox read by the change feed; ids are the cursors clients resume from
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS patient_events (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            patient_id VARCHAR(20) NOT NULL,
+            event_type VARCHAR(30) NOT NULL,
+            created_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+            INDEX idx_patient_events_created (created_at)
+        )
+    """)
+
+def migrate_emr_history(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS emr_record_history (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            patient_id VARCHAR(20) NOT NULL,
+            section_type VARCHAR(50) NOT NULL,
+            version INT NOT NULL,
+            kind ENUM('snapshot', 'delta', 'delete') NOT NULL,
+            payload MEDIUMBLOB,
+            created_by VARCHAR(100),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE KEY unique_section_version (patient_id, section_type, version)
+        )
+    """)
+    # Start every existing section's history with a snapshot of its current version
+    cursor.execute("""
+        INSERT IGNORE INTO emr_record_history
+            (patient_id, section_type, version, kind, payload, created_by, created_at)
+        SELECT patient_id, section_type, version, 'snapshot', COMPRESS(data), created_by,
+               COALESCE(updated_at, created_at)
+        FROM emr_records
+    """)
+
+def migrate_patient_search(cursor):
+    # Mobile numbers stripped of separators and reversed, so an ending is an index prefix
+    add_column_if_missing(cursor, 'patients', 'mobile_rev', """
+        VARCHAR(20) AS (REVERSE(REPLACE(REPLACE(REPLACE(mobile, ' ', ''), '-', ''), '+', ''))) VIRTUAL
+        AFTER mobile
+    """)
+    add_index_if_missing(cursor, 'patients', 'idx_patients_mobile_rev', 'mobile_rev')
+    add_index_if_missing(cursor, 'patients', 'idx_patients_name', 'name')
+    # The first FULLTEXT index rebuilds the table, which allows reads but not writes
+    add_index_if_missing(cursor, 'patients', 'ft_patients_name', 'name',
+                         kind='FULLTEXT INDEX', parser='ngram', lock='SHARED')
+
+def migrate_archive_tables(cursor):
+    # Same columns and ids as the hot tables, plus when each row was archived
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS visits_archive (
+            id INT PRIMARY KEY,
+            patient_id VARCHAR(20) NOT NULL,
+            visit_date DATE NOT NULL,
+            visit_time TIME,
+            visit_type VARCHAR(10),
+            purpose VARCHAR(255),
+            clinic VARCHAR(100),
+            location VARCHAR(100),
+            has_investigation BOOLEAN DEFAULT FALSE,
+            has_refraction BOOLEAN DEFAULT FALSE,
+            has_glaucoma BOOLEAN DEFAULT FALSE,
+            notes TEXT,
+            created_at TIMESTAMP NULL,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_visits_archive_patient_date (patient_id, visit_date, id),
+            FOREIGN KEY (patient_id) REFERENCES patients(id) ON DELETE CASCADE
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS medical_alerts_archive (
+            id INT PRIMARY KEY,
+            patient_id VARCHAR(20) NOT NULL,
+            alert_type VARCHAR(50) NOT NULL,
+            alert_value VARCHAR(255) NOT NULL,
+            is_active BOOLEAN DEFAULT FALSE,
+            created_at TIMESTAMP NULL,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_alerts_archive_patient (patient_id, id),
+            FOREIGN KEY (patient_id) REFERENCES patients(id) ON DELETE CASCADE
+        )
+    """)
+    # Let the archiver find rows past their retention period without a scan
+    add_index_if_missing(cursor, 'visits', 'idx_visits_date', 'visit_date')
+    add_index_if_missing(cursor, 'medical_alerts', 'idx_alerts_active_created', 'is_active, created_at')
+
+# (version, name, function) in the order they must be applied. SQLite
+# databases are created at the latest version, so mirror schema changes in
+# sqlite_storage.SCHEMA_SQL.
+MIGRATIONS = [
+    (1, 'patient photo store', migrate_photo_hash),
+    (2, 'denormalized visit summary', migrate_visit_summary),
+    (3, 'indexes for route queries', migrate_query_indexes),
+    (4, 'row versions for conditional requests', migrate_row_versions),
+    (5, 'patient ID sequence', migrate_id_sequences),
+    (6, 'patient change feed', migrate_patient_events),
+    (7, 'EMR section history', migrate_emr_history),
+    (8, 'patient search indexes', migrate_patient_search),
+    (9, 'visit and alert archive', migrate_archive_tables),
+]
+
+def applied_versions(cursor):
+    """Get the set of migration versions recorded as applied"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {row['version'] for row in cursor.fetchall()}
+
+def apply_migrations(conn):
+    """Apply all pending migrations in order and return the versions applied"""
+    applied = []
+    with conn.cursor(pymysql.cursors.DictCursor) as cursor:
+        cursor.execute("SELECT GET_LOCK(%s, %s) AS acquired", (MIGRATION_LOCK, MIGRATION_LOCK_TIMEOUT))
+        if not cursor.fetchone()['acquired']:
+            raise RuntimeError('Timed out waiting for another process to finish migrating')
+        try:
+            done = applied_versions(cursor)
+            for version, name, migrate in MIGRATIONS:
+                if version in done:
+                    continue
+                print(f"Applying migration {version}: {name}")
+                migrate(cursor)
+                cursor.execute("""
+                    INSERT INTO schema_migrations (version, name) VALUES (%s, %s)
+                """, (version, name))
+                conn.commit()
+                applied.append(version)
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (MIGRATION_LOCK,))
+    return applied
+
+# ============== QUERY PLAN CHECK ==============
+
+def split_statements(sql, params):
+    """Split a multi-statement query into (statement, params) pairs"""
+    params = list(params)
+    pairs = []
+    for statement in sql.split(';'):
+        count = statement.count('%s')
+        pairs.append((statement, tuple(params[:count])))
+        params = params[count:]
+    return pairs
+
+def route_queries():
+    """(route, sql, params, full_scan_ok) for each query the routes run, with sample params.
+
+    Built from the routes' own SQL constants and query builders, so the check
+    follows the queries as they change. Queries that return a whole table by
+    design are marked so the check does not flag them.
+    """
+    import app
+    import archive
+    import search
+
+    queries = [('get_all_patients', app.SELECT_ALL_PATIENTS_SQL, (), True)]
+    for arg, value in [(None, None), ('status', 'Waiting'), ('assigned_to', 'Unassigned'),
+                       ('last_clinic', 'CHN')]:
+        sql, params, _ = app.build_queue_query({arg: value} if arg else {})
+        queries.append((f"get_patient_queue?{arg}" if arg else 'get_patient_queue', sql, params, False))
+    for route, key, by in [('get_patient', 'P0', 'id'), ('get_patient_by_mr', 'MR0', 'mr_number')]:
+        sql, params = app.patient_aggregate_query(key, by, app.PATIENT_INCLUDES)
+        queries.extend((route, statement, statement_params, False)
+                       for statement, statement_params in split_statements(sql, params))
+    queries += [
+        ('get_patient_photo', app.SELECT_PHOTO_HASH_SQL, ('P0',), False),
+        ('get_patient_visits', app.SELECT_VISITS_SQL, ('P0',), False),
+        ('get_patient_visits?archived', *archive.build_archived_visits_query('P0', {})[:2], False),
+        ('get_patient_alerts', app.SELECT_ALERTS_SQL, ('P0',), False),
+        ('get_patient_alerts?archived', *archive.build_archived_alerts_query('P0', {})[:2], False),
+        ('get_all_emr_records', app.SELECT_EMR_RECORDS_SQL, ('P0',), False),
+        ('get_emr_record', app.SELECT_EMR_RECORD_SQL, ('P0', 'complaints'), False),
+        ('get_emr_record_version', app.SELECT_VERSION_CHAIN_SQL,
+         app.chain_params('P0', 'complaints', 1), False),
+        ('get_patient_changes', app.changes.read_sql(), (0, 500), False),
+        ('archiver?visits', archive.SELECT_OLD_VISITS_SQL, ('2000-01-01', 1000), False),
+        ('archiver?alerts', archive.SELECT_OLD_ALERTS_SQL, ('2000-01-01', 1000), False),
+    ]
+    # One query per kind of match: an MR number, a mobile ending and a name
+    for q in ('MR0', '3210', 'Ramesh'):
+        sql, params = search.build_search_query(app.QUEUE_COLUMNS, q, 1, search.SEARCH_PAGE_SIZE)
+        queries.append((f"search_patients?q={q}", sql, params, False))
+    return queries
+
+def explain_route_queries(cursor):
+    """EXPLAIN each route query and return the ones doing a full table scan.
+
+    MySQL may still prefer a scan on near-empty tables, so run this against a
+    populated database.
+    """
+    problems = []
+    for route, sql, params, full_scan_ok in route_queries():
+        cursor.execute(f"EXPLAIN {sql}", params)
+        for row in cursor.fetchall():
+            # <derivedN> and <unionN> rows scan the query's own temporary results
+            if (row.get('type') == 'ALL' and not full_scan_ok
+                    and not str(row.get('table') or '').startswith('<')):
+                problems.append({
+                    'route': route,
+                    'table': row.get('table'),
+                    'rows': row.get('rows'),
+                    'extra': row.get('Extra')
+                })
+    return problems
+
+def main(argv=None):
+    import argparse
+    from database import init_database
+
+    parser = argparse.ArgumentParser(description='EMR schema migrations')
+    parser.add_argument('command', nargs='?', default='migrate', choices=['migrate', 'status', 'explain'])
+    args = parser.parse_args(argv)
+
+    if args.command == 'migrate':
+        # init_database creates anything missing and then applies pending migrations
+        init_database()
+        return 0
+    if args.command == 'explain' and config.DB_BACKEND == 'sqlite':
+        print("explain checks MySQL query plans; use EXPLAIN QUERY PLAN with SQLite")
+        return 1
+
+    with db_connection() as conn:
+        with conn.cursor() as cursor:
+            if args.command == 'status':
+                done = applied_versions(cursor)
+                for version, name, _ in MIGRATIONS:
+                    print(f"{version:>4}  {'applied' if version in done else 'pending':<8} {name}")
+                return 0
+            problems = explain_route_queries(cursor)
+
+    for problem in problems:
+        print(f"{problem['route']}: full scan of {problem['table']} "
+              f"(~{problem['rows']} rows) {problem['extra'] or ''}")
+    print(f"{len(problems)} route queries doing a full table scan")
+    return 1 if problems else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,103 @@
+import os
+import threading
+
+from config import config
+from database import db_connection
+
+# Legacy IDs were P0..P999999 (a timestamp modulo 1,000,000), so the sequence
+# starts above that range and can never hand out an ID already in use.
+SEQUENCE_START = 1000000
+ID_PREFIX = 'P'
+
+def reserve_block(name, size):
+    """Atomically reserve ``size`` values from a sequence; returns (first, last)"""
+    with db_connection() as conn:
+        with conn.cursor() as cursor:
+            # LAST_INSERT_ID(expr) makes the new value readable on this connection
+            # without holding a lock past the commit
+            cursor.execute("""
+                UPDATE id_sequences
+                SET next_value = LAST_INSERT_ID(next_value + %s)
+                WHERE name = %s
+            """, (size, name))
+            if cursor.rowcount != 1:
+                raise RuntimeError(f"ID sequence {name!r} does not exist; run database migrations")
+            cursor.execute("SELECT LAST_INSERT_ID() AS next_value")
+            end = cursor.fetchone()['next_value']
+            conn.commit()
+    return end - size, end - 1
+
+
+class IdAllocator:
+    """Hands out unique IDs from blocks reserved in the database (hi/lo).
+
+    Each process reserves a block of ``block_size`` values with one atomic
+    UPDATE and then allocates from it in memory, so IDs stay unique across
+    threads and worker processes while costing a round trip only once per
+    block. Values left in a block when a process exits are simply skipped.
+    """
+
+    def __init__(self, sequence='patient', block_size=100, prefix=ID_PREFIX, reserve=reserve_block):
+        self.sequence = sequence
+        self.block_size = block_size
+        self.prefix = prefix
+        self._reserve = reserve
+        self._lock = threading.Lock()
+        self._next = 0
+        self._last = -1
+        self._pid = os.getpid()
+
+    def next_id(self):
+        """Allocate the next ID, e.g. 'P1000042'"""
+        with self._lock:
+            # A forked worker must not reuse the block it inherited from its parent
+            if self._pid != os.getpid():
+                self._next, self._last, self._pid = 0, -1, os.getpid()
+            if self._next > self._last:
+                self._next, self._last = self._reserve(self.sequence, self.block_size)
+            value = self._next
+            self._next += 1
+        return f"{self.prefix}{value}"
+
+    __call__ = next_id
+
+
+patient_ids = IdAllocator(block_size=config.PATIENT_ID_BLOCK_SIZE)
+
+def new_patient_id():
+    """Allocate a new patient ID"""
+    return patient_ids.next_id()
+
+def stress(workers=8, processes=4, count=5000):
+    """Allocate IDs from many threads in several processes and check for duplicates"""
+    import time
+    from concurrent.futures import ProcessPoolExecutor
+
+    started = time.monotonic()
+    with ProcessPoolExecutor(processes) as pool:
+        results = list(pool.map(_stress_process, [(workers, count)] * processes))
+    elapsed = time.monotonic() - started
+
+    ids = [patient_id for result in results for patient_id in result]
+    duplicates = len(ids) - len(set(ids))
+    print(f"Allocated {len(ids)} IDs in {elapsed:.2f}s ({len(ids) / elapsed:,.0f}/s) "
+          f"across {processes} processes x {workers} threads; {duplicates} duplicates")
+    return duplicates
+
+def _stress_process(args):
+    from concurrent.futures import ThreadPoolExecutor
+
+    workers, count = args
+    allocator = IdAllocator(block_size=config.PATIENT_ID_BLOCK_SIZE)
+    with ThreadPoolExecutor(workers) as pool:
+        return list(pool.map(lambda _: allocator.next_id(), range(count)))
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Stress-test patient ID allocation against the database')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--count', type=int, default=5000, help='IDs per process')
+    args = parser.parse_args()
+    raise SystemExit(1 if stress(args.threads, args.processes, args.count) else 0)
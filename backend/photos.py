@@ -0,0 +1,107 @@
+import base64
+import binascii
+import hashlib
+import io
+
+from PIL import Image, UnidentifiedImageError
+
+from database import db_connection
+
+# Longest edge of the thumbnails shown in lists and headers
+THUMBNAIL_SIZE = (128, 128)
+THUMBNAIL_QUALITY = 80
+
+def decode_photo(value):
+    """Decode an inline photo (data URL or bare base64) into (bytes, content_type).
+
+    Returns None when the value is not inline image data, e.g. the photo URL
+    the API handed out earlier being sent back unchanged.
+    """
+    if not value or not isinstance(value, str):
+        return None
+    if value.startswith(('http://', 'https://', '/')):
+        return None
+
+    content_type = None
+    if value.startswith('data:'):
+        header, _, value = value.partition(',')
+        if ';base64' not in header:
+            raise ValueError('Photo data URL must be base64 encoded')
+        content_type = header[5:].split(';')[0] or None
+
+    try:
+        data = base64.b64decode(value, validate=True)
+    except (binascii.Error, ValueError):
+        raise ValueError('Photo is not valid base64 data')
+
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            content_type = content_type or Image.MIME.get(image.format)
+    except UnidentifiedImageError:
+        raise ValueError('Photo is not a recognised image')
+    return data, content_type or 'application/octet-stream'
+
+def make_thumbnail(data):
+    """Scale an image down to THUMBNAIL_SIZE and re-encode it as JPEG"""
+    with Image.open(io.BytesIO(data)) as image:
+        image = image.convert('RGB')
+        image.thumbnail(THUMBNAIL_SIZE)
+        out = io.BytesIO()
+        image.save(out, format='JPEG', quality=THUMBNAIL_QUALITY, optimize=True)
+        return out.getvalue()
+
+def store_photo(cursor, value):
+    """Store an inline photo in patient_photos and return its content hash.
+
+    Identical images are stored once. Returns None if ``value`` carries no
+    inline image data.
+    """
+    decoded = decode_photo(value)
+    if decoded is None:
+        return None
+    data, content_type = decoded
+    photo_hash = hashlib.sha256(data).hexdigest()
+
+    cursor.execute("SELECT 1 FROM patient_photos WHERE hash = %s", (photo_hash,))
+    if cursor.fetchone() is None:
+        cursor.execute("""
+            INSERT IGNORE INTO patient_photos (hash, content_type, size, data, thumbnail)
+            VALUES (%s, %s, %s, %s, %s)
+        """, (photo_hash, content_type, len(data), data, make_thumbnail(data)))
+    return photo_hash
+
+def migrate_inline_photos(batch_size=100):
+    """Move photos still stored inline in patients.photo into patient_photos"""
+    migrated = 0
+    last_id = ''
+    while True:
+        with db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT id, photo FROM patients
+                    WHERE photo IS NOT NULL AND id > %s
+                    ORDER BY id
+                    LIMIT %s
+                """, (last_id, batch_size))
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                for row in rows:
+                    last_id = row['id']
+                    try:
+                        photo_hash = store_photo(cursor, row['photo'])
+                    except ValueError as e:
+                        # Leave the inline photo in place so nothing is lost
+                        print(f"Skipping unreadable photo for patient {row['id']}: {e}")
+                        continue
+                    cursor.execute("""
+                        UPDATE patients SET photo_hash = %s, photo = NULL
+                        WHERE id = %s
+                    """, (photo_hash, row['id']))
+                    migrated += 1
+                conn.commit()
+    print(f"Migrated {migrated} inline photos")
+    return migrated
+
+if __name__ == "__main__":
+    migrate_inline_photos()
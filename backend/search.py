@@ -0,0 +1,196 @@
+"""Ranked patient search across name, mobile number and MR number.
+
+Each kind of match is a separate index lookup, capped at SEARCH_MAX_RESULTS
+rows, and the candidates are merged and ranked in one query:
+
+    exact MR number > MR number prefix > mobile number ending > name prefix > fuzzy name
+
+Fuzzy name matching uses the FULLTEXT index on patients.name, built with the
+ngram parser so that partial words and misspellings still share most of their
+two-letter tokens with the stored name. SQLite has only an FTS5 trigram index,
+which a short typo such as "alcie" for "Alice" can miss entirely, so there the
+names with a word starting like the query are also scored by edit distance
+(name_similarity). Mobile endings are matched as a prefix of the indexed
+``mobile_rev`` column, which holds the digits reversed.
+"""
+import re
+
+from config import config
+
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+# Results past this depth are not served; staff refine the query instead
+SEARCH_MAX_RESULTS = 500
+SEARCH_MIN_LENGTH = 2
+SEARCH_MAX_LENGTH = 100
+MOBILE_MIN_DIGITS = 3
+
+# Rank of each kind of match, best first
+MATCH_KINDS = {
+    5: 'mr_number',
+    4: 'mr_number_prefix',
+    3: 'mobile',
+    2: 'name_prefix',
+    1: 'name'
+}
+
+
+# MySQL and SQLite disagree on the default LIKE escape, so name one explicitly
+LIKE_ESCAPE = '!'
+
+# Fuzzy name match: rows sharing any of the query's n-grams, best overlap first
+FUZZY_NAME_SQL = """
+    SELECT id, 1 AS rank_tier, MATCH(name) AGAINST (%s IN NATURAL LANGUAGE MODE) AS relevance
+    FROM patients WHERE MATCH(name) AGAINST (%s IN NATURAL LANGUAGE MODE)
+    ORDER BY relevance DESC LIMIT %s
+"""
+
+if config.DB_BACKEND == 'sqlite':
+    # FTS5 trigram index; bm25() is lower for better matches
+    FUZZY_NAME_SQL = """
+        SELECT p.id, 1 AS rank_tier, -bm25(patients_fts) AS relevance
+        FROM patients_fts JOIN patients p ON p.rowid = patients_fts.rowid
+        WHERE patients_fts MATCH %s
+        ORDER BY relevance DESC LIMIT %s
+    """
+
+# Typos that share no trigram with the name; NAME_SIMILARITY is registered by
+# sqlite_storage and is 0 for names too far from the query
+TYPO_NAME_SQL = f"""
+    SELECT id, 1 AS rank_tier, NAME_SIMILARITY(name, %s) AS relevance
+    FROM patients
+    WHERE (name LIKE %s ESCAPE '{LIKE_ESCAPE}' OR name LIKE %s ESCAPE '{LIKE_ESCAPE}')
+      AND NAME_SIMILARITY(name, %s) > 0
+    ORDER BY relevance DESC LIMIT %s
+"""
+
+
+def escape_like(value):
+    """Escape LIKE wildcards so the value only matches literally"""
+    for char in (LIKE_ESCAPE, '%', '_'):
+        value = value.replace(char, LIKE_ESCAPE + char)
+    return value
+
+def fuzzy_name_params(q):
+    """Params for FUZZY_NAME_SQL"""
+    if config.DB_BACKEND != 'sqlite':
+        return (q, q, SEARCH_MAX_RESULTS)
+    # Any of the query's trigrams, each quoted as an FTS5 string
+    words = q.lower().split()
+    trigrams = {word[i:i + 3] for word in words for i in range(len(word) - 2)} or set(words)
+    expression = ' OR '.join('"' + gram.replace('"', '""') + '"' for gram in sorted(trigrams))
+    return (expression, SEARCH_MAX_RESULTS)
+
+def typo_name_params(q):
+    """Params for TYPO_NAME_SQL: names with a word starting like the query's first word"""
+    initial = escape_like(q[0])
+    return (q, initial + '%', '% ' + initial + '%', q, SEARCH_MAX_RESULTS)
+
+def edit_distance(a, b, limit):
+    """Edits (insert, delete, substitute, swap adjacent) turning a into b, capped at limit + 1"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous, current = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        before, previous, current = previous, current, [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+    return min(current[len(b)], limit + 1)
+
+def name_similarity(name, q):
+    """Score in (0, 1] for a name whose words match every query word within a
+    typo or two (one for words of up to five letters), else 0"""
+    if not name or not q:
+        return 0
+    words = name.lower().split()
+    total = 0
+    for term in q.lower().split():
+        limit = 1 if len(term) <= 5 else 2
+        distance = min(edit_distance(term, word, limit) for word in words)
+        if distance > limit:
+            return 0
+        total += 1 - distance / max(len(term), 1)
+    return total / len(q.split())
+
+def parse_search_args(args):
+    """Read q, page and limit from request args, raising ValueError if invalid"""
+    q = ' '.join((args.get('q') or '').split())
+    if len(q) < SEARCH_MIN_LENGTH:
+        raise ValueError(f'q must be at least {SEARCH_MIN_LENGTH} characters')
+    if len(q) > SEARCH_MAX_LENGTH:
+        raise ValueError(f'q must be at most {SEARCH_MAX_LENGTH} characters')
+    try:
+        page = max(int(args.get('page', 1)), 1)
+        limit = min(max(int(args.get('limit', SEARCH_PAGE_SIZE)), 1), SEARCH_MAX_PAGE_SIZE)
+    except ValueError:
+        raise ValueError('page and limit must be integers')
+    return q, page, limit
+
+def candidate_queries(q):
+    """(sql, params) for each kind of match that applies to the query"""
+    prefix = escape_like(q) + '%'
+    queries = [
+        ("SELECT id, 5 AS rank_tier, 0 AS relevance FROM patients WHERE mr_number = %s", (q,)),
+        (f"""SELECT id, 4 AS rank_tier, 0 AS relevance FROM patients
+            WHERE mr_number LIKE %s ESCAPE '{LIKE_ESCAPE}'
+            ORDER BY mr_number LIMIT %s""", (prefix, SEARCH_MAX_RESULTS)),
+    ]
+    digits = re.sub(r'\D', '', q)
+    # Only treat the query as a phone number if it is nothing else
+    if len(digits) >= MOBILE_MIN_DIGITS and not re.search(r'[^\d\s()+-]', q):
+        queries.append(("""SELECT id, 3 AS rank_tier, 0 AS relevance FROM patients
+            WHERE mobile_rev LIKE %s
+            ORDER BY mobile_rev LIMIT %s""", (digits[::-1] + '%', SEARCH_MAX_RESULTS)))
+    if re.search(r'[^\W\d_]', q):
+        queries.append((f"""SELECT id, 2 AS rank_tier, 0 AS relevance FROM patients
+            WHERE name LIKE %s ESCAPE '{LIKE_ESCAPE}'
+            ORDER BY name, id LIMIT %s""", (prefix, SEARCH_MAX_RESULTS)))
+        queries.append((FUZZY_NAME_SQL, fuzzy_name_params(q)))
+        if config.DB_BACKEND == 'sqlite':
+            queries.append((TYPO_NAME_SQL, typo_name_params(q)))
+    return queries
+
+def build_search_query(columns, q, page, limit):
+    """Build the SQL for one page of ranked results.
+
+    Returns (sql, params); fetches one extra row to tell whether another page exists.
+    """
+    queries = candidate_queries(q)
+    # Derived tables, since SQLite does not allow parenthesized SELECTs in a UNION
+    union = '\nUNION ALL\n'.join(f"SELECT * FROM ({sql}) c{i}" for i, (sql, _) in enumerate(queries))
+    params = [param for _, query_params in queries for param in query_params]
+    offset = (page - 1) * limit
+    fetch = max(min(limit + 1, SEARCH_MAX_RESULTS - offset), 0)
+    sql = f"""
+        SELECT {columns}, m.rank_tier, m.relevance
+        FROM (
+            SELECT id, MAX(rank_tier) AS rank_tier, MAX(relevance) AS relevance
+            FROM ({union}) candidates
+            GROUP BY id
+        ) m
+        JOIN patients p ON p.id = m.id
+        ORDER BY m.rank_tier DESC, m.relevance DESC, p.name, p.id
+        LIMIT %s OFFSET %s
+    """
+    return sql, (*params, fetch, offset)
+
+def search_page(rows, page, limit, serialize):
+    """Build the search response body from up to limit + 1 fetched rows"""
+    results = []
+    for row in rows[:limit]:
+        tier = row.pop('rank_tier')
+        row.pop('relevance')
+        patient = serialize(row)
+        patient['match'] = MATCH_KINDS[tier]
+        results.append(patient)
+    return {
+        'patients': results,
+        'page': page,
+        'limit': limit,
+        'has_more': len(rows) > limit
+    }
@@ -0,0 +1,94 @@
+"""Production entry point: serves the API with gunicorn using settings from Config.
+
+    python database.py init    # once per deployment: create/migrate the schema
+    python serve.py            # start the workers
+    python serve.py --async    # or serve async_app with uvicorn
+
+Workers never run schema DDL. Each one opens its own connection pool lazily
+after the fork, so adding workers scales throughput without extra startup work.
+"""
+import argparse
+import os
+
+from gunicorn.app.base import BaseApplication
+
+from config import config
+
+
+class EMRServer(BaseApplication):
+    """Gunicorn application that loads the Flask app from the app factory"""
+
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            if key in self.cfg.settings and value is not None:
+                self.cfg.set(key, value)
+
+    def load(self):
+        from app import create_app
+        return create_app()
+
+
+def server_options(workers, threads, bind):
+    return {
+        'bind': bind,
+        'workers': workers,
+        'threads': threads,
+        # Threaded workers keep idle keep-alive connections cheap
+        'worker_class': 'gthread' if threads > 1 else 'sync',
+        'keepalive': config.WEB_KEEPALIVE,
+        'timeout': config.WEB_TIMEOUT,
+        'backlog': config.WEB_BACKLOG,
+        'max_requests': config.WEB_MAX_REQUESTS,
+        'max_requests_jitter': config.WEB_MAX_REQUESTS // 10,
+        # Import the app once in the master; workers share its memory copy-on-write
+        'preload_app': True,
+        'accesslog': '-',
+    }
+
+
+def run_async(workers, bind):
+    """Serve async_app with uvicorn; one event loop per worker process"""
+    import uvicorn
+
+    host, port = bind.rsplit(':', 1)
+    uvicorn.run(
+        'async_app:app',
+        host=host,
+        port=int(port),
+        workers=workers,
+        timeout_keep_alive=config.WEB_KEEPALIVE,
+        backlog=config.WEB_BACKLOG,
+        limit_max_requests=config.WEB_MAX_REQUESTS or None,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the EMR API with gunicorn')
+    parser.add_argument('--workers', type=int, default=config.WEB_WORKERS)
+    parser.add_argument('--threads', type=int, default=config.WEB_THREADS)
+    parser.add_argument('--bind', default=f"{config.WEB_HOST}:{config.FLASK_PORT}")
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help='serve the ASGI app (async_app.py) with uvicorn instead of gunicorn')
+    args = parser.parse_args(argv)
+
+    if args.workers > 1 and config.CACHE_BACKEND == 'memory':
+        # A per-process cache would miss invalidations made by the other workers
+        print("CACHE_BACKEND=memory is per process; using the shared sqlite cache for multiple workers")
+        config.CACHE_BACKEND = 'sqlite'
+        # uvicorn workers are spawned, not forked, and read the setting afresh
+        os.environ['CACHE_BACKEND'] = 'sqlite'
+
+    if args.use_async and config.DB_BACKEND == 'sqlite':
+        parser.error('--async needs MySQL (aiomysql); DB_BACKEND=sqlite serves with gunicorn only')
+    if args.use_async:
+        run_async(args.workers, args.bind)
+    else:
+        EMRServer(server_options(args.workers, args.threads, args.bind)).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,539 @@
+"""Embedded SQLite storage, used instead of MySQL when DB_BACKEND=sqlite.
+
+Meant for single-machine clinics, tests and benchmarks: no server to run,
+and each query is a function call instead of a network round trip.
+
+SQLiteConnection mimics the parts of a pymysql connection the app uses
+(dict rows, ``%s`` and ``%(name)s`` placeholders, multi-statement queries
+with nextset(), pymysql exception types), so the route code and the
+connection pool work unchanged. The MySQL functions the queries call
+(CURDATE(), COMPRESS(), LAST_INSERT_ID(), ...) are registered as SQL
+functions; the few statements with no SQLite equivalent have SQLite
+variants next to the MySQL ones, chosen with ``config.DB_BACKEND``.
+
+The database runs in WAL mode, so readers never wait for the writer.
+Writers are serialized: the first write of a transaction, or a
+``SELECT ... FOR UPDATE``, starts it with BEGIN IMMEDIATE. EMR data is
+stored as text checked and patched with the JSON1 functions.
+"""
+import random
+import re
+import sqlite3
+import time
+import zlib
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+
+import pymysql
+
+import metrics
+from config import config
+from search import name_similarity
+
+# Compiled statements kept per connection; queries are translated once, so
+# each distinct statement is parsed once per connection
+STATEMENT_CACHE_SIZE = 256
+
+_PLACEHOLDER = re.compile(r"%\((\w+)\)s|%s|%%|'(?:[^']|'')*'")
+_FOR_UPDATE = re.compile(r"\s+FOR\s+UPDATE\s*$", re.IGNORECASE)
+_READ_STATEMENTS = ('SELECT', 'WITH', 'PRAGMA', 'EXPLAIN')
+
+SCHEMA_SQL = """
+    CREATE TABLE IF NOT EXISTS patients (
+        id VARCHAR(20) PRIMARY KEY,
+        mr_number VARCHAR(50) COLLATE NOCASE UNIQUE NOT NULL,
+        name VARCHAR(255) COLLATE NOCASE NOT NULL,
+        parent_info VARCHAR(255),
+        age INT,
+        gender VARCHAR(20),
+        dob DATE,
+        mobile VARCHAR(20),
+        mobile_rev VARCHAR(20) COLLATE NOCASE GENERATED ALWAYS AS (
+            REVERSE(REPLACE(REPLACE(REPLACE(mobile, ' ', ''), '-', ''), '+', ''))
+        ) VIRTUAL,
+        city VARCHAR(100),
+        state VARCHAR(100),
+        photo TEXT,
+        photo_hash CHAR(64),
+        purpose VARCHAR(255),
+        visit_type VARCHAR(10) DEFAULT 'N',
+        allergies TEXT,
+        conditions TEXT,
+        assigned_to VARCHAR(255) DEFAULT 'Unassigned',
+        visit_count INT NOT NULL DEFAULT 0,
+        last_visit_date DATE,
+        last_clinic VARCHAR(100),
+        status VARCHAR(50) DEFAULT 'Waiting',
+        version INT NOT NULL DEFAULT 1,
+        emr_version INT NOT NULL DEFAULT 1,
+        created_at TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+        updated_at TIMESTAMP DEFAULT (datetime('now', 'localtime'))
+    );
+    CREATE INDEX IF NOT EXISTS idx_patients_created ON patients (created_at, id);
+    CREATE INDEX IF NOT EXISTS idx_patients_status_created ON patients (status, created_at, id);
+    CREATE INDEX IF NOT EXISTS idx_patients_assigned_created ON patients (assigned_to, created_at, id);
+    CREATE INDEX IF NOT EXISTS idx_patients_clinic_created ON patients (last_clinic, created_at, id);
+    CREATE INDEX IF NOT EXISTS idx_patients_mobile_rev ON patients (mobile_rev);
+    CREATE INDEX IF NOT EXISTS idx_patients_name ON patients (name, id);
+    CREATE TRIGGER IF NOT EXISTS patients_updated_at AFTER UPDATE ON patients
+    WHEN NEW.updated_at IS OLD.updated_at BEGIN
+        UPDATE patients SET updated_at = datetime('now', 'localtime') WHERE id = NEW.id;
+    END;
+
+    -- Trigram index for fuzzy name search, kept in step with patients.name
+    CREATE VIRTUAL TABLE IF NOT EXISTS patients_fts USING fts5(
+        name, content='patients', content_rowid='rowid', tokenize='trigram'
+    );
+    CREATE TRIGGER IF NOT EXISTS patients_fts_insert AFTER INSERT ON patients BEGIN
+        INSERT INTO patients_fts (rowid, name) VALUES (NEW.rowid, NEW.name);
+    END;
+    CREATE TRIGGER IF NOT EXISTS patients_fts_update AFTER UPDATE OF name ON patients BEGIN
+        INSERT INTO patients_fts (patients_fts, rowid, name) VALUES ('delete', OLD.rowid, OLD.name);
+        INSERT INTO patients_fts (rowid, name) VALUES (NEW.rowid, NEW.name);
+    END;
+    CREATE TRIGGER IF NOT EXISTS patients_fts_delete AFTER DELETE ON patients BEGIN
+        INSERT INTO patients_fts (patients_fts, rowid, name) VALUES ('delete', OLD.rowid, OLD.name);
+    END;
+
+    CREATE TABLE IF NOT EXISTS patient_photos (
+        hash CHAR(64) PRIMARY KEY,
+        content_type VARCHAR(50) NOT NULL,
+        size INT NOT NULL,
+        data BLOB NOT NULL,
+        thumbnail BLOB,
+        created_at TIMESTAMP DEFAULT (datetime('now', 'localtime'))
+    );
+
+    CREATE TABLE IF NOT EXISTS visits (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        patient_id VARCHAR(20) NOT NULL REFERENCES patients(id) ON DELETE CASCADE,
+        visit_date DATE NOT NULL,
+        visit_time TIME,
+        visit_type VARCHAR(10),
+        purpose VARCHAR(255),
+        clinic VARCHAR(100),
+        location VARCHAR(100),
+        has_investigation BOOLEAN DEFAULT FALSE,
+        has_refraction BOOLEAN DEFAULT FALSE,
+        has_glaucoma BOOLEAN DEFAULT FALSE,
+        notes TEXT,
+        created_at TIMESTAMP DEFAULT (datetime('now', 'localtime'))
+    );
+    CREATE INDEX IF NOT EXISTS idx_visits_patient_date ON visits (patient_id, visit_date, visit_time);
+    CREATE INDEX IF NOT EXISTS idx_visits_date ON visits (visit_date);
+
+    CREATE TABLE IF NOT EXISTS medical_alerts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        patient_id VARCHAR(20) NOT NULL REFERENCES patients(id) ON DELETE CASCADE,
+        alert_type VARCHAR(50) NOT NULL,
+        alert_value VARCHAR(255) NOT NULL,
+        is_active BOOLEAN DEFAULT TRUE,
+        created_at TIMESTAMP DEFAULT (datetime('now', 'localtime'))
+    );
+    CREATE INDEX IF NOT EXISTS idx_alerts_patient_active ON medical_alerts (patient_id, is_active);
+    CREATE INDEX IF NOT EXISTS idx_alerts_active_created ON medical_alerts (is_active, created_at);
+
+    CREATE TABLE IF NOT EXISTS visits_archive (
+        id INTEGER PRIMARY KEY,
+        patient_id VARCHAR(20) NOT NULL REFERENCES patients(id) ON DELETE CASCADE,
+        visit_date DATE NOT NULL,
+        visit_time TIME,
+        visit_type VARCHAR(10),
+        purpose VARCHAR(255),
+        clinic VARCHAR(100),
+        location VARCHAR(100),
+        has_investigation BOOLEAN DEFAULT FALSE,
+        has_refraction BOOLEAN DEFAULT FALSE,
+        has_glaucoma BOOLEAN DEFAULT FALSE,
+        notes TEXT,
+        created_at TIMESTAMP,
+        archived_at TIMESTAMP DEFAULT (datetime('now', 'localtime'))
+    );
+    CREATE INDEX IF NOT EXISTS idx_visits_archive_patient_date ON visits_archive (patient_id, visit_date, id);
+
+    CREATE TABLE IF NOT EXISTS medical_alerts_archive (
+        id INTEGER PRIMARY KEY,
+        patient_id VARCHAR(20) NOT NULL REFERENCES patients(id) ON DELETE CASCADE,
+        alert_type VARCHAR(50) NOT NULL,
+        alert_value VARCHAR(255) NOT NULL,
+        is_active BOOLEAN DEFAULT FALSE,
+        created_at TIMESTAMP,
+        archived_at TIMESTAMP DEFAULT (datetime('now', 'localtime'))
+    );
+    CREATE INDEX IF NOT EXISTS idx_alerts_archive_patient ON medical_alerts_archive (patient_id, id);
+
+    CREATE TABLE IF NOT EXISTS emr_records (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        patient_id VARCHAR(20) NOT NULL REFERENCES patients(id) ON DELETE CASCADE,
+        visit_id INT,
+        section_type VARCHAR(50) NOT NULL,
+        data TEXT NOT NULL CHECK (json_valid(data)),
+        version INT NOT NULL DEFAULT 1,
+        created_by VARCHAR(100),
+        created_at TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+        updated_at TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+        UNIQUE (patient_id, section_type)
+    );
+    CREATE TRIGGER IF NOT EXISTS emr_records_updated_at AFTER UPDATE ON emr_records
+    WHEN NEW.updated_at IS OLD.updated_at BEGIN
+        UPDATE emr_records SET updated_at = datetime('now', 'localtime') WHERE id = NEW.id;
+    END;
+
+    CREATE TABLE IF NOT EXISTS emr_record_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        patient_id VARCHAR(20) NOT NULL,
+        section_type VARCHAR(50) NOT NULL,
+        version INT NOT NULL,
+        kind TEXT NOT NULL CHECK (kind IN ('snapshot', 'delta', 'delete')),
+        payload BLOB,
+        created_by VARCHAR(100),
+        created_at TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+        UNIQUE (patient_id, section_type, version)
+    );
+
+    CREATE TABLE IF NOT EXISTS id_sequences (
+        name VARCHAR(50) PRIMARY KEY,
+        next_value BIGINT NOT NULL
+    );
+
+    -- AUTOINCREMENT so pruning the newest events never lets an id (a client cursor) be reused
+    CREATE TABLE IF NOT EXISTS patient_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        patient_id VARCHAR(20) NOT NULL,
+        event_type VARCHAR(30) NOT NULL,
+        created_at TIMESTAMP NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime'))
+    );
+    CREATE INDEX IF NOT EXISTS idx_patient_events_created ON patient_events (created_at);
+
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INT PRIMARY KEY,
+        name VARCHAR(255) NOT NULL,
+        applied_at TIMESTAMP DEFAULT (datetime('now', 'localtime'))
+    );
+"""
+
+# ============== TYPES ==============
+# Values come back as the same Python types pymysql returns for MySQL
+
+def _convert_timestamp(value):
+    return datetime.fromisoformat(value.decode())
+
+def _convert_date(value):
+    return date.fromisoformat(value.decode())
+
+def _convert_time(value):
+    hours, minutes, seconds = value.decode().split(':')
+    return timedelta(hours=int(hours), minutes=int(minutes), seconds=float(seconds))
+
+sqlite3.register_converter('TIMESTAMP', _convert_timestamp)
+sqlite3.register_converter('DATE', _convert_date)
+sqlite3.register_converter('TIME', _convert_time)
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(' '))
+sqlite3.register_adapter(date, lambda value: value.isoformat())
+
+# ============== MYSQL FUNCTIONS ==============
+
+def _compress(value):
+    """MySQL COMPRESS(): 4-byte little-endian length, then zlib data"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = value.encode('utf-8')
+    if not value:
+        return b''
+    return len(value).to_bytes(4, 'little') + zlib.compress(value)
+
+def _uncompress(value):
+    if value is None:
+        return None
+    if not value:
+        return b''
+    return zlib.decompress(bytes(value)[4:])
+
+def _reverse(value):
+    return None if value is None else value[::-1]
+
+def _register_functions(conn, state):
+    def last_insert_id(*args):
+        # LAST_INSERT_ID(expr) remembers expr for this connection, as in MySQL
+        if args:
+            state['last_insert_id'] = args[0]
+        return state.get('last_insert_id', 0)
+
+    conn.create_function('CURDATE', 0, lambda: date.today().isoformat())
+    conn.create_function('CURTIME', 0, lambda: datetime.now().strftime('%H:%M:%S'))
+    conn.create_function('NOW', 0, lambda: datetime.now().isoformat(' ', 'seconds'))
+    conn.create_function('RAND', 0, random.random)
+    conn.create_function('COMPRESS', 1, _compress, deterministic=True)
+    conn.create_function('UNCOMPRESS', 1, _uncompress, deterministic=True)
+    conn.create_function('REVERSE', 1, _reverse, deterministic=True)
+    conn.create_function('LAST_INSERT_ID', -1, last_insert_id)
+    # Typo-tolerant name search (see search.py)
+    conn.create_function('NAME_SIMILARITY', 2, name_similarity, deterministic=True)
+
+# ============== SQL TRANSLATION ==============
+
+def _split_statements(sql):
+    """Split a multi-statement query on semicolons outside string literals"""
+    statements, start, quoted = [], 0, False
+    for i, char in enumerate(sql):
+        if char == "'":
+            quoted = not quoted
+        elif char == ';' and not quoted:
+            statements.append(sql[start:i])
+            start = i + 1
+    statements.append(sql[start:])
+    return [statement for statement in statements if statement.strip()]
+
+@lru_cache(maxsize=1024)
+def translate(sql):
+    """Translate a pymysql-style query into SQLite statements.
+
+    Returns a tuple of (statement, placeholder_count, is_write, locks) where
+    ``locks`` marks a SELECT ... FOR UPDATE.
+    """
+    translated = []
+    for statement in _split_statements(sql):
+        count = 0
+
+        def placeholder(match):
+            nonlocal count
+            if match.group(1):
+                return f":{match.group(1)}"
+            if match.group(0) == '%s':
+                count += 1
+                return '?'
+            if match.group(0) == '%%':
+                return '%'
+            return match.group(0)
+
+        statement = _PLACEHOLDER.sub(placeholder, statement)
+        statement = re.sub(r'\bINSERT\s+IGNORE\b', 'INSERT OR IGNORE', statement, flags=re.IGNORECASE)
+        statement = re.sub(r'\bIF\s*\(', 'iif(', statement)
+        statement = statement.replace('<=>', ' IS ')
+        locks = bool(_FOR_UPDATE.search(statement))
+        if locks:
+            statement = _FOR_UPDATE.sub('', statement)
+        keyword = statement.lstrip().split(None, 1)[0].upper()
+        translated.append((statement, count, keyword not in _READ_STATEMENTS, locks))
+    return tuple(translated)
+
+def _translate_error(e):
+    message = str(e)
+    if isinstance(e, sqlite3.IntegrityError):
+        return pymysql.err.IntegrityError(1062, message)
+    if isinstance(e, sqlite3.OperationalError):
+        return pymysql.err.OperationalError(1205 if 'locked' in message else 1064, message)
+    return pymysql.err.DatabaseError(0, message)
+
+# ============== CONNECTION ==============
+
+class SQLiteCursor:
+    """DictCursor-like cursor over a sqlite3 connection"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self._cursor = connection._conn.cursor()
+        self._results = []
+        self._current = []
+        self._position = 0
+        self.rowcount = -1
+        self.lastrowid = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._cursor.close()
+
+    def _run(self, statement, params, is_write, locks):
+        if (is_write or locks) and not self.connection.in_transaction:
+            self._cursor.execute('BEGIN IMMEDIATE')
+        self._cursor.execute(statement, params)
+        if self._cursor.description is None:
+            self.rowcount = self._cursor.rowcount
+            self.lastrowid = self._cursor.lastrowid
+            return []
+        names = [column[0] for column in self._cursor.description]
+        rows = [dict(zip(names, row)) for row in self._cursor.fetchall()]
+        self.rowcount = len(rows)
+        return rows
+
+    def execute(self, sql, params=None):
+        statements = translate(sql)
+        if params is None:
+            params = ()
+        started = time.perf_counter()
+        try:
+            if len(statements) == 1:
+                statement, _, is_write, locks = statements[0]
+                self._results = [self._run(statement, params, is_write, locks)]
+            elif not self.connection.multi_statements:
+                # As MySQL does for a connection without CLIENT.MULTI_STATEMENTS
+                raise pymysql.err.ProgrammingError(
+                    1064, 'Multiple statements are not allowed on this connection')
+            else:
+                # Positional params are handed to each statement in turn
+                results, offset = [], 0
+                for statement, count, is_write, locks in statements:
+                    results.append(self._run(statement, tuple(params[offset:offset + count]),
+                                             is_write, locks))
+                    offset += count
+                self._results = results
+        except sqlite3.Error as e:
+            raise _translate_error(e) from e
+        finally:
+            if config.METRICS_ENABLED:
+                metrics.observe_query(sql, time.perf_counter() - started, self.rowcount)
+        self._current = self._results.pop(0)
+        self._position = 0
+        return self.rowcount
+
+    def executemany(self, sql, seq_of_params):
+        (statement, _, is_write, locks), = translate(sql)
+        started = time.perf_counter()
+        try:
+            if not self.connection.in_transaction:
+                self._cursor.execute('BEGIN IMMEDIATE')
+            self._cursor.executemany(statement, seq_of_params)
+        except sqlite3.Error as e:
+            raise _translate_error(e) from e
+        finally:
+            self.rowcount = self._cursor.rowcount
+            if config.METRICS_ENABLED:
+                metrics.observe_query(sql, time.perf_counter() - started, self.rowcount)
+        self._results, self._current, self._position = [], [], 0
+        return self.rowcount
+
+    def fetchone(self):
+        if self._position >= len(self._current):
+            return None
+        row = self._current[self._position]
+        self._position += 1
+        return row
+
+    def fetchmany(self, size):
+        rows = self._current[self._position:self._position + size]
+        self._position += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._current[self._position:]
+        self._position = len(self._current)
+        return rows
+
+    def nextset(self):
+        if not self._results:
+            return None
+        self._current = self._results.pop(0)
+        self._position = 0
+        return True
+
+
+class SQLiteStreamCursor(SQLiteCursor):
+    """SSCursor-like cursor: rows are stepped out of SQLite as they are fetched"""
+
+    def execute(self, sql, params=None):
+        (statement, _, _, _), = translate(sql)
+        started = time.perf_counter()
+        try:
+            self._cursor.execute(statement, params or ())
+        except sqlite3.Error as e:
+            raise _translate_error(e) from e
+        finally:
+            if config.METRICS_ENABLED:
+                metrics.observe_query(sql, time.perf_counter() - started, None)
+        self._names = [column[0] for column in self._cursor.description or ()]
+        return 0
+
+    def fetchone(self):
+        rows = self.fetchmany(1)
+        return rows[0] if rows else None
+
+    def fetchmany(self, size):
+        try:
+            return [dict(zip(self._names, row)) for row in self._cursor.fetchmany(size)]
+        except sqlite3.Error as e:
+            raise _translate_error(e) from e
+
+    def fetchall(self):
+        rows = []
+        while batch := self.fetchmany(1000):
+            rows.extend(batch)
+        return rows
+
+    def nextset(self):
+        return None
+
+
+class SQLiteConnection:
+    """The subset of the pymysql connection API used by the app and the pool"""
+
+    def __init__(self, path, timeout, multi_statements=False):
+        self.multi_statements = multi_statements
+        self._conn = sqlite3.connect(
+            path,
+            timeout=timeout,
+            # Autocommit mode: SQLiteCursor starts transactions itself
+            isolation_level=None,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            # The pool hands a connection to one thread at a time
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE
+        )
+        self._state = {}
+        _register_functions(self._conn, self._state)
+        self._conn.execute('PRAGMA journal_mode = WAL')
+        self._conn.execute('PRAGMA synchronous = NORMAL')
+        self._conn.execute('PRAGMA foreign_keys = ON')
+
+    @property
+    def in_transaction(self):
+        return self._conn.in_transaction
+
+    def cursor(self, cursorclass=None):
+        if cursorclass is not None and issubclass(cursorclass, pymysql.cursors.SSCursor):
+            return SQLiteStreamCursor(self)
+        return SQLiteCursor(self)
+
+    def commit(self):
+        if self._conn.in_transaction:
+            self._conn.execute('COMMIT')
+
+    def rollback(self):
+        if self._conn.in_transaction:
+            self._conn.execute('ROLLBACK')
+
+    def ping(self, reconnect=False):
+        self._conn.execute('SELECT 1')
+
+    def close(self):
+        self._conn.close()
+
+
+def connect(multi_statements=False):
+    """Open a connection to the DB_SQLITE_PATH database"""
+    return SQLiteConnection(config.DB_SQLITE_PATH, config.DB_POOL_TIMEOUT, multi_statements)
+
+def init_database():
+    """Create the schema at its latest version and seed the ID sequence"""
+    from migrations import MIGRATIONS
+    from patient_ids import SEQUENCE_START
+
+    conn = connect()
+    try:
+        # executescript() commits first and runs the whole script in autocommit mode
+        conn._conn.executescript(f"BEGIN IMMEDIATE; {SCHEMA_SQL} COMMIT;")
+        with conn.cursor() as cursor:
+            cursor.execute("INSERT IGNORE INTO id_sequences (name, next_value) VALUES ('patient', %s)",
+                           (SEQUENCE_START,))
+            # The schema above already includes every migration
+            cursor.executemany("INSERT IGNORE INTO schema_migrations (version, name) VALUES (%s, %s)",
+                               [(version, name) for version, name, _ in MIGRATIONS])
+        conn.commit()
+        print(f"SQLite database ready at {config.DB_SQLITE_PATH}")
+    finally:
+        conn.close()
@@ -0,0 +1,50 @@
+"""Shared fixtures: every test runs against a throwaway SQLite database.
+
+The settings are environment variables read when config is first imported,
+so they are set here before any backend module is loaded.
+"""
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+_tmpdir = tempfile.mkdtemp(prefix='emr-tests-')
+os.environ.update({
+    'DB_BACKEND': 'sqlite',
+    'DB_SQLITE_PATH': os.path.join(_tmpdir, 'emr.sqlite3'),
+    'ARCHIVE_INTERVAL': '0',
+    'CACHE_BACKEND': 'memory',
+    'METRICS_ENABLED': 'False',
+})
+
+import database  # noqa: E402
+
+
+@pytest.fixture(scope='session', autouse=True)
+def db():
+    database.init_database()
+    return os.environ['DB_SQLITE_PATH']
+
+@pytest.fixture(scope='session')
+def app():
+    from app import create_app
+    return create_app()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def make_patient(client):
+    """Create a patient with a unique MR number; returns its id"""
+    def make(**fields):
+        body = {'mrNumber': f"T{uuid.uuid4().hex[:10]}", 'name': 'Test Patient', **fields}
+        response = client.post('/api/patients', json=body)
+        assert response.status_code == 201, response.json
+        return response.json['id']
+    return make
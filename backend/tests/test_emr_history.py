@@ -0,0 +1,94 @@
+import copy
+import json
+
+import pytest
+
+from config import config
+from emr_history import apply_delta, json_delta
+
+DOCUMENTS = [
+    ({}, {}),
+    ({'a': 1}, {'a': 2}),
+    ({'a': 1, 'b': 2}, {'a': 1}),
+    ({'a': 1}, {'a': 1, 'b': {'c': [1, 2]}}),
+    ({'a': {'b': {'c': 1, 'd': 2}}}, {'a': {'b': {'c': 1, 'e': None}}}),
+    ({'a': None}, {'a': {'b': 1}}),
+    ({'a': {'b': 1}}, {'a': None}),
+    ({'a': [1, {'b': 2}]}, {'a': [1, {'b': 3}, 4]}),
+    ({'a': {'b': 1}}, {'a': [1]}),
+    ({'re': {'sph': '-1.25', 'cyl': ''}, 'le': {'sph': '0'}},
+     {'re': {'sph': '-1.50'}, 'le': {'sph': '0', 'axis': '90'}, 'notes': 'dilated'}),
+    ([1, 2], {'a': 1}),
+    ({'a': 1}, 'text'),
+]
+
+
+@pytest.mark.parametrize('old,new', DOCUMENTS)
+def test_delta_round_trip(old, new):
+    delta = json_delta(old, new)
+    # Deltas are stored as JSON, so they must survive a round trip through it
+    delta = json.loads(json.dumps(delta))
+    assert apply_delta(copy.deepcopy(old), delta) == new
+
+def test_unchanged_document_has_empty_delta():
+    doc = {'a': {'b': [1, 2]}, 'c': None}
+    assert json_delta(doc, copy.deepcopy(doc)) == {'set': [], 'unset': []}
+
+def test_deleted_key_is_unset_not_nulled():
+    assert json_delta({'a': 1, 'b': {'c': 1}}, {'b': {}}) == {'set': [], 'unset': [['a'], ['b', 'c']]}
+
+
+def section_data(version):
+    """A document that changes a little at every version, as form edits do"""
+    data = {'examData': {'re': {'disc': f'cdr 0.{version}'}, 'le': {'disc': 'cdr 0.3'}},
+            'notes': ['seen'] * version,
+            # Unchanged bulk, so that a delta is smaller than a snapshot
+            'findings': {f'field{i}': 'within normal limits' for i in range(20)}}
+    if version % 2:
+        data['examData']['re']['note'] = None
+    else:
+        data['extra'] = {'flag': True}
+    return data
+
+def save(client, patient_id, data):
+    response = client.post(f'/api/patients/{patient_id}/emr/fundusexam',
+                           json={'data': data, 'createdBy': 'Dr. Test'})
+    assert response.status_code in (200, 201), response.json
+
+def version(client, patient_id, number):
+    response = client.get(f'/api/patients/{patient_id}/emr/fundusexam/history/{number}')
+    assert response.status_code == 200, response.json
+    return response.json
+
+def test_rebuild_across_snapshot_boundary(client, make_patient, monkeypatch):
+    monkeypatch.setattr(config, 'EMR_SNAPSHOT_INTERVAL', 3)
+    patient_id = make_patient()
+    for number in range(1, 9):
+        save(client, patient_id, section_data(number))
+
+    history = client.get(f'/api/patients/{patient_id}/emr/fundusexam/history').json
+    kinds = {entry['version']: entry['kind'] for entry in history}
+    assert kinds[1] == 'snapshot'
+    assert kinds[3] == kinds[6] == 'snapshot'
+    assert all(kinds[number] == 'delta' for number in (2, 4, 5, 7, 8))
+
+    for number in range(1, 9):
+        entry = version(client, patient_id, number)
+        assert entry['deleted'] is False
+        assert entry['data'] == section_data(number)
+
+def test_delete_is_a_version(client, make_patient):
+    patient_id = make_patient()
+    save(client, patient_id, section_data(1))
+    save(client, patient_id, section_data(2))
+    assert client.delete(f'/api/patients/{patient_id}/emr/fundusexam').status_code == 200
+    save(client, patient_id, section_data(4))
+    save(client, patient_id, section_data(5))
+
+    assert version(client, patient_id, 2)['data'] == section_data(2)
+    deleted = version(client, patient_id, 3)
+    assert deleted['deleted'] is True and deleted['data'] is None
+    # The first save after a delete starts a new chain from a snapshot
+    assert version(client, patient_id, 4)['data'] == section_data(4)
+    assert version(client, patient_id, 5)['data'] == section_data(5)
+    assert client.get(f'/api/patients/{patient_id}/emr/fundusexam/history/6').status_code == 404
@@ -0,0 +1,77 @@
+import multiprocessing
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from patient_ids import ID_PREFIX, IdAllocator, reserve_block
+
+fork = pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(),
+                          reason='needs the fork start method')
+
+
+def id_value(patient_id):
+    return int(patient_id[len(ID_PREFIX):])
+
+def allocate(allocator, count, threads):
+    with ThreadPoolExecutor(threads) as pool:
+        return list(pool.map(lambda _: allocator.next_id(), range(count)))
+
+def test_threads_get_unique_ids():
+    # A small block makes the threads race for new blocks as well as within one
+    allocator = IdAllocator(block_size=7)
+    ids = allocate(allocator, 2000, threads=16)
+    assert len(set(ids)) == len(ids)
+
+def test_blocks_are_reserved_once_per_block_size():
+    calls = []
+
+    def reserve(name, size):
+        calls.append(size)
+        return reserve_block(name, size)
+
+    allocator = IdAllocator(block_size=50, reserve=reserve)
+    allocate(allocator, 500, threads=8)
+    assert calls == [50] * 10
+
+def test_allocators_share_the_sequence():
+    first, second = IdAllocator(block_size=10), IdAllocator(block_size=10)
+    ids = [allocator.next_id() for _ in range(25) for allocator in (first, second)]
+    assert len(set(ids)) == len(ids)
+
+
+def _allocate_in_child(args):
+    count, threads = args
+    return allocate(IdAllocator(block_size=13), count, threads)
+
+@fork
+def test_processes_get_unique_ids():
+    context = multiprocessing.get_context('fork')
+    with context.Pool(4) as pool:
+        results = pool.map(_allocate_in_child, [(500, 8)] * 4)
+    ids = [patient_id for result in results for patient_id in result]
+    # And none of them collides with IDs handed out in this process meanwhile
+    ids += allocate(IdAllocator(block_size=13), 500, threads=8)
+    assert len(ids) == 2500
+    assert len(set(ids)) == len(ids)
+
+def _next_id_in_child(allocator, conn):
+    conn.send(allocator.next_id())
+    conn.close()
+
+@fork
+def test_forked_process_reserves_its_own_block():
+    allocator = IdAllocator(block_size=100)
+    first = id_value(allocator.next_id())
+
+    context = multiprocessing.get_context('fork')
+    receiver, sender = context.Pipe(duplex=False)
+    child = context.Process(target=_next_id_in_child, args=(allocator, sender))
+    child.start()
+    child_id = id_value(receiver.recv())
+    child.join(10)
+    assert child.exitcode == 0
+
+    # The child inherited the parent's half-used block but must not draw from it
+    assert not first <= child_id < first + 100
+    assert id_value(allocator.next_id()) == first + 1
@@ -0,0 +1,77 @@
+import base64
+import json
+import uuid
+from datetime import datetime
+
+import pytest
+
+from app import decode_cursor, encode_cursor
+from database import db_connection
+
+
+@pytest.fixture
+def clinic():
+    """A clinic name no other test uses, to filter the shared queue down to one test's patients"""
+    return f"Q{uuid.uuid4().hex[:8]}"
+
+def set_created_at(patient_ids, created_at):
+    with db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.executemany("UPDATE patients SET created_at = %s WHERE id = %s",
+                               [(created_at, patient_id) for patient_id in patient_ids])
+            conn.commit()
+
+def read_queue(client, limit, **filters):
+    """Follow next_cursor to the end; returns the pages' patient ids"""
+    pages, cursor = [], None
+    while True:
+        params = {'view': 'queue', 'limit': limit, **filters}
+        if cursor:
+            params['cursor'] = cursor
+        response = client.get('/api/patients', query_string=params)
+        assert response.status_code == 200, response.json
+        pages.append([patient['id'] for patient in response.json['patients']])
+        cursor = response.json['next_cursor']
+        if cursor is None:
+            return pages
+
+def test_cursor_round_trip():
+    created_at = datetime(2024, 5, 1, 9, 30, 15)
+    assert decode_cursor(encode_cursor(created_at, 'P1000001')) == (created_at, 'P1000001')
+
+def test_pages_cover_ties_on_created_at(client, make_patient, clinic):
+    # Three patients share one timestamp and straddle page boundaries
+    older = [make_patient(clinic=clinic) for _ in range(2)]
+    tied = [make_patient(clinic=clinic) for _ in range(3)]
+    newest = [make_patient(clinic=clinic)]
+    set_created_at(older, datetime(2024, 1, 1, 8, 0, 0))
+    set_created_at(tied, datetime(2024, 1, 1, 9, 0, 0))
+    set_created_at(newest, datetime(2024, 1, 1, 10, 0, 0))
+
+    pages = read_queue(client, 2, last_clinic=clinic)
+    assert [len(page) for page in pages] == [2, 2, 2]
+    ids = [patient_id for page in pages for patient_id in page]
+    # Newest first, ties broken by id descending, nothing skipped or repeated
+    expected = newest + sorted(tied, reverse=True) + sorted(older, reverse=True)
+    assert ids == expected
+
+def test_exactly_full_page_has_no_cursor(client, make_patient, clinic):
+    patients = [make_patient(clinic=clinic) for _ in range(2)]
+    set_created_at(patients, datetime(2024, 1, 1, 9, 0, 0))
+    assert read_queue(client, 2, last_clinic=clinic) == [sorted(patients, reverse=True)]
+
+def encoded(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode()
+
+@pytest.mark.parametrize('cursor', [
+    'not-a-cursor',
+    base64.urlsafe_b64encode(b'not json').decode(),
+    encoded(['2024-01-01T09:00:00']),
+    encoded({'created_at': '2024-01-01T09:00:00', 'id': 'P1'}),
+    encoded(['yesterday', 'P1000001']),
+    encoded([None, 'P1000001']),
+])
+def test_malformed_cursor_is_rejected(client, cursor):
+    response = client.get('/api/patients', query_string={'view': 'queue', 'cursor': cursor})
+    assert response.status_code == 400
+    assert response.json == {'error': 'Invalid cursor'}
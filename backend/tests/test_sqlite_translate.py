@@ -0,0 +1,66 @@
+import sqlite3
+
+import pytest
+
+import sqlite_storage
+from sqlite_storage import translate
+
+# (MySQL query, [(SQLite statement, placeholder count, is_write, locks), ...])
+CASES = [
+    # Placeholders
+    ("SELECT * FROM patients WHERE id = %s AND name = %s",
+     [("SELECT * FROM patients WHERE id = ? AND name = ?", 2, False, False)]),
+    ("SELECT * FROM patients WHERE id = %(id)s",
+     [("SELECT * FROM patients WHERE id = :id", 0, False, False)]),
+    ("SELECT DATE_FORMAT(d, '%s'), 100 %% 7 FROM t WHERE a = %s",
+     [("SELECT DATE_FORMAT(d, '%s'), 100 % 7 FROM t WHERE a = ?", 1, False, False)]),
+    ("SELECT 'it''s %s' AS s", [("SELECT 'it''s %s' AS s", 0, False, False)]),
+    # IF() -> iif(), leaving IFNULL() alone
+    ("SELECT IF(is_active, 'yes', 'no') FROM medical_alerts",
+     [("SELECT iif(is_active, 'yes', 'no') FROM medical_alerts", 0, False, False)]),
+    ("SELECT IF (a > 1, IF(b, 1, 2), 3)", [("SELECT iif(a > 1, iif(b, 1, 2), 3)", 0, False, False)]),
+    ("SELECT IFNULL(a, 0)", [("SELECT IFNULL(a, 0)", 0, False, False)]),
+    # INSERT IGNORE -> INSERT OR IGNORE, in any case
+    ("INSERT IGNORE INTO id_sequences (name, next_value) VALUES (%s, %s)",
+     [("INSERT OR IGNORE INTO id_sequences (name, next_value) VALUES (?, ?)", 2, True, False)]),
+    ("insert  ignore into t (a) values (%s)", [("INSERT OR IGNORE into t (a) values (?)", 1, True, False)]),
+    # Null-safe equality
+    ("SELECT * FROM t WHERE a <=> %s", [("SELECT * FROM t WHERE a  IS  ?", 1, False, False)]),
+    # FOR UPDATE is dropped but marks the read as locking
+    ("SELECT version FROM emr_records WHERE patient_id = %s FOR UPDATE",
+     [("SELECT version FROM emr_records WHERE patient_id = ?", 1, False, True)]),
+    ("SELECT id FROM visits\n    LIMIT %s\n    for update\n",
+     [("SELECT id FROM visits\n    LIMIT ?", 1, False, True)]),
+    # Statement kinds
+    ("UPDATE patients SET version = version + 1 WHERE id = %s",
+     [("UPDATE patients SET version = version + 1 WHERE id = ?", 1, True, False)]),
+    ("DELETE FROM t WHERE id = %s", [("DELETE FROM t WHERE id = ?", 1, True, False)]),
+    ("WITH x AS (SELECT 1) SELECT * FROM x", [("WITH x AS (SELECT 1) SELECT * FROM x", 0, False, False)]),
+    ("EXPLAIN SELECT 1", [("EXPLAIN SELECT 1", 0, False, False)]),
+    # Multi-statement queries split outside string literals
+    ("SELECT * FROM a WHERE id = %s; SELECT * FROM b WHERE x = ';' AND id = %s;",
+     [("SELECT * FROM a WHERE id = ?", 1, False, False),
+      (" SELECT * FROM b WHERE x = ';' AND id = ?", 1, False, False)]),
+]
+
+
+@pytest.mark.parametrize('sql,expected', CASES)
+def test_translate(sql, expected):
+    assert list(translate(sql)) == expected
+
+def test_translated_statements_run():
+    """Every translation that needs no real tables is valid SQLite"""
+    conn = sqlite3.connect(':memory:')
+    sqlite_storage._register_functions(conn, {})
+    conn.execute("CREATE TABLE t (a, b)")
+    for sql, params in [
+        ("SELECT IF(%s > 1, 'big', 'small') AS size", (2,)),
+        ("SELECT IF(%s, IFNULL(%s, 0), 3)", (0, None)),
+        ("INSERT IGNORE INTO t (a, b) VALUES (%s, %s)", (1, None)),
+        ("SELECT a FROM t WHERE b <=> %s", (None,)),
+        ("SELECT a FROM t WHERE a = %s FOR UPDATE", (1,)),
+    ]:
+        (statement, count, _, _), = translate(sql)
+        assert count == len(params)
+        conn.execute(statement, params)
+    assert conn.execute(translate("SELECT a FROM t WHERE b <=> %s")[0][0], (None,)).fetchall() == [(1,)]
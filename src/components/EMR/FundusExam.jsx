@@ -1,4 +1,5 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
+import { createMergePatch, patchEmrRecord } from '../../services/api';
 import './FundusExam.css';
 
 const API_BASE = 'http://localhost:5000';
@@ -23,6 +24,8 @@ export default function FundusExam({ patient }) {
     const [isSaved, setIsSaved] = useState(false);
     const [loading, setLoading] = useState(true);
     const [savedAt, setSavedAt] = useState(null);
+    // Last data known to be on the server; later saves only send what changed
+    const savedData = useRef(null);
 
     useEffect(() => {
         if (patient?.id) {
@@ -36,6 +39,8 @@ export default function FundusExam({ patient }) {
             const result = await response.json();
 
             if (result.exists && result.data) {
+                // A copy, since the form edits some of these objects in place
+                savedData.current = JSON.parse(JSON.stringify(result.data));
                 setExamData(result.data.examData || examData);
                 setSpecialInvestigations(result.data.specialInvestigations || [{ name: '', reValue: '', leValue: '', dateTime: '' }]);
                 setIsSaved(true);
@@ -50,17 +55,30 @@ export default function FundusExam({ patient }) {
     };
 
     const handleSave = async () => {
+        const data = { examData, specialInvestigations };
         try {
-            const response = await fetch(`${API_BASE}/api/patients/${patient.id}/emr/fundusexam`, {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({
-                    data: { examData, specialInvestigations },
-                    createdBy: 'Dr. Chris Diana Pius'
-                })
-            });
+            let ok;
+            if (savedData.current) {
+                const patch = createMergePatch(savedData.current, data);
+                // Nothing changed since the last save: no request, no new version
+                if (Object.keys(patch).length > 0) {
+                    await patchEmrRecord(patient.id, 'fundusexam', patch, 'Dr. Chris Diana Pius');
+                }
+                ok = true;
+            } else {
+                const response = await fetch(`${API_BASE}/api/patients/${patient.id}/emr/fundusexam`, {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({
+                        data,
+                        createdBy: 'Dr. Chris Diana Pius'
+                    })
+                });
+                ok = response.ok;
+            }
 
-            if (response.ok) {
+            if (ok) {
+                savedData.current = JSON.parse(JSON.stringify(data));
                 setIsSaved(true);
                 setIsEditing(false);
                 setSavedAt(new Date().toISOString());
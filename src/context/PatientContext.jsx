@@ -1,4 +1,4 @@
-import React, { createContext, useContext, useState, useEffect, useCallback } from 'react';
+import React, { createContext, useContext, useState, useEffect, useCallback, useRef } from 'react';
 import { patients as initialPatients } from '../data/mockPatients';
 import * as api from '../services/api';
 
@@ -7,10 +7,18 @@ const PatientContext = createContext();
 // Check if backend is available
 const USE_BACKEND = true; // Set to false to use localStorage only
 
+// Patients per queue page; older ones are fetched as the queue is scrolled
+const QUEUE_PAGE_SIZE = 100;
+
 export function PatientProvider({ children }) {
     const [patients, setPatients] = useState([]);
     const [loading, setLoading] = useState(true);
     const [backendAvailable, setBackendAvailable] = useState(false);
+    // Cursor of the next, older queue page; null once the whole queue is loaded
+    const [nextCursor, setNextCursor] = useState(null);
+    const [loadingMore, setLoadingMore] = useState(false);
+    // Set synchronously, so a burst of scroll events fetches each page once
+    const fetchingMore = useRef(false);
 
     // Load patients on mount
     useEffect(() => {
@@ -22,14 +30,13 @@ export function PatientProvider({ children }) {
 
         if (USE_BACKEND) {
             try {
-                const response = await fetch('http://localhost:5000/api/patients');
-                if (response.ok) {
-                    const data = await response.json();
-                    setPatients(data);
-                    setBackendAvailable(true);
-                    setLoading(false);
-                    return;
-                }
+                // Start with the newest page; photos are loaded per patient
+                const data = await api.fetchPatientQueue({ limit: QUEUE_PAGE_SIZE });
+                setPatients(data.patients);
+                setNextCursor(data.next_cursor);
+                setBackendAvailable(true);
+                setLoading(false);
+                return;
             } catch (error) {
                 console.warn('Backend not available, falling back to localStorage/mock data');
             }
@@ -55,6 +62,42 @@ export function PatientProvider({ children }) {
         setLoading(false);
     };
 
+    // Append the next, older page of the queue
+    const loadMorePatients = useCallback(async () => {
+        if (!backendAvailable || !nextCursor || fetchingMore.current) return;
+        fetchingMore.current = true;
+        setLoadingMore(true);
+        try {
+            const data = await api.fetchPatientQueue({ cursor: nextCursor, limit: QUEUE_PAGE_SIZE });
+            setPatients(prev => {
+                // A patient pushed in by the change feed may already be listed
+                const seen = new Set(prev.map(p => p.id));
+                return [...prev, ...data.patients.filter(p => !seen.has(p.id))];
+            });
+            setNextCursor(data.next_cursor);
+        } catch (error) {
+            console.error('Error loading more patients:', error);
+        } finally {
+            fetchingMore.current = false;
+            setLoadingMore(false);
+        }
+    }, [backendAvailable, nextCursor]);
+
+    // Apply pushed queue changes instead of polling the patient list
+    useEffect(() => {
+        if (!backendAvailable) return undefined;
+        return api.subscribePatientChanges({
+            // Changes made before the stream went live are only in a fresh snapshot
+            onReady: () => loadPatients(),
+            onChange: ({ patient }) => {
+                if (!patient) return;
+                setPatients(prev => prev.some(p => p.id === patient.id)
+                    ? prev.map(p => p.id === patient.id ? { ...p, ...patient } : p)
+                    : [patient, ...prev]);
+            }
+        });
+    }, [backendAvailable]);
+
     // Save to localStorage when patients change (fallback mode)
     useEffect(() => {
         if (!backendAvailable && patients.length > 0) {
@@ -83,7 +126,7 @@ export function PatientProvider({ children }) {
     const updatePatient = async (id, updates) => {
         if (backendAvailable) {
             try {
-                await api.updatePatient(id, updates);
+                await api.patchPatient(id, updates);
                 await loadPatients();
                 return;
             } catch (error) {
@@ -102,18 +145,36 @@ export function PatientProvider({ children }) {
         return patients.find(p => p.mr_number === mrNumber || p.mrNumber === mrNumber);
     }, [patients]);
 
-    // Fetch patient with full details from backend
+    // Fetch patient with full details from backend. Queue rows lack details
+    // such as allergies and dob, so with a backend there is no local fallback.
     const fetchPatientDetails = async (id) => {
         if (backendAvailable) {
             try {
                 return await api.fetchPatientById(id);
             } catch (error) {
                 console.error('Error fetching patient details:', error);
+                return null;
             }
         }
         return getPatient(id);
     };
 
+    // Search by name, mobile number or MR number; the server ranks the matches
+    const searchPatients = async (query) => {
+        if (backendAvailable) {
+            try {
+                return (await api.searchPatients(query)).patients;
+            } catch (error) {
+                console.error('Error searching patients:', error);
+            }
+        }
+        const needle = query.trim().toLowerCase();
+        return patients.filter(p =>
+            (p.name || '').toLowerCase().includes(needle) ||
+            (p.mobile || '').endsWith(needle) ||
+            (p.mr_number || p.mrNumber || '').toLowerCase().startsWith(needle));
+    };
+
     // Check if MR number exists
     const checkMRExists = async (mrNumber) => {
         if (backendAvailable) {
@@ -145,12 +206,16 @@ export function PatientProvider({ children }) {
             patients,
             loading,
             backendAvailable,
+            hasMorePatients: backendAvailable && nextCursor != null,
+            loadingMore,
+            loadMorePatients,
             addPatient,
             updatePatient,
             getPatient,
             getPatientByMR,
             fetchPatientDetails,
             checkMRExists,
+            searchPatients,
             logVisit,
             refreshPatients: loadPatients
         }}>
@@ -16,7 +16,7 @@ import './PatientEMR.css';
 export default function PatientEMR() {
     const { patientId } = useParams();
     const navigate = useNavigate();
-    const { getPatient, fetchPatientDetails, logVisit } = usePatients();
+    const { getPatient, fetchPatientDetails, logVisit, backendAvailable } = usePatients();
 
     const [patient, setPatient] = useState(null);
     const [visitHistory, setVisitHistory] = useState([]);
@@ -67,8 +67,8 @@ export default function PatientEMR() {
                 }
                 setMedicalAlerts(alerts);
             } else {
-                // Fallback to local state
-                const p = getPatient(patientId);
+                // Local mode keeps full patients; a backend queue row is not a full chart
+                const p = backendAvailable ? null : getPatient(patientId);
                 if (p) {
                     setPatient(p);
                     setVisitCount(p.visitHistory?.length || 1);
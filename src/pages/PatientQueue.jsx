@@ -19,7 +19,7 @@ function getElapsedTime(checkInTimestamp) {
 
 export default function PatientQueue() {
     const navigate = useNavigate();
-    const { patients } = usePatients();
+    const { patients, searchPatients, hasMorePatients, loadingMore, loadMorePatients } = usePatients();
     const [activeTab, setActiveTab] = useState('All');
     const [currentTime, setCurrentTime] = useState(Date.now());
 
@@ -29,6 +29,37 @@ export default function PatientQueue() {
     const [mrInput, setMrInput] = useState('');
     const [error, setError] = useState('');
 
+    // Patient search: results replace the queue while a query is entered
+    const [searchQuery, setSearchQuery] = useState('');
+    const [searchResults, setSearchResults] = useState(null);
+
+    useEffect(() => {
+        const query = searchQuery.trim();
+        if (query.length < 2) {
+            setSearchResults(null);
+            return undefined;
+        }
+        let cancelled = false;
+        const timer = setTimeout(async () => {
+            const results = await searchPatients(query);
+            if (!cancelled) setSearchResults(results);
+        }, 250);
+        return () => {
+            cancelled = true;
+            clearTimeout(timer);
+        };
+    }, [searchQuery]);
+
+    const visiblePatients = searchResults ?? patients;
+
+    // Fetch older patients as the queue is scrolled near its end
+    const handleTableScroll = (e) => {
+        const { scrollTop, clientHeight, scrollHeight } = e.currentTarget;
+        if (!searchResults && scrollTop + clientHeight >= scrollHeight - 200) {
+            loadMorePatients();
+        }
+    };
+
     // Update elapsed time every minute
     useEffect(() => {
         const interval = setInterval(() => {
@@ -130,7 +161,12 @@ export default function PatientQueue() {
                     </div>
                     <button className="header-btn exam-btn">Doctor Exam</button>
                     <div className="header-search">
-                        <input type="text" placeholder="Patient Details" />
+                        <input
+                            type="text"
+                            placeholder="Patient Details"
+                            value={searchQuery}
+                            onChange={(e) => setSearchQuery(e.target.value)}
+                        />
                         <Search size={14} className="search-icon" />
                     </div>
                     <button className="waiting-list-btn">
@@ -201,7 +237,7 @@ export default function PatientQueue() {
             </div>
 
             {/* Patient Table */}
-            <div className="patient-table-container">
+            <div className="patient-table-container" onScroll={handleTableScroll}>
                 <table className="patient-table">
                     <thead>
                         <tr>
@@ -220,7 +256,7 @@ export default function PatientQueue() {
                         </tr>
                     </thead>
                     <tbody>
-                        {patients.map((patient, index) => (
+                        {visiblePatients.map((patient, index) => (
                             <tr
                                 key={patient.id}
                                 onClick={() => handlePatientClick(patient)}
@@ -271,6 +307,15 @@ export default function PatientQueue() {
                                 <td className="treatment-cell">{patient.lastTreatment || ''}</td>
                             </tr>
                         ))}
+                        {!searchResults && hasMorePatients && (
+                            <tr className="load-more-row">
+                                <td colSpan={12}>
+                                    <button className="load-more-btn" onClick={loadMorePatients} disabled={loadingMore}>
+                                        {loadingMore ? 'Loading...' : 'Load more patients'}
+                                    </button>
+                                </td>
+                            </tr>
+                        )}
                     </tbody>
                 </table>
             </div>
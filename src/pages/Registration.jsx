@@ -4,6 +4,8 @@ import { usePatients } from '../context/PatientContext';
 import { User, Camera, Menu, X, Search } from 'lucide-react';
 import './Registration.css';
 
+const API_BASE = 'http://localhost:5000';
+
 export default function Registration() {
     const navigate = useNavigate();
     const { addPatient, checkMRExists } = usePatients();
@@ -61,7 +63,9 @@ export default function Registration() {
                     allergies: result.patient.allergies || '',
                     conditions: result.patient.conditions || ''
                 });
-                if (result.patient.photo) {
+                if (result.patient.photo_url) {
+                    setPhoto(`${API_BASE}${result.patient.photo_url}`);
+                } else if (result.patient.photo) {
                     setPhoto(result.patient.photo);
                 }
                 alert('Existing patient found! Form has been pre-filled.');
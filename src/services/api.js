@@ -13,9 +13,110 @@ export async function fetchPatients() {
     }
 }
 
-export async function fetchPatientById(patientId) {
+// Fetch one page of the patient queue (no photos). Pass `cursor` from the
+// previous page's `next_cursor` to get the next page.
+export async function fetchPatientQueue({ status, assignedTo, lastClinic, cursor, limit = 50 } = {}) {
+    const params = new URLSearchParams({ view: 'queue', limit });
+    if (status) params.set('status', status);
+    if (assignedTo) params.set('assigned_to', assignedTo);
+    if (lastClinic) params.set('last_clinic', lastClinic);
+    if (cursor) params.set('cursor', cursor);
+    const response = await fetch(`${API_BASE_URL}/patients?${params}`);
+    if (!response.ok) throw new Error('Failed to fetch patient queue');
+    return await response.json();
+}
+
+// While the server has no stream free, poll this often (ms), and try the
+// stream again after STREAM_RETRY_MS
+const CHANGE_POLL_INTERVAL = 5000;
+const STREAM_RETRY_MS = 60000;
+
+// Subscribe to queue changes pushed by the server. `onReady(cursor)` fires
+// once the stream is live (load the queue snapshot then); `onChange(event)`
+// gets { cursor, type, patient_id, patient } with the patient's queue row;
+// `onReset()` means the snapshot is stale and must be reloaded. The browser
+// reconnects on its own and resumes from the last event it received. If the
+// server turns the stream away (it caps open streams), this polls
+// /patients/changes from the same cursor until a stream is free again.
+// Returns a function that closes the stream.
+export function subscribePatientChanges({ onReady, onChange, onReset }) {
+    let source;
+    let timer;
+    let cursor = null;
+    let closed = false;
+
+    const open = () => {
+        const query = cursor != null ? `?since=${encodeURIComponent(cursor)}` : '';
+        source = new EventSource(`${API_BASE_URL}/patients/changes/stream${query}`);
+        source.addEventListener('ready', (e) => {
+            cursor = JSON.parse(e.data).cursor;
+            if (onReady) onReady(cursor);
+        });
+        source.addEventListener('patient', (e) => {
+            cursor = e.lastEventId || cursor;
+            onChange(JSON.parse(e.data));
+        });
+        source.addEventListener('reset', () => {
+            // The resume cursor has expired: start over from a fresh snapshot
+            source.close();
+            cursor = null;
+            if (onReset) onReset();
+            open();
+        });
+        source.onerror = () => {
+            // A refused stream (503) closes for good; dropped ones reconnect
+            if (source.readyState === EventSource.CLOSED) poll(Date.now() + STREAM_RETRY_MS);
+        };
+    };
+
+    const poll = async (retryAt) => {
+        if (closed) return;
+        if (Date.now() >= retryAt) {
+            open();
+            return;
+        }
+        let hasMore = false;
+        try {
+            const result = await fetchPatientChanges(cursor);
+            if (result.expired) {
+                cursor = null;
+                if (onReset) onReset();
+            } else {
+                // Without a cursor this only fetched the current one: snapshot now
+                if (cursor == null && onReady) onReady(result.cursor);
+                result.events.forEach(onChange);
+                cursor = result.cursor;
+                hasMore = result.has_more;
+            }
+        } catch (error) {
+            console.warn('Error polling patient changes:', error);
+        }
+        if (!closed) timer = setTimeout(() => poll(retryAt), hasMore ? 0 : CHANGE_POLL_INTERVAL);
+    };
+
+    open();
+    return () => {
+        closed = true;
+        clearTimeout(timer);
+        source.close();
+    };
+}
+
+// Fetch queue changes after `since` (polling alternative to the stream)
+export async function fetchPatientChanges(since) {
+    const query = since != null ? `?since=${encodeURIComponent(since)}` : '';
+    const response = await fetch(`${API_BASE_URL}/patients/changes${query}`);
+    if (response.status === 410) return { expired: true, events: [] };
+    if (!response.ok) throw new Error('Failed to fetch patient changes');
+    return await response.json();
+}
+
+// `include` selects related data loaded in the same request,
+// e.g. ['visits', 'alerts', 'emr'] to open a chart in one call.
+export async function fetchPatientById(patientId, include) {
     try {
-        const response = await fetch(`${API_BASE_URL}/patients/${patientId}`);
+        const query = include ? `?include=${include.join(',')}` : '';
+        const response = await fetch(`${API_BASE_URL}/patients/${patientId}${query}`);
         if (!response.ok) throw new Error('Failed to fetch patient');
         return await response.json();
     } catch (error) {
@@ -24,6 +125,15 @@ export async function fetchPatientById(patientId) {
     }
 }
 
+// Ranked search by partial name, mobile number ending or MR number.
+// Each result carries `match`, the kind of match it was ranked by.
+export async function searchPatients(query, { page = 1, limit = 20 } = {}) {
+    const params = new URLSearchParams({ q: query, page, limit });
+    const response = await fetch(`${API_BASE_URL}/patients/search?${params}`);
+    if (!response.ok) throw new Error('Failed to search patients');
+    return await response.json();
+}
+
 export async function checkMRExists(mrNumber) {
     try {
         const response = await fetch(`${API_BASE_URL}/patients/mr/${mrNumber}`);
@@ -65,6 +175,22 @@ export async function updatePatient(patientId, patientData) {
     }
 }
 
+// Update only the given fields; anything left out keeps its stored value
+export async function patchPatient(patientId, changes) {
+    try {
+        const response = await fetch(`${API_BASE_URL}/patients/${patientId}`, {
+            method: 'PATCH',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(changes)
+        });
+        if (!response.ok) throw new Error('Failed to update patient');
+        return await response.json();
+    } catch (error) {
+        console.error('Error updating patient:', error);
+        throw error;
+    }
+}
+
 // ============== VISIT API ==============
 
 export async function fetchVisitHistory(patientId) {
@@ -78,6 +204,16 @@ export async function fetchVisitHistory(patientId) {
     }
 }
 
+// One page of visits moved to the archive, newest first:
+// { visits: [...], next_cursor } where next_cursor is null on the last page
+export async function fetchArchivedVisits(patientId, { cursor, limit = 50 } = {}) {
+    const params = new URLSearchParams({ archived: 'true', limit });
+    if (cursor) params.set('cursor', cursor);
+    const response = await fetch(`${API_BASE_URL}/patients/${patientId}/visits?${params}`);
+    if (!response.ok) throw new Error('Failed to fetch archived visits');
+    return await response.json();
+}
+
 export async function logVisit(patientId, visitData) {
     try {
         const response = await fetch(`${API_BASE_URL}/patients/${patientId}/visits`, {
@@ -106,6 +242,15 @@ export async function fetchMedicalAlerts(patientId) {
     }
 }
 
+// One page of archived (inactive) alerts: { alerts: [...], next_cursor }
+export async function fetchArchivedAlerts(patientId, { cursor, limit = 50 } = {}) {
+    const params = new URLSearchParams({ archived: 'true', limit });
+    if (cursor) params.set('cursor', cursor);
+    const response = await fetch(`${API_BASE_URL}/patients/${patientId}/alerts?${params}`);
+    if (!response.ok) throw new Error('Failed to fetch archived alerts');
+    return await response.json();
+}
+
 export async function addMedicalAlert(patientId, alertData) {
     try {
         const response = await fetch(`${API_BASE_URL}/patients/${patientId}/alerts`, {
@@ -120,3 +265,49 @@ export async function addMedicalAlert(patientId, alertData) {
         throw error;
     }
 }
+
+// ============== EMR API ==============
+
+const isObject = (value) => value !== null && typeof value === 'object' && !Array.isArray(value);
+
+// Build a JSON merge patch (RFC 7396) that turns `saved` into `current`:
+// changed keys only, with null for removed keys. Arrays are sent whole.
+export function createMergePatch(saved, current) {
+    if (!isObject(saved) || !isObject(current)) return current;
+    const patch = {};
+    for (const key of Object.keys(saved)) {
+        if (!(key in current)) patch[key] = null;
+    }
+    for (const [key, value] of Object.entries(current)) {
+        if (isObject(value) && isObject(saved[key])) {
+            const nested = createMergePatch(saved[key], value);
+            if (Object.keys(nested).length > 0) patch[key] = nested;
+        } else if (JSON.stringify(value) !== JSON.stringify(saved[key])) {
+            patch[key] = value;
+        }
+    }
+    return patch;
+}
+
+// Apply a merge patch to a section's saved data on the server
+export async function patchEmrRecord(patientId, sectionType, patch, createdBy) {
+    const response = await fetch(`${API_BASE_URL}/patients/${patientId}/emr/${sectionType}`, {
+        method: 'PATCH',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ data: patch, createdBy })
+    });
+    if (!response.ok) throw new Error('Failed to update EMR record');
+    return await response.json();
+}
+
+// Save several sections (e.g. { Complaints: { data, ifMatch } }) and optionally
+// log the visit in one request; all of it is saved or none of it is
+export async function saveEmrRecords(patientId, sections, { createdBy, visit } = {}) {
+    const response = await fetch(`${API_BASE_URL}/patients/${patientId}/emr`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ sections, createdBy, visit })
+    });
+    if (!response.ok) throw new Error('Failed to save EMR records');
+    return await response.json();
+}